@@ -8,27 +8,111 @@
 # Source: based on your uploaded file. :contentReference[oaicite:1]{index=1}
 
 import os
+import sys
 import json
+import marshal
+import time
+_START = time.perf_counter()   # process start, for the startup timing report
+import heapq
+import queue
+import threading
 from datetime import datetime
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas as pdf_canvas
-from reportlab.lib.units import mm
-from reportlab.platypus import Table, TableStyle
-from reportlab.lib import colors
 
-import firebase_admin
-from firebase_admin import credentials, db
+# -------------------------
+# Lazy imports (reportlab, Firebase)
+# -------------------------
+# reportlab is only needed for bill/receipt PDFs and firebase_admin only
+# once something is synced, so neither is imported when the module loads.
+A4 = mm = colors = pdf_canvas = Table = TableStyle = None
+
+def load_reportlab():
+    """Import reportlab into the module globals on first use."""
+    global A4, mm, colors, pdf_canvas, Table, TableStyle
+    if pdf_canvas is None:
+        from reportlab.lib.pagesizes import A4
+        from reportlab.lib.units import mm
+        from reportlab.platypus import Table, TableStyle
+        from reportlab.lib import colors
+        from reportlab.pdfgen import canvas as pdf_canvas
+
+FIREBASE_KEY_FILE = "firebase_key.json"
+FIREBASE_URL = "https://inventory-677b9-default-rtdb.firebaseio.com/"
+_firebase_lock = threading.Lock()
+_firebase_db = None
+
+def init_firebase():
+    """Import firebase_admin and initialize the app (once, thread-safe); returns firebase_admin.db."""
+    global _firebase_db
+    with _firebase_lock:
+        if _firebase_db is None:
+            import firebase_admin
+            from firebase_admin import credentials, db
+            try:
+                firebase_admin.get_app()
+            except ValueError:
+                firebase_admin.initialize_app(credentials.Certificate(FIREBASE_KEY_FILE),
+                                              {"databaseURL": FIREBASE_URL})
+            _firebase_db = db
+            startup_mark("firebase")
+    return _firebase_db
+
+def init_firebase_in_background():
+    """
+    Run init_firebase() on a daemon thread, then log the startup report.
+    A failure (offline, missing key) is left for the first sync to report.
+    """
+    def run():
+        try:
+            init_firebase()
+        except Exception:
+            pass
+        save_startup_report()
+    threading.Thread(target=run, name="firebase-init", daemon=True).start()
 
 # -------------------------
-# Firebase Setup
+# Startup timing
 # -------------------------
-cred = credentials.Certificate("firebase_key.json")
+STARTUP_LOG_FILE = "startup_times.jsonl"
+_startup_marks = {}
+
+def startup_mark(name):
+    """Seconds since process start at which `name` happened (first call wins)."""
+    return _startup_marks.setdefault(name, round(time.perf_counter() - _START, 4))
 
-firebase_admin.initialize_app(cred, {
-    "databaseURL": "https://inventory-677b9-default-rtdb.firebaseio.com/"
-})
+def save_startup_report(path=STARTUP_LOG_FILE):
+    """Append this run's marks as one JSON line (frozen = PyInstaller build)."""
+    entry = {"at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+             "frozen": bool(getattr(sys, "frozen", False)), **_startup_marks}
+    try:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+    except OSError:
+        pass
+    return entry
+
+def startup_report(path=STARTUP_LOG_FILE, last=20):
+    """Median and latest seconds per mark over the last `last` logged runs."""
+    runs = []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    runs.append(json.loads(line))
+                except ValueError:
+                    continue
+    except OSError:
+        return "No startup runs logged yet."
+    runs = runs[-last:]
+    if not runs:
+        return "No startup runs logged yet."
+    names = sorted((k for k in runs[-1] if k not in ("at", "frozen")), key=runs[-1].get)
+    lines = [f"{len(runs)} runs, latest {runs[-1]['at']}" + (" (frozen)" if runs[-1].get("frozen") else "")]
+    for name in names:
+        vals = sorted(r[name] for r in runs if isinstance(r.get(name), (int, float)))
+        lines.append(f"  {name:<12} median {vals[len(vals) // 2]:.3f}s  latest {runs[-1][name]:.3f}s")
+    return "\n".join(lines)
 
 # -------------------------
 # Constants / filenames
@@ -37,58 +121,1400 @@ PURCHASE_FILE = "purchase.json"
 SALE_FILE = "sale.json"
 STOCK_FILE = "stock.json"
 LEDGER_FILE = "ledger.json"
+STOCK_STATE_FILE = "stock_state.json"
+# data files people open by hand keep indent=2; derived state is written compact
+READABLE_FILES = (PURCHASE_FILE, SALE_FILE, STOCK_FILE, LEDGER_FILE)
 RECEIPTS_DIR = "receipts"
 BILLS_DIR = "bills"
 
+# -------------------------
+# Storage backends
+# -------------------------
+# "json" keeps the original whole-file documents, "sqlite" stores invoices,
+# product lines and ledger transactions as indexed rows in DB_FILE,
+# "eventlog" appends purchase/sale changes to EVENT_LOG_FILE.
+STORAGE_BACKEND = os.environ.get("INVENTORY_STORAGE", "json")
+DB_FILE = "inventory.db"
+EVENT_LOG_FILE = "events.jsonl"
+EVENT_SNAPSHOT_FILE = "events_snapshot.json"
+EVENT_COMPACT_EVERY = 1000
+
+INVOICE_FILES = {PURCHASE_FILE: "purchase", SALE_FILE: "sale"}
+
+def _default_for(fn):
+    return [] if fn != LEDGER_FILE else {}
+
+def _file_signature(fn):
+    """(size, mtime_ns) of a file, or None if it doesn't exist."""
+    try:
+        st = os.stat(fn)
+        return [st.st_size, st.st_mtime_ns]
+    except OSError:
+        return None
+
+JOURNAL_FILE = "journal.jsonl"
+JOURNAL_COMPACT_EVERY = 200
+
+def _atomic_write_json(fn, data, indent=2):
+    """Write JSON to a temp file, fsync it and rename it over fn (never leaves fn half-written)."""
+    tmp = fn + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=indent, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, fn)
+
+def _record_id(r):
+    return r.id if type(r) is Invoice else r.get("id")
+
+def _apply_record_op(recs, op, rec=None, rec_id=None):
+    """
+    Apply one insert/update/delete to a record list (of dicts, or of Invoice
+    in the repository cache). Idempotent, so journals can be replayed.
+    """
+    if op == "delete":
+        return [r for r in recs if _record_id(r) != rec_id]
+    rid = _record_id(rec)
+    for i, r in enumerate(recs):
+        if _record_id(r) == rid:
+            recs[i] = rec
+            return recs
+    recs.append(rec)
+    return recs
+
+# -------------------------
+# Columnar invoice format
+# -------------------------
+# Optional compact encoding of purchase/sale history (INVENTORY_FORMAT=columnar):
+# one column per record key and per product-line key, so keys are stored
+# once per file instead of once per line. Numbers go in typed little-endian
+# arrays, strings are interned in one table and stored as indices.
+INVOICE_FORMAT = os.environ.get("INVENTORY_FORMAT", "json")
+COLUMNAR_SUFFIX = ".col"
+COLUMNAR_MAGIC = b"INVCOL1\n"
+
+def _columnar_path(fn):
+    return os.path.splitext(fn)[0] + COLUMNAR_SUFFIX
+
+def _column_type(values):
+    """'i' int64, 'd' float64, 's' interned string, 'j' JSON (mixed / nested / bool / None)."""
+    types = {type(v) for v in values}
+    if types == {int} and all(-2**63 <= v < 2**63 for v in values):
+        return "i"
+    if types == {float}:
+        return "d"
+    if types == {str}:
+        return "s"
+    return "j"
+
+def _encode_columns(rows, strings, interned, blobs, offset):
+    """Column specs for a list of dicts; appends each column's bytes to blobs."""
+    from array import array
+    keys = {}
+    for row in rows:
+        for k in row:
+            keys.setdefault(k, None)
+    cols = []
+    for key in keys:
+        missing = [i for i, row in enumerate(rows) if key not in row]
+        values = [row[key] for row in rows if key in row]
+        kind = _column_type(values)
+        if missing and kind != "j":
+            # placeholders keep typed columns one value per row
+            fill = {"i": 0, "d": 0.0, "s": ""}[kind]
+            values = [row.get(key, fill) for row in rows]
+        if kind == "s":
+            idx = []
+            for v in values:
+                j = interned.get(v)
+                if j is None:
+                    j = interned[v] = len(strings)
+                    strings.append(v)
+                idx.append(j)
+            arr = array("I" if len(strings) < 2**32 else "Q", idx)
+            kind = "s" if arr.typecode == "I" else "S"
+        elif kind in ("i", "d"):
+            arr = array("q" if kind == "i" else "d", values)
+        else:
+            arr = None
+        if arr is not None:
+            if sys.byteorder != "little":
+                arr.byteswap()
+            data = arr.tobytes()
+        else:
+            data = json.dumps(values, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        cols.append([key, kind, offset, len(data), missing])
+        blobs.append(data)
+        offset += len(data)
+    return cols, offset
+
+def encode_invoices(recs):
+    """Encode a purchase/sale record list in the columnar format (bytes)."""
+    import struct
+    strings, interned, blobs = [], {}, []
+    lines, counts = [], []
+    heads = []
+    for rec in recs:
+        prods = rec.get("products")
+        if isinstance(prods, list) and all(isinstance(p, dict) for p in prods):
+            heads.append({k: v for k, v in rec.items() if k != "products"})
+            lines.extend(prods)
+            counts.append(len(prods))
+        else:
+            heads.append(rec)
+            counts.append(-1)
+    rec_cols, offset = _encode_columns(heads, strings, interned, blobs, 0)
+    line_cols, offset = _encode_columns(lines, strings, interned, blobs, offset)
+    count_cols, offset = _encode_columns([{"n": n} for n in counts], strings, interned, blobs, offset)
+    header = json.dumps({"records": len(recs), "lines": len(lines), "strings": strings,
+                         "record_cols": rec_cols, "line_cols": line_cols, "counts": count_cols[:1]},
+                        ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return COLUMNAR_MAGIC + struct.pack("<I", len(header)) + header + b"".join(blobs)
+
+def _decode_columns(buf, base, cols, count, strings):
+    from array import array
+    from itertools import repeat
+    keys, columns, missing = [], [], []
+    for key, kind, offset, size, miss in cols:
+        raw = buf[base + offset: base + offset + size]
+        if kind == "j":
+            values = json.loads(bytes(raw).decode("utf-8"))
+            if miss:
+                # JSON columns hold only present values: re-insert gaps
+                it, gaps = iter(values), set(miss)
+                values = [None if i in gaps else next(it) for i in range(count)]
+        else:
+            arr = array({"i": "q", "d": "d", "s": "I", "S": "Q"}[kind])
+            arr.frombytes(raw)
+            if sys.byteorder != "little":
+                arr.byteswap()
+            values = list(map(strings.__getitem__, arr)) if kind in ("s", "S") else arr.tolist()
+        keys.append(key)
+        columns.append(values)
+        if miss:
+            missing.append((key, miss))
+    rows = list(map(dict, map(zip, repeat(keys), zip(*columns)))) if columns else [{} for _ in range(count)]
+    for key, miss in missing:
+        for i in miss:
+            del rows[i][key]
+    return rows
+
+def decode_invoices(buf):
+    """Record list from encode_invoices() bytes (or a memoryview of them)."""
+    import gc
+    # building ~100k dicts would otherwise trigger repeated full GC passes
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _decode_invoices(buf)
+    finally:
+        if enabled:
+            gc.enable()
+
+def _decode_invoices(buf):
+    import struct
+    buf = memoryview(buf)
+    if bytes(buf[:len(COLUMNAR_MAGIC)]) != COLUMNAR_MAGIC:
+        raise ValueError("Not a columnar invoice file")
+    start = len(COLUMNAR_MAGIC) + 4
+    (hlen,) = struct.unpack("<I", buf[len(COLUMNAR_MAGIC):start])
+    header = json.loads(bytes(buf[start:start + hlen]).decode("utf-8"))
+    base, strings = start + hlen, header["strings"]
+    recs = _decode_columns(buf, base, header["record_cols"], header["records"], strings)
+    lines = _decode_columns(buf, base, header["line_cols"], header["lines"], strings)
+    counts = _decode_columns(buf, base, header["counts"], header["records"], strings)
+    pos = 0
+    for rec, c in zip(recs, counts):
+        n = c["n"]
+        if n >= 0:
+            rec["products"] = lines[pos:pos + n]
+            pos += n
+    return recs
+
+def write_columnar(path, recs):
+    """Atomic write of a record list in the columnar format."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(encode_invoices(recs))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def read_columnar(path):
+    with open(path, "rb") as f:
+        return decode_invoices(f.read())
+
+def convert_invoice_file(src, dst):
+    """
+    Convert purchase/sale history between JSON and the columnar format,
+    by extension (.json <-> .col). Returns the number of records.
+    """
+    if src.endswith(COLUMNAR_SUFFIX):
+        recs = read_columnar(src)
+    else:
+        with open(src, "r", encoding="utf-8") as f:
+            recs = json.load(f)
+    if dst.endswith(COLUMNAR_SUFFIX):
+        write_columnar(dst, recs)
+    else:
+        _atomic_write_json(dst, recs)
+    return len(recs)
+
+class JsonStorage:
+    """
+    Original storage: one JSON document per file. Whole-document saves are
+    atomic (temp file + fsync + rename). Single-record writes are appended to
+    JOURNAL_FILE instead of rewriting the file; the journal is replayed on
+    load and folded into the snapshots every JOURNAL_COMPACT_EVERY entries
+    and on startup (ensure). With columnar=True (INVENTORY_FORMAT=columnar)
+    the purchase/sale snapshots are kept as .col files instead; an existing
+    .json history is converted on the first ensure().
+    """
+    name = "json"
+
+    def __init__(self, journal_file=JOURNAL_FILE, compact_every=JOURNAL_COMPACT_EVERY, columnar=None):
+        self.journal_file = journal_file
+        self.compact_every = compact_every
+        self.columnar = INVOICE_FORMAT == "columnar" if columnar is None else columnar
+        self.pending = {}   # fn -> journal entries not yet in the snapshot
+        self.lock = threading.RLock()
+        self._read_journal()
+
+    # ---- journal ----
+    def _read_journal(self):
+        try:
+            with open(self.journal_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except Exception:
+                        continue    # torn last line after a crash
+                    if entry.get("fn") in INVOICE_FILES:
+                        self.pending.setdefault(entry["fn"], []).append(entry)
+        except OSError:
+            pass
+
+    def _rewrite_journal(self):
+        tmp = self.journal_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for entries in self.pending.values():
+                for entry in entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.journal_file)
+
+    def _append(self, entry):
+        if "rec" in entry:
+            entry["rec"] = DataRepository._copy(entry["rec"])   # not the caller's dict
+        with self.lock:
+            with open(self.journal_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.pending.setdefault(entry["fn"], []).append(entry)
+            # fold only this file, so the other file's signature (and state
+            # derived from it, see StockEngine / _DerivedStore) stays valid
+            if len(self.pending[entry["fn"]]) >= self.compact_every:
+                self.compact(entry["fn"])
+
+    def compact(self, fn=None):
+        """Fold journaled writes (of fn, or of every file) into the JSON snapshots."""
+        with self.lock:
+            names = [fn] if fn is not None else list(self.pending)
+            names = [n for n in names if self.pending.get(n)]
+            if not names:
+                return
+            for name in names:
+                self._write(name, self.load(name))
+                del self.pending[name]
+            self._rewrite_journal()
+
+    # ---- snapshot files ----
+    def path(self, fn):
+        """File that holds fn's snapshot (the .col file for columnar invoices)."""
+        return _columnar_path(fn) if self.columnar and fn in INVOICE_FILES else fn
+
+    def _read(self, fn):
+        path = self.path(fn)
+        if path != fn:
+            return read_columnar(path)
+        with open(fn, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write(self, fn, data):
+        path = self.path(fn)
+        if path != fn:
+            write_columnar(path, data)
+        else:
+            _atomic_write_json(fn, data, indent=2 if fn in READABLE_FILES else None)
+
+    # ---- storage API ----
+    def ensure(self):
+        for fn in (PURCHASE_FILE, SALE_FILE, STOCK_FILE, LEDGER_FILE):
+            if os.path.exists(self.path(fn)):
+                continue
+            if os.path.exists(fn):
+                convert_invoice_file(fn, self.path(fn))
+            else:
+                self._write(fn, _default_for(fn))
+        self.compact()
+
+    def load(self, fn):
+        with self.lock:
+            data = self._read(fn)
+            for entry in self.pending.get(fn, ()):
+                rec = entry.get("rec")
+                data = _apply_record_op(data, entry["op"], DataRepository._copy(rec) if rec else None, entry.get("id"))
+            return data
+
+    def save(self, fn, data):
+        with self.lock:
+            self._write(fn, data)
+            if self.pending.pop(fn, None):
+                self._rewrite_journal()
+
+    def insert_record(self, fn, rec):
+        self._append({"op": "insert", "fn": fn, "rec": rec})
+
+    def update_record(self, fn, rec):
+        self._append({"op": "update", "fn": fn, "rec": rec})
+
+    def delete_record(self, fn, rec_id):
+        self._append({"op": "delete", "fn": fn, "id": rec_id})
+
+    def signature(self, fn):
+        sig = _file_signature(self.path(fn))
+        if sig is None:
+            return None
+        with self.lock:
+            return sig + [len(self.pending.get(fn, ()))]
+
+class SqliteStorage:
+    """
+    Embedded SQLite storage. Purchases and sales live in `invoices` +
+    `product_lines`, the ledger in `ledger_parties` + `ledger_txns`, and any
+    other file (stock.json, engine state, ...) as a row in `documents`.
+    Every write runs in one transaction and only touches the rows that changed.
+    """
+    name = "sqlite"
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS invoices (
+        kind TEXT NOT NULL, id INTEGER NOT NULL, invoice TEXT, date TEXT, party TEXT,
+        total REAL, doc TEXT NOT NULL, PRIMARY KEY (kind, id));
+    CREATE INDEX IF NOT EXISTS ix_invoices_invoice ON invoices(kind, invoice);
+    CREATE INDEX IF NOT EXISTS ix_invoices_party ON invoices(kind, party);
+    CREATE INDEX IF NOT EXISTS ix_invoices_date ON invoices(kind, date);
+    CREATE TABLE IF NOT EXISTS product_lines (
+        kind TEXT NOT NULL, invoice_id INTEGER NOT NULL, line_no INTEGER NOT NULL,
+        product TEXT, unit TEXT, qty REAL, rate REAL, doc TEXT NOT NULL,
+        PRIMARY KEY (kind, invoice_id, line_no));
+    CREATE INDEX IF NOT EXISTS ix_lines_product ON product_lines(product);
+    CREATE TABLE IF NOT EXISTS ledger_parties (party TEXT PRIMARY KEY, doc TEXT NOT NULL);
+    CREATE TABLE IF NOT EXISTS ledger_txns (
+        party TEXT NOT NULL, seq INTEGER NOT NULL, type TEXT, invoice TEXT, date TEXT,
+        doc TEXT NOT NULL, PRIMARY KEY (party, seq));
+    CREATE INDEX IF NOT EXISTS ix_txns_lookup ON ledger_txns(party, type, invoice);
+    CREATE TABLE IF NOT EXISTS documents (name TEXT PRIMARY KEY, doc TEXT NOT NULL);
+    CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    """
+
+    def __init__(self, path=DB_FILE):
+        import sqlite3
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self.lock = threading.RLock()
+
+    # ---- helpers ----
+    @staticmethod
+    def _dump(obj):
+        return json.dumps(obj, ensure_ascii=False)
+
+    def _bump(self, fn):
+        self.conn.execute(
+            "INSERT INTO meta(key, value) VALUES (?, '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+            ("version:" + fn,))
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)", (key, str(value)))
+
+    def is_empty(self):
+        return self.conn.execute(
+            "SELECT (SELECT COUNT(*) FROM invoices) + (SELECT COUNT(*) FROM ledger_parties)"
+            " + (SELECT COUNT(*) FROM documents)").fetchone()[0] == 0
+
+    def _write_invoice(self, kind, rec):
+        head = {k: v for k, v in rec.items() if k != "products"}
+        if "products" in rec:
+            head["products"] = None
+        rid = rec.get("id")
+        row = (rec.get("invoice"), rec.get("date"), rec.get("party"),
+               _to_qty(rec.get("total", 0)), self._dump(head), kind, rid)
+        # UPDATE in place first so the record keeps its position (rowid order)
+        cur = self.conn.execute(
+            "UPDATE invoices SET invoice = ?, date = ?, party = ?, total = ?, doc = ? WHERE kind = ? AND id = ?", row)
+        if cur.rowcount == 0:
+            self.conn.execute(
+                "INSERT INTO invoices(invoice, date, party, total, doc, kind, id) VALUES (?,?,?,?,?,?,?)", row)
+        self.conn.execute("DELETE FROM product_lines WHERE kind = ? AND invoice_id = ?", (kind, rid))
+        prods = rec.get("products")
+        if isinstance(prods, list):
+            self.conn.executemany(
+                "INSERT INTO product_lines(kind, invoice_id, line_no, product, unit, qty, rate, doc) VALUES (?,?,?,?,?,?,?,?)",
+                [(kind, rid, i, line.get("product"), line.get("unit"),
+                  _to_qty(line.get("qty", 0)), _to_qty(line.get("rate", 0)), self._dump(line))
+                 for i, line in enumerate(prods)])
+
+    def _delete_invoice(self, kind, rid):
+        self.conn.execute("DELETE FROM invoices WHERE kind = ? AND id = ?", (kind, rid))
+        self.conn.execute("DELETE FROM product_lines WHERE kind = ? AND invoice_id = ?", (kind, rid))
+
+    def _write_party(self, party, ent):
+        head = {k: v for k, v in ent.items() if k != "transactions"}
+        cur = self.conn.execute("UPDATE ledger_parties SET doc = ? WHERE party = ?", (self._dump(head), party))
+        if cur.rowcount == 0:
+            self.conn.execute("INSERT INTO ledger_parties(party, doc) VALUES (?, ?)", (party, self._dump(head)))
+        self.conn.execute("DELETE FROM ledger_txns WHERE party = ?", (party,))
+        self.conn.executemany(
+            "INSERT INTO ledger_txns(party, seq, type, invoice, date, doc) VALUES (?,?,?,?,?,?)",
+            [(party, i, t.get("type"), t.get("invoice"), t.get("date"), self._dump(t))
+             for i, t in enumerate(ent.get("transactions", []))])
+
+    # ---- storage API ----
+    def ensure(self):
+        pass
+
+    def load(self, fn):
+        with self.lock:
+            if fn in INVOICE_FILES:
+                kind = INVOICE_FILES[fn]
+                lines = {}
+                for rid, doc in self.conn.execute(
+                        "SELECT invoice_id, doc FROM product_lines WHERE kind = ? ORDER BY invoice_id, line_no", (kind,)):
+                    lines.setdefault(rid, []).append(json.loads(doc))
+                recs = []
+                for rid, doc in self.conn.execute(
+                        "SELECT id, doc FROM invoices WHERE kind = ? ORDER BY rowid", (kind,)):
+                    rec = json.loads(doc)
+                    if "products" in rec:
+                        rec["products"] = lines.get(rid, [])
+                    recs.append(rec)
+                return recs
+            if fn == LEDGER_FILE:
+                txns = {}
+                for party, doc in self.conn.execute("SELECT party, doc FROM ledger_txns ORDER BY party, seq"):
+                    txns.setdefault(party, []).append(json.loads(doc))
+                ledger = {}
+                for party, doc in self.conn.execute("SELECT party, doc FROM ledger_parties ORDER BY rowid"):
+                    ent = json.loads(doc)
+                    ent["transactions"] = txns.get(party, [])
+                    ledger[party] = ent
+                return ledger
+            row = self.conn.execute("SELECT doc FROM documents WHERE name = ?", (fn,)).fetchone()
+            if row is None:
+                raise FileNotFoundError(fn)
+            return json.loads(row[0])
+
+    def iter_invoices(self, fn, date_from=None, date_to=None, party=None, batch=500):
+        """Stream purchase/sale records in file order, filtered in SQL, batch rows at a time."""
+        kind = INVOICE_FILES[fn]
+        where, args = ["kind = ?"], [kind]
+        if date_from:
+            where.append("substr(date, 1, 10) >= ?"); args.append(date_from)
+        if date_to:
+            where.append("substr(date, 1, 10) <= ?"); args.append(date_to)
+        if party:
+            where.append("party = ?"); args.append(party)
+        sql = "SELECT rowid, id, doc FROM invoices WHERE " + " AND ".join(where) + \
+              " AND rowid > ? ORDER BY rowid LIMIT ?"
+        last = 0
+        while True:
+            with self.lock:
+                rows = self.conn.execute(sql, args + [last, batch]).fetchall()
+                if not rows:
+                    return
+                ids = [r[1] for r in rows]
+                lines = {}
+                for rid, doc in self.conn.execute(
+                        "SELECT invoice_id, doc FROM product_lines WHERE kind = ? AND invoice_id IN (%s)"
+                        " ORDER BY invoice_id, line_no" % ",".join("?" * len(ids)), [kind] + ids):
+                    lines.setdefault(rid, []).append(json.loads(doc))
+            for rowid, rid, doc in rows:
+                rec = json.loads(doc)
+                if "products" in rec:
+                    rec["products"] = lines.get(rid, [])
+                yield rec
+            last = rows[-1][0]
+
+    def save(self, fn, data):
+        """Replace a whole document, writing only the rows whose content changed."""
+        with self.lock, self.conn:
+            if fn in INVOICE_FILES:
+                kind = INVOICE_FILES[fn]
+                old = {rid: doc for rid, doc in self.conn.execute(
+                    "SELECT id, doc FROM invoices WHERE kind = ?", (kind,))}
+                old_lines = {}
+                for rid, doc in self.conn.execute(
+                        "SELECT invoice_id, doc FROM product_lines WHERE kind = ? ORDER BY invoice_id, line_no", (kind,)):
+                    old_lines.setdefault(rid, []).append(doc)
+                keep = set()
+                for rec in data:
+                    rid = rec.get("id")
+                    keep.add(rid)
+                    head = {k: v for k, v in rec.items() if k != "products"}
+                    if "products" in rec:
+                        head["products"] = None
+                    lines = [self._dump(line) for line in rec.get("products") or []]
+                    if old.get(rid) != self._dump(head) or old_lines.get(rid, []) != lines:
+                        self._write_invoice(kind, rec)
+                for rid in set(old) - keep:
+                    self._delete_invoice(kind, rid)
+            elif fn == LEDGER_FILE:
+                old = {p: doc for p, doc in self.conn.execute("SELECT party, doc FROM ledger_parties")}
+                old_txns = {}
+                for party, doc in self.conn.execute("SELECT party, doc FROM ledger_txns ORDER BY party, seq"):
+                    old_txns.setdefault(party, []).append(doc)
+                for party, ent in data.items():
+                    head = {k: v for k, v in ent.items() if k != "transactions"}
+                    txns = [self._dump(t) for t in ent.get("transactions", [])]
+                    if old.get(party) != self._dump(head) or old_txns.get(party, []) != txns:
+                        self._write_party(party, ent)
+                for party in set(old) - set(data):
+                    self.conn.execute("DELETE FROM ledger_parties WHERE party = ?", (party,))
+                    self.conn.execute("DELETE FROM ledger_txns WHERE party = ?", (party,))
+            else:
+                self.conn.execute("INSERT OR REPLACE INTO documents(name, doc) VALUES (?, ?)",
+                                  (fn, json.dumps(data, ensure_ascii=False)))
+            self._bump(fn)
+
+    def insert_record(self, fn, rec):
+        with self.lock, self.conn:
+            self._write_invoice(INVOICE_FILES[fn], rec)
+            self._bump(fn)
+
+    def update_record(self, fn, rec):
+        with self.lock, self.conn:
+            self._write_invoice(INVOICE_FILES[fn], rec)
+            self._bump(fn)
+
+    def delete_record(self, fn, rec_id):
+        with self.lock, self.conn:
+            self._delete_invoice(INVOICE_FILES[fn], rec_id)
+            self._bump(fn)
+
+    def signature(self, fn):
+        with self.lock:
+            return ["sqlite", int(self.get_meta("version:" + fn, 0))]
+
+def iter_events(path=EVENT_LOG_FILE, kind=None, since_seq=0):
+    """
+    Stream events from the JSONL log one line at a time (constant memory).
+    Optionally only one kind ("purchase"/"sale") and only seq > since_seq.
+    """
+    try:
+        f = open(path, "r", encoding="utf-8")
+    except OSError:
+        return
+    with f:
+        for line in f:
+            try:
+                ev = json.loads(line)
+            except Exception:
+                continue    # torn last line after a crash
+            if ev.get("seq", 0) <= since_seq:
+                continue
+            if kind is not None and ev.get("kind") != kind:
+                continue
+            yield ev
+
+class EventLogStorage:
+    """
+    Purchases and sales stored as an append-only JSONL event log: every
+    create / update / delete is one line, so saving an invoice costs O(1)
+    regardless of history size. Current state is materialized in memory
+    from the latest snapshot plus the events after it; every
+    EVENT_COMPACT_EVERY events the state is written to EVENT_SNAPSHOT_FILE
+    and the log is restarted. Other documents (stock, ledger, engine state)
+    are kept as JSON files.
+    """
+    name = "eventlog"
+
+    def __init__(self, log_file=EVENT_LOG_FILE, snapshot_file=EVENT_SNAPSHOT_FILE,
+                 compact_every=EVENT_COMPACT_EVERY):
+        self.log_file = log_file
+        self.snapshot_file = snapshot_file
+        self.compact_every = compact_every
+        self.files = JsonStorage()
+        self.lock = threading.RLock()
+        self.state = None       # kind -> {id: rec as JSON text}, in insertion order
+        self.seq = 0
+        self.kind_seq = {}
+        self.since_snapshot = 0
+
+    def _materialize(self):
+        if self.state is not None:
+            return
+        self.state = {kind: {} for kind in INVOICE_FILES.values()}
+        snap_seq = 0
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, "r", encoding="utf-8") as f:
+                snap = json.load(f)
+            snap_seq = snap.get("seq", 0)
+            for kind in self.state:
+                self.state[kind] = {r.get("id"): self._dump(r) for r in snap.get(kind, [])}
+        elif not os.path.exists(self.log_file):
+            # first run: start from the existing JSON history
+            for fn, kind in INVOICE_FILES.items():
+                if os.path.exists(fn):
+                    try:
+                        self.state[kind] = {r.get("id"): self._dump(r) for r in self.files.load(fn)}
+                    except Exception:
+                        pass
+        self.seq = snap_seq
+        self.kind_seq = {kind: snap_seq for kind in self.state}
+        for ev in iter_events(self.log_file, since_seq=snap_seq):
+            self._apply(ev)
+            self.since_snapshot += 1
+
+    @staticmethod
+    def _dump(rec):
+        return json.dumps(rec, ensure_ascii=False)
+
+    def _apply(self, ev):
+        recs = self.state[ev["kind"]]
+        if ev["op"] == "delete":
+            recs.pop(ev.get("id"), None)
+        else:
+            recs[ev["rec"].get("id")] = self._dump(ev["rec"])
+        self.seq = max(self.seq, ev["seq"])
+        self.kind_seq[ev["kind"]] = ev["seq"]
+
+    def _append(self, kind, op, rec=None, rec_id=None):
+        with self.lock:
+            self._materialize()
+            ev = {"seq": self.seq + 1, "ts": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                  "kind": kind, "op": op}
+            if rec is not None:
+                ev["rec"] = rec
+                ev["id"] = rec.get("id")
+            else:
+                ev["id"] = rec_id
+            with open(self.log_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(ev, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._apply(ev)
+            self.since_snapshot += 1
+            if self.since_snapshot >= self.compact_every:
+                self.compact()
+
+    def compact(self):
+        """Write the materialized state as a snapshot and start a fresh log."""
+        with self.lock:
+            self._materialize()
+            snap = {"seq": self.seq}
+            for kind, recs in self.state.items():
+                snap[kind] = [json.loads(r) for r in recs.values()]
+            _atomic_write_json(self.snapshot_file, snap, indent=None)
+            # everything in the log is now covered by the snapshot
+            open(self.log_file, "w", encoding="utf-8").close()
+            self.since_snapshot = 0
+
+    # ---- storage API ----
+    def ensure(self):
+        self.files.ensure()
+        with self.lock:
+            self._materialize()
+            if not os.path.exists(self.snapshot_file) or self.since_snapshot:
+                self.compact()
+
+    def load(self, fn):
+        if fn not in INVOICE_FILES:
+            return self.files.load(fn)
+        with self.lock:
+            self._materialize()
+            # fresh objects on every load, so callers can't alter the log's state
+            return [json.loads(r) for r in self.state[INVOICE_FILES[fn]].values()]
+
+    def save(self, fn, data):
+        """Whole-list save: appends events only for records that changed."""
+        if fn not in INVOICE_FILES:
+            return self.files.save(fn, data)
+        kind = INVOICE_FILES[fn]
+        with self.lock:
+            self._materialize()
+            current = self.state[kind]
+            keep = set()
+            for rec in data:
+                keep.add(rec.get("id"))
+                old = current.get(rec.get("id"))
+                if old is None:
+                    self._append(kind, "create", rec)
+                elif old != self._dump(rec):
+                    self._append(kind, "update", rec)
+            for rec_id in [i for i in current if i not in keep]:
+                self._append(kind, "delete", rec_id=rec_id)
+
+    def insert_record(self, fn, rec):
+        self._append(INVOICE_FILES[fn], "create", rec)
+
+    def update_record(self, fn, rec):
+        self._append(INVOICE_FILES[fn], "update", rec)
+
+    def delete_record(self, fn, rec_id):
+        self._append(INVOICE_FILES[fn], "delete", rec_id=rec_id)
+
+    def signature(self, fn):
+        if fn not in INVOICE_FILES:
+            return self.files.signature(fn)
+        with self.lock:
+            self._materialize()
+            return ["eventlog", self.kind_seq.get(INVOICE_FILES[fn], 0)]
+
+def migrate_json_to_sqlite(db_file=DB_FILE, force=False):
+    """
+    One-shot copy of purchase.json, sale.json, stock.json, ledger.json and
+    stock_state.json into the SQLite database. Skipped if already migrated
+    unless force=True. Returns the number of documents copied.
+    """
+    src = JsonStorage()
+    dst = SqliteStorage(db_file)
+    if dst.get_meta("migrated_from_json") and not force:
+        return 0
+    copied = 0
+    for fn in (PURCHASE_FILE, SALE_FILE, STOCK_FILE, LEDGER_FILE, STOCK_STATE_FILE):
+        if not os.path.exists(fn):
+            continue
+        try:
+            data = src.load(fn)
+        except Exception:
+            continue
+        dst.save(fn, data)
+        copied += 1
+    dst.set_meta("migrated_from_json", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    dst.conn.close()
+    return copied
+
+_storage = None
+
+def get_storage():
+    """Return the active storage backend (chosen by STORAGE_BACKEND)."""
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND == "sqlite":
+            _storage = SqliteStorage()
+        elif STORAGE_BACKEND == "eventlog":
+            _storage = EventLogStorage()
+        else:
+            _storage = JsonStorage()
+    return _storage
+
+def set_storage(storage):
+    """Switch the active backend (e.g. from a script or test)."""
+    global _storage
+    _storage = storage
+    get_repository().invalidate()
+
+# -------------------------
+# In-process data cache
+# -------------------------
+class DataRepository:
+    """
+    Shared in-memory copy of every document loaded through load_json.
+    Each file is parsed once and served from memory until its storage
+    signature (size/mtime for JSON, write counter for SQLite) changes;
+    writes made through save_json / insert_record / ... update the cached
+    copy directly instead of forcing a re-parse.
+
+    load() hands out a deep copy and store() keeps one, so callers (the
+    ledger window, the sync worker thread) never share objects with the
+    cache or with each other. Purchases and sales are kept only as slotted
+    Invoice records: load() rebuilds fresh dicts from them, and
+    load_invoices() hands out the shared records themselves.
+    """
+
+    def __init__(self):
+        self.entries = {}   # fn -> (signature, data)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def _copy(data):
+        # marshal round-trip: deep copy of JSON-shaped data without per-object Python calls
+        try:
+            return marshal.loads(marshal.dumps(data))
+        except ValueError:
+            import copy
+            return copy.deepcopy(data)
+
+    def _keep(self, fn, data):
+        """The form cached for fn: a private copy, as Invoice records for purchases/sales."""
+        data = self._copy(data)
+        if fn in INVOICE_FILES and isinstance(data, list) and all(isinstance(r, dict) for r in data):
+            return [Invoice.from_dict(r) for r in data]
+        return data
+
+    def _out(self, cached):
+        if isinstance(cached, list) and cached and type(cached[0]) is Invoice:
+            return [r.to_dict() for r in cached]
+        return self._copy(cached)
+
+    def _cached(self, fn):
+        """(cached data, True if it was a hit) for fn, loading it on a miss."""
+        storage = get_storage()
+        sig = storage.signature(fn)
+        ent = self.entries.get(fn)
+        if ent is not None and sig is not None and ent[0] == sig:
+            self.hits += 1
+            return ent[1], True
+        self.misses += 1
+        data = storage.load(fn)
+        self.entries[fn] = (sig, self._keep(fn, data))
+        return data, False
+
+    def load(self, fn):
+        with self.lock:
+            data, hit = self._cached(fn)
+            return self._out(data) if hit else self._copy(data)
+
+    def load_invoices(self, fn):
+        """fn's records as the cached Invoice objects (shared: read-only)."""
+        with self.lock:
+            self._cached(fn)
+            cached = self.entries[fn][1]
+            if isinstance(cached, list) and cached and type(cached[0]) is not Invoice:
+                return [Invoice.from_dict(r) for r in self._copy(cached)]
+            return list(cached)
+
+    def store(self, fn, data):
+        storage = get_storage()
+        with self.lock:
+            storage.save(fn, data)
+            self.entries[fn] = (storage.signature(fn), self._keep(fn, data))
+
+    def apply(self, fn, op, rec=None, rec_id=None):
+        """Run a single-record write ("insert", "update", "delete") and patch the cache."""
+        storage = get_storage()
+        with self.lock:
+            ent = self.entries.get(fn)
+            fresh = ent is not None and ent[0] == storage.signature(fn)
+            if fresh and fn in INVOICE_FILES and ent[1] and type(ent[1][0]) is not Invoice:
+                fresh = False   # odd records cached as plain data: re-read next time
+            if rec is not None:
+                rec = json.loads(json.dumps(rec, ensure_ascii=False))
+                cached_rec = Invoice.from_dict(rec) if fn in INVOICE_FILES else self._copy(rec)
+            if op == "insert":
+                storage.insert_record(fn, rec)
+            elif op == "update":
+                storage.update_record(fn, rec)
+            else:
+                storage.delete_record(fn, rec_id)
+            if not fresh:
+                self.entries.pop(fn, None)
+                return
+            data = _apply_record_op(list(ent[1]), op, cached_rec if rec is not None else None, rec_id)
+            self.entries[fn] = (storage.signature(fn), data)
+
+    def invalidate(self, fn=None):
+        with self.lock:
+            if fn is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(fn, None)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "cached": sorted(self.entries),
+            }
+
+_repository = None
+
+def get_repository():
+    global _repository
+    if _repository is None:
+        _repository = DataRepository()
+    return _repository
+
 # -------------------------
 # Basic file helpers
 # -------------------------
 def ensure_files_exist():
-    """Make sure required files and folders exist."""
+    """Make sure required files and folders exist and replay any journaled writes."""
     os.makedirs(RECEIPTS_DIR, exist_ok=True)
     os.makedirs(BILLS_DIR, exist_ok=True)
-    for fn, default in [
-        (PURCHASE_FILE, []),
-        (SALE_FILE, []),
-        (STOCK_FILE, []),
-        (LEDGER_FILE, {}),
-    ]:
-        if not os.path.exists(fn):
-            with open(fn, "w", encoding="utf-8") as f:
-                json.dump(default, f, indent=2, ensure_ascii=False)
+    if STORAGE_BACKEND == "sqlite" and _storage is None and not os.path.exists(DB_FILE):
+        # first run on SQLite: bring the existing JSON history across
+        migrate_json_to_sqlite()
+    get_storage().ensure()
+
+# history the app can't rebuild: an unreadable copy must never load as empty
+CRITICAL_FILES = (PURCHASE_FILE, SALE_FILE, LEDGER_FILE)
+
+class DataFileError(Exception):
+    """A purchase/sale/ledger file exists but can't be read."""
+
+def _unreadable(fn, e):
+    return DataFileError(f"{fn} could not be read ({e}). The file was left as it is; "
+                         f"fix or restore it before saving anything.")
 
 def load_json(fn):
-    """Load JSON, return empty list or dict on error depending on file."""
+    """
+    Load JSON, return empty list or dict if the file doesn't exist. An
+    unreadable purchase/sale/ledger file raises DataFileError (saving over an
+    empty list would wipe the history); other files fall back to the default.
+    """
     try:
-        with open(fn, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return [] if fn != LEDGER_FILE else {}
+        return get_repository().load(fn)
+    except FileNotFoundError:
+        return _default_for(fn)
+    except Exception as e:
+        if fn in CRITICAL_FILES:
+            raise _unreadable(fn, e) from e
+        return _default_for(fn)
 
 def save_json(fn, data):
-    """Save object as JSON with indentation."""
-    with open(fn, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    """Save object as JSON with indentation (atomic replace)."""
+    get_repository().store(fn, data)
+
+def insert_record(fn, rec):
+    """Append one purchase/sale record."""
+    get_repository().apply(fn, "insert", rec=rec)
+
+def update_record(fn, rec):
+    """Replace the purchase/sale record with the same id."""
+    get_repository().apply(fn, "update", rec=rec)
+
+def delete_record(fn, rec_id):
+    """Remove the purchase/sale record with this id."""
+    get_repository().apply(fn, "delete", rec_id=rec_id)
+
+# -------------------------
+# Firebase delta sync
+# -------------------------
+SYNC_STATE_FILE = "firebase_sync_state.json"
+
+# Firebase path -> local file it mirrors
+FIREBASE_PATHS = {
+    "purchases": PURCHASE_FILE,
+    "sales": SALE_FILE,
+    "stock": STOCK_FILE,
+    "ledger": LEDGER_FILE,
+}
+
+# Remote layout, as other readers of the database see it:
+#   /purchases/id_<id>   one purchase record, keyed by its id
+#   /sales/id_<id>       one sale record, keyed by its id
+#   /stock               array of stock summary rows
+#   /ledger/<party>      ledger entry of one party
+# purchases and sales used to be arrays. Keyed by id, inserting or deleting
+# one record doesn't shift (and re-send) every later one; the "id_" prefix
+# stops Firebase from reading dense integer keys back as an array. The first
+# sync of a path under a new FIREBASE_SCHEMA replaces the whole node, so the
+# old array is never left behind.
+FIREBASE_KEYED = ("purchases", "sales")
+FIREBASE_SCHEMA = 2
+
+def fb_keyed(path, data):
+    """The tree Firebase `path` should hold for local `data` (records keyed by "id_<id>")."""
+    if path not in FIREBASE_KEYED or not isinstance(data, list):
+        return data
+    return {f"id_{r['id']}" if isinstance(r, dict) and r.get("id") is not None else f"row_{i}": r
+            for i, r in enumerate(data)}
+
+def _fb_children(data):
+    """Children of a node the way Firebase stores them (lists become "0", "1", ... keys)."""
+    if isinstance(data, list):
+        return {str(i): v for i, v in enumerate(data)}
+    if isinstance(data, dict):
+        return {str(k): v for k, v in data.items()}
+    return None
+
+def _fb_hash(value):
+    import hashlib
+    raw = json.dumps(value, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.md5(raw).hexdigest()[:16]
+
+def fb_fingerprint(data, depth):
+    """
+    Compact fingerprint of a tree: nested dicts of child hashes `depth` levels
+    deep, a single hash string below that.
+    """
+    children = _fb_children(data)
+    if depth <= 0 or not children:
+        return _fb_hash(data)
+    return {k: fb_fingerprint(v, depth - 1) for k, v in children.items()}
+
+def fb_diff(path, old_fp, new, depth, updates):
+    """
+    Collect multi-path updates {"path/child": value} turning the tree described
+    by old_fp into `new`. Removed children are sent as None (Firebase delete).
+    """
+    children = _fb_children(new)
+    if not isinstance(old_fp, dict) or depth <= 0 or not children:
+        if old_fp is None or isinstance(old_fp, dict) or old_fp != _fb_hash(new):
+            updates[path] = new
+        return updates
+    for k, v in children.items():
+        fb_diff(f"{path}/{k}", old_fp.get(k), v, depth - 1, updates)
+    for k in old_fp:
+        if k not in children:
+            updates[f"{path}/{k}"] = None
+    return updates
+
+class FirebaseSync:
+    """
+    Sends only the children that changed since the last successful sync,
+    through one multi-path update() per call. The last synced state is kept
+    as a fingerprint of hashes in SYNC_STATE_FILE, not as a full copy.
+    """
+
+    def __init__(self, database=None, state_file=SYNC_STATE_FILE, depth=2):
+        # state_file=None keeps the fingerprint in memory only
+        self.database = database
+        self.state_file = state_file
+        self.depth = depth
+        self.synced = None
+        self.bytes_sent = 0
+        self.calls = 0
+
+    def _db(self):
+        return self.database if self.database is not None else init_firebase()
+
+    def _state(self):
+        if self.synced is None:
+            state = load_json(self.state_file) if self.state_file else {}
+            self.synced = state if isinstance(state, dict) else {}
+        return self.synced
+
+    def _save_state(self):
+        if self.state_file:
+            save_json(self.state_file, self.synced)
+
+    def _synced_fp(self, path):
+        """Fingerprint of what Firebase holds at `path`; None means replace the whole node."""
+        state = self._state()
+        if path in FIREBASE_KEYED and state.get("schema", {}).get(path) != FIREBASE_SCHEMA:
+            return None     # may still hold an older layout
+        return state.get(path)
+
+    def diff(self, path, data):
+        """Multi-path updates needed to bring Firebase `path` up to `data`."""
+        return fb_diff(path, self._synced_fp(path), fb_keyed(path, data), self.depth, {})
+
+    def sync(self, path, data):
+        """Push the changes of one collection; returns the number of paths written."""
+        return self.sync_many({path: data})
+
+    def sync_many(self, collections):
+        """Push the changes of several collections in a single update() call."""
+        collections = {path: fb_keyed(path, data) for path, data in collections.items()}
+        updates = {}
+        for path, data in collections.items():
+            fb_diff(path, self._synced_fp(path), data, self.depth, updates)
+        if updates:
+            self._db().reference("/").update(updates)
+            self.calls += 1
+            self.bytes_sent += len(json.dumps(updates, ensure_ascii=False).encode("utf-8"))
+        state = self._state()
+        for path, data in collections.items():
+            state[path] = fb_fingerprint(data, self.depth)
+            if path in FIREBASE_KEYED:
+                state.setdefault("schema", {})[path] = FIREBASE_SCHEMA
+        self._save_state()
+        return len(updates)
+
+    def reset(self, path=None):
+        """Forget what was synced, so the next sync re-sends the full tree."""
+        state = self._state()
+        if path is None:
+            state.clear()
+        else:
+            state.pop(path, None)
+        self._save_state()
+
+_firebase_sync = None
+
+def get_firebase_sync():
+    global _firebase_sync
+    if _firebase_sync is None:
+        _firebase_sync = FirebaseSync()
+    return _firebase_sync
 
 def save_to_firebase(path, data):
-    ref = db.reference(path)
-    ref.set(data)
-    print("Firebase Updated:", path)
+    n = get_firebase_sync().sync(path, data)
+    if n:
+        print("Firebase Updated:", path, f"({n} paths)")
+
+def sync_to_firebase(*paths):
+    """
+    Delta-sync the given collections ("purchases", "sales", "stock", "ledger").
+    Queued for the background worker when it is running, otherwise sent now.
+    """
+    for path in paths:
+        data = load_json(FIREBASE_PATHS[path])
+        if _sync_queue is not None:
+            _sync_queue.put(path, data)
+        else:
+            save_to_firebase(path, data)
 
+# -------------------------
+# Background sync queue
+# -------------------------
+SYNC_QUEUE_FILE = "sync_queue.jsonl"
+
+class SyncQueue:
+    """
+    Outbound Firebase writes, drained by a worker thread so the Tk main loop
+    never waits on the network. Writes to the same collection are coalesced
+    and each batch goes out as one multi-path update(). Pending collections
+    are journaled to SYNC_QUEUE_FILE, so anything not sent (offline, app
+    closed) is re-sent on the next start. Failures are retried with
+    exponential backoff; results are collected for the UI to poll().
+    """
+
+    def __init__(self, sync=None, journal_file=SYNC_QUEUE_FILE, batch_delay=0.5, max_backoff=60.0):
+        self.sync = sync or get_firebase_sync()
+        self.journal_file = journal_file
+        self.batch_delay = batch_delay
+        self.max_backoff = max_backoff
+        self.pending = {}          # firebase path -> data snapshot to send
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.results = queue.Queue()
+        self.thread = None
+        self.last_sync = None
+        self.last_error = None
+        self.retry_in = 0
+
+    # ---- journal ----
+    def _read_journal(self):
+        paths = []
+        try:
+            with open(self.journal_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        path = json.loads(line).get("path")
+                    except Exception:
+                        continue
+                    if path in FIREBASE_PATHS and path not in paths:
+                        paths.append(path)
+        except OSError:
+            pass
+        return paths
+
+    def _append_journal(self, path):
+        with open(self.journal_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"path": path, "queued": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}) + "\n")
+
+    def _rewrite_journal(self):
+        with open(self.journal_file, "w", encoding="utf-8") as f:
+            for path in self.pending:
+                f.write(json.dumps({"path": path}) + "\n")
+
+    # ---- producer side (Tk thread) ----
+    def put(self, path, data):
+        with self.lock:
+            if path not in self.pending:
+                self._append_journal(path)
+            self.pending[path] = data
+        self.wakeup.set()
+
+    def depth(self):
+        with self.lock:
+            return len(self.pending)
+
+    def start(self):
+        """Reload journaled paths (from the Tk thread) and start the worker."""
+        for path in self._read_journal():
+            with self.lock:
+                self.pending.setdefault(path, load_json(FIREBASE_PATHS[path]))
+        if self.pending:
+            self.wakeup.set()
+        self.thread = threading.Thread(target=self._run, name="firebase-sync", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        self.stopping.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def poll(self):
+        """Drain worker results; call from the Tk thread (via after())."""
+        out = []
+        while True:
+            try:
+                res = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if res[0] == "ok":
+                self.last_sync = res[2]
+                self.last_error = None
+                self.retry_in = 0
+            else:
+                self.last_error = res[1]
+                self.retry_in = res[2]
+            out.append(res)
+        return out
+
+    # ---- worker ----
+    def _run(self):
+        backoff = 1.0
+        while not self.stopping.is_set():
+            self.wakeup.wait()
+            if self.stopping.is_set():
+                break
+            # let writes from the same user action coalesce into one batch
+            self.stopping.wait(self.batch_delay)
+            with self.lock:
+                self.wakeup.clear()
+                batch = dict(self.pending)
+            if not batch:
+                continue
+            try:
+                n = self.sync.sync_many(batch)
+            except Exception as e:
+                self.results.put(("error", str(e), backoff))
+                self.stopping.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                self.wakeup.set()
+                continue
+            backoff = 1.0
+            with self.lock:
+                for path, data in batch.items():
+                    if self.pending.get(path) is data:
+                        del self.pending[path]
+                self._rewrite_journal()
+                if self.pending:
+                    self.wakeup.set()
+            self.results.put(("ok", sorted(batch), datetime.now().strftime("%H:%M:%S"), n))
+
+_sync_queue = None
+
+def start_sync_queue():
+    """Start the background Firebase worker (once); later syncs are queued."""
+    global _sync_queue
+    if _sync_queue is None:
+        _sync_queue = SyncQueue().start()
+    return _sync_queue
+
+# -------------------------
+# Id / invoice sequences
+# -------------------------
+SEQUENCE_FILE = "sequences.json"
+
+class SequenceAllocator:
+    """
+    Persistent per-document counters ("purchase" -> P invoices, "sale" -> S).
+    Ids are never reused, even after the highest record is deleted. The
+    counter is written (temp file + fsync + rename) before an id is used,
+    so a crash can leave a gap but never a duplicate. A counter missing from
+    SEQUENCE_FILE is seeded once from the highest id already in the data.
+    """
+
+    def __init__(self, path=SEQUENCE_FILE):
+        self.path = path
+        self.counters = None
+        self.lock = threading.RLock()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.counters = {k: int(v) for k, v in data.items()}
+        except Exception:
+            self.counters = {}
+
+    def _persist(self):
+        _atomic_write_json(self.path, self.counters, indent=None)
+
+    def _last(self, fn):
+        if self.counters is None:
+            self._load()
+        key = INVOICE_FILES.get(fn, fn)
+        if key not in self.counters:
+            recs = load_json(fn)
+            last = 0
+            for r in recs if isinstance(recs, list) else []:
+                try:
+                    last = max(last, int(r.get("id", 0)))
+                except Exception:
+                    pass
+            self.counters[key] = last
+            self._persist()
+        return self.counters[key]
+
+    def peek(self, fn):
+        """Next id that allocate() would hand out (does not reserve it)."""
+        with self.lock:
+            return self._last(fn) + 1
+
+    def claim(self, fn, rec_id):
+        """
+        Mark rec_id as used; call before the record is saved. Raises
+        ValueError if rec_id was already handed out (e.g. another window
+        saved with the id peek() showed), so it can't be saved twice.
+        """
+        with self.lock:
+            key = INVOICE_FILES.get(fn, fn)
+            if int(rec_id) <= self._last(fn):
+                raise ValueError(f"Id {rec_id} is already in use for {key} records.")
+            self.counters[key] = int(rec_id)
+            self._persist()
+
+    def allocate(self, fn):
+        """Reserve and return the next id."""
+        with self.lock:
+            rec_id = self._last(fn) + 1
+            self.claim(fn, rec_id)
+            return rec_id
+
+    def reserve(self, fn, count):
+        """Reserve count consecutive ids with one write; returns the first one."""
+        with self.lock:
+            first = self._last(fn) + 1
+            if count > 0:
+                self.claim(fn, first + count - 1)
+            return first
+
+_sequences = None
+
+def get_sequences():
+    global _sequences
+    if _sequences is None:
+        _sequences = SequenceAllocator()
+    return _sequences
 
 def next_id(fn):
-    """Return next integer id for records in fn (based on existing 'id' fields)."""
-    recs = load_json(fn)
-    if not isinstance(recs, list) or len(recs) == 0:
-        return 1
-    try:
-        return max(int(r.get("id", 0)) for r in recs) + 1
-    except Exception:
-        return len(recs) + 1
+    """Return next integer id for records in fn (not reserved; see claim_id)."""
+    return get_sequences().peek(fn)
 
-def next_invoice(prefix, fn):
+def claim_id(fn, rec_id):
+    """Reserve an id handed out by next_id before saving the record (ValueError if taken)."""
+    get_sequences().claim(fn, rec_id)
+
+def next_invoice(prefix, fn, seq=None):
     """Create a readable invoice string using prefix + date + seq number."""
-    seq = next_id(fn)
+    if seq is None:
+        seq = next_id(fn)
     date_part = datetime.now().strftime("%y%m%d")
     return f"{prefix}{date_part}{seq:04d}"
 
@@ -118,127 +1544,275 @@ def calc_totals(qty, rate, discount_pct=0, tax_pct=0):
     return round(subtotal, 2), round(discount_amt, 2), round(tax_amt, 2), round(total, 2)
 
 # -------------------------
-# Stock & Ledger computation
+# Record model
 # -------------------------
-def compute_stock_from_files():
+# Slotted stand-ins for the invoice / product line / ledger row dicts, used to
+# hold the purchase/sale history in memory (see DataRepository). Values are
+# kept exactly as loaded (callers coerce numbers with _to_qty), keys the model
+# doesn't know are kept in `extra`, and `keys` is the dict's key order, shared
+# by every record with the same fields, so to_dict() gives back the same dict.
+# Low-cardinality strings (product, unit, party, address, ...) are interned,
+# so thousands of lines naming the same product share one string object.
+LINE_ITEM_FIELDS = ("product", "unit", "qty", "rate", "discount_pct", "tax_pct",
+                    "subtotal", "discount_amt", "tax_amt", "total")
+INVOICE_FIELDS = ("id", "invoice", "date", "party", "phone", "address", "gst_no",
+                  "place_of_supply", "auth_sign", "products", "subtotal", "discount_amt",
+                  "tax_amt", "total", "notes")
+LEDGER_TXN_FIELDS = ("date", "type", "invoice", "credit", "debit", "remaining", "amount")
+LINE_ITEM_KEYS = frozenset(LINE_ITEM_FIELDS)
+INVOICE_KEYS = frozenset(INVOICE_FIELDS)
+LEDGER_TXN_KEYS = frozenset(LEDGER_TXN_FIELDS)
+_layouts = {}
+
+def _intern(v):
+    return sys.intern(v) if type(v) is str else v
+
+def _layout(d):
+    """d's key order as a tuple shared by all records with the same keys."""
+    keys = tuple(d)
+    return _layouts.setdefault(keys, keys)
+
+def _extra(d, known):
+    return {k: v for k, v in d.items() if k not in known} or None
+
+_getters = {}
+
+def _record_dict(rec, known):
+    """Rebuild the dict in its original key order; containers in extra are copied."""
+    extra = rec.extra
+    keys = rec.keys
+    if extra is None and len(keys) > 1:
+        get = _getters.get(keys)
+        if get is None:
+            from operator import attrgetter
+            get = _getters[keys] = attrgetter(*keys)
+        return dict(zip(keys, get(rec)))
+    d = {}
+    for k in rec.keys:
+        if k in known:
+            d[k] = getattr(rec, k)
+        else:
+            v = extra[k]
+            d[k] = DataRepository._copy(v) if isinstance(v, (dict, list)) else v
+    return d
+
+class LineItem:
+    __slots__ = LINE_ITEM_FIELDS + ("keys", "extra")
+
+    def __init__(self, product="", unit="", qty=0.0, rate=0.0, discount_pct=0.0, tax_pct=0.0,
+                 subtotal=0.0, discount_amt=0.0, tax_amt=0.0, total=0.0, keys=LINE_ITEM_FIELDS, extra=None):
+        self.product = product
+        self.unit = unit
+        self.qty = qty
+        self.rate = rate
+        self.discount_pct = discount_pct
+        self.tax_pct = tax_pct
+        self.subtotal = subtotal
+        self.discount_amt = discount_amt
+        self.tax_amt = tax_amt
+        self.total = total
+        self.keys = keys
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, d):
+        g = d.get
+        return cls(_intern(g("product")), _intern(g("unit")), g("qty"), g("rate"),
+                   g("discount_pct"), g("tax_pct"), g("subtotal"),
+                   g("discount_amt"), g("tax_amt"), g("total"),
+                   _layout(d), _extra(d, LINE_ITEM_KEYS))
+
+    def to_dict(self):
+        return _record_dict(self, LINE_ITEM_KEYS)
+
+class Invoice:
     """
-    Build stock summary from purchases and sales.
-    For each product compute: purchased, sold, available, avg_price, total value, latest_invoice.
-    Returns a list of dicts to be saved as stock.json.
-    Handles both old single-product records and new multi-product records.
+    One purchase or sale. products is a list of LineItem, or None for old
+    single-product records, whose line fields stay in extra (see lines()).
     """
-    purchases = load_json(PURCHASE_FILE)
-    sales = load_json(SALE_FILE)
+    __slots__ = INVOICE_FIELDS + ("keys", "extra")
+
+    def __init__(self, id=0, invoice="", date="", party="", phone="", address="", gst_no="",
+                 place_of_supply="", auth_sign="", products=None, subtotal=0.0, discount_amt=0.0,
+                 tax_amt=0.0, total=0.0, notes="", keys=INVOICE_FIELDS, extra=None):
+        self.id = id
+        self.invoice = invoice
+        self.date = date
+        self.party = party
+        self.phone = phone
+        self.address = address
+        self.gst_no = gst_no
+        self.place_of_supply = place_of_supply
+        self.auth_sign = auth_sign
+        self.products = products
+        self.subtotal = subtotal
+        self.discount_amt = discount_amt
+        self.tax_amt = tax_amt
+        self.total = total
+        self.notes = notes
+        self.keys = keys
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, d):
+        g = d.get
+        prods = g("products")
+        if isinstance(prods, list) and all(isinstance(p, dict) for p in prods):
+            products, known = [LineItem.from_dict(p) for p in prods], INVOICE_KEYS
+        else:
+            products, known = None, INVOICE_KEYS - {"products"}
+        return cls(g("id"), g("invoice"), g("date"), _intern(g("party")), _intern(g("phone")),
+                   _intern(g("address")), _intern(g("gst_no")), _intern(g("place_of_supply")),
+                   _intern(g("auth_sign")), products, g("subtotal"), g("discount_amt"),
+                   g("tax_amt"), g("total"), g("notes"), _layout(d), _extra(d, known))
+
+    def to_dict(self):
+        if self.products is None:
+            return _record_dict(self, INVOICE_KEYS - {"products"})
+        d = _record_dict(self, INVOICE_KEYS)
+        d["products"] = [p.to_dict() for p in self.products]
+        return d
+
+    def lines(self):
+        """Product lines; an old single-product record is its own one line."""
+        if self.products is not None:
+            return self.products
+        return [LineItem.from_dict(self.extra or {})]
+
+class LedgerTxn:
+    """One ledger row; credit/debit keep their raw value ("" when empty)."""
+    __slots__ = LEDGER_TXN_FIELDS + ("keys", "extra")
+
+    def __init__(self, date="", type="", invoice="", credit="", debit="", remaining=0.0, amount=0.0,
+                 keys=LEDGER_TXN_FIELDS, extra=None):
+        self.date = date
+        self.type = type
+        self.invoice = invoice
+        self.credit = credit
+        self.debit = debit
+        self.remaining = remaining
+        self.amount = amount
+        self.keys = keys
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, d):
+        g = d.get
+        return cls(g("date"), _intern(g("type")), g("invoice"), g("credit"), g("debit"),
+                   g("remaining"), g("amount"), _layout(d), _extra(d, LEDGER_TXN_KEYS))
+
+    def update(self, **values):
+        """Assign fields like dict.update: a field the row didn't have is added at the end."""
+        for k, v in values.items():
+            setattr(self, k, v)
+        missing = tuple(k for k in values if k not in self.keys)
+        if missing:
+            self.keys = _layout(dict.fromkeys(self.keys + missing))
+
+    def to_dict(self):
+        return _record_dict(self, LEDGER_TXN_KEYS)
+
+def load_invoices(fn):
+    """
+    purchase.json / sale.json as a list of Invoice. The records are the
+    repository's cached ones, shared by every caller: read them, don't change them.
+    """
+    try:
+        return get_repository().load_invoices(fn)
+    except FileNotFoundError:
+        return []
+    except Exception as e:
+        raise _unreadable(fn, e) from e
 
-    products = {}
+# -------------------------
+# Stock & Ledger computation
+# -------------------------
+def _to_qty(v):
+    try:
+        return float(v or 0)
+    except:
+        return 0.0
 
-    # accumulate purchases (support both formats)
-    for p in purchases:
-        prods = p.get("products")
-        if isinstance(prods, list):
-            for line in prods:
-                name = str(line.get("product", "")).strip()
-                if not name:
-                    continue
-                rec = products.setdefault(name, {
-                    "product": name,
-                    "purchased": 0,
-                    "sold": 0,
-                    "purchase_value": 0.0,
-                    "unit": line.get("unit", "") or "pcs",
-                    "latest_invoice": p.get("invoice", "") or "",
-                    "latest_purchase_date": p.get("date", "") or ""
-                })
-                try:
-                    qty = float(line.get("qty", 0) or 0)
-                except:
-                    qty = 0
-                try:
-                    rate = float(line.get("rate", 0) or 0)
-                except:
-                    rate = 0.0
-                rec["purchased"] += qty
-                rec["purchase_value"] += qty * rate
-                # prefer unit and latest invoice/date
-                if line.get("unit"):
-                    rec["unit"] = line.get("unit")
-                date_str = p.get("date", "")
-                if date_str and (not rec.get("latest_purchase_date") or date_str > rec.get("latest_purchase_date", "")):
-                    rec["latest_purchase_date"] = date_str
-                    rec["latest_invoice"] = p.get("invoice", "")
-        else:
-            # fallback single-product purchase record
-            name = str(p.get("product", "")).strip()
-            if not name:
+def _stock_lines(rec):
+    """
+    Yield (product, unit, qty, rate) for every product line of an Invoice.
+    Handles both old single-product records and new multi-product records.
+    """
+    for line in rec.lines():
+        name = str(line.product if line.product is not None else "").strip()
+        if not name:
+            continue
+        yield name, line.unit if line.unit is not None else "", _to_qty(line.qty), _to_qty(line.rate)
+
+def _stock_needed(products, old=None):
+    """Qty per product that a sale with these product lines takes out of stock, net of old (the sale it replaces)."""
+    need = {}
+    for name, _, qty, _ in _stock_lines(Invoice.from_dict({"products": products})):
+        need[name] = need.get(name, 0.0) + qty
+    for name, _, qty, _ in (_stock_lines(Invoice.from_dict(old)) if old else ()):
+        if name in need:
+            need[name] -= qty
+    return need
+
+def check_stock_available(need, available):
+    """Raise ValueError if any qty in need exceeds available[product] (unknown products have none)."""
+    for name, qty in need.items():
+        have = available.get(name, 0)
+        if qty > 0 and qty > have + 1e-9:
+            raise ValueError(f"{name}: only {have:g} in stock, cannot sell {qty:g}.")
+
+def _apply_stock_record(products, rec, kind, sign=1, stale=None):
+    """
+    Add (sign=1) or remove (sign=-1) one purchase/sale Invoice into the running
+    per-product totals in `products`. Products whose latest purchase invoice is
+    removed are added to `stale`, because the previous latest can't be derived
+    from the totals alone.
+    """
+    invoice = rec.invoice or ""
+    date_str = rec.date or ""
+    for name, unit, qty, rate in _stock_lines(rec):
+        ent = products.get(name)
+        if ent is None:
+            if sign < 0:
                 continue
-            rec = products.setdefault(name, {
+            ent = products[name] = {
                 "product": name,
                 "purchased": 0,
                 "sold": 0,
                 "purchase_value": 0.0,
-                "unit": p.get("unit", "") or "pcs",
-                "latest_invoice": p.get("invoice", "") or "",
-                "latest_purchase_date": p.get("date", "") or ""
-            })
-            try:
-                qty = float(p.get("qty", 0) or 0)
-            except:
-                qty = 0
-            try:
-                rate = float(p.get("rate", 0) or 0)
-            except:
-                rate = 0.0
-            rec["purchased"] += qty
-            rec["purchase_value"] += qty * rate
-            date_str = p.get("date", "")
-            if date_str and (not rec.get("latest_purchase_date") or date_str > rec.get("latest_purchase_date", "")):
-                rec["latest_purchase_date"] = date_str
-                rec["latest_invoice"] = p.get("invoice", "")
-
-    # accumulate sales (support multi-product)
-    for s in sales:
-        prods = s.get("products")
-        if isinstance(prods, list):
-            for line in prods:
-                name = str(line.get("product", "")).strip()
-                if not name:
-                    continue
-                rec = products.setdefault(name, {
-                    "product": name,
-                    "purchased": 0,
-                    "sold": 0,
-                    "purchase_value": 0.0,
-                    "unit": line.get("unit", "") or "pcs",
-                    "latest_invoice": "",
-                    "latest_purchase_date": ""
-                })
-                try:
-                    qty = float(line.get("qty", 0) or 0)
-                except:
-                    qty = 0
-                rec["sold"] += qty
-                if line.get("unit"):
-                    rec["unit"] = line.get("unit")
+                "unit": unit or "pcs",
+                "latest_invoice": invoice if kind == "purchase" else "",
+                "latest_purchase_date": date_str if kind == "purchase" else "",
+                "lines": 0
+            }
+        ent["lines"] = ent.get("lines", 0) + sign
+        if kind == "purchase":
+            ent["purchased"] += sign * qty
+            ent["purchase_value"] += sign * qty * rate
         else:
-            name = str(s.get("product", "")).strip()
-            if not name:
-                continue
-            rec = products.setdefault(name, {
-                "product": name,
-                "purchased": 0,
-                "sold": 0,
-                "purchase_value": 0.0,
-                "unit": s.get("unit", "") or "pcs",
-                "latest_invoice": "",
-                "latest_purchase_date": ""
-            })
-            try:
-                qty = float(s.get("qty", 0) or 0)
-            except:
-                qty = 0
-            rec["sold"] += qty
-
-    # build final summary list
+            ent["sold"] += sign * qty
+        if sign > 0:
+            # prefer unit and latest invoice/date
+            if unit:
+                ent["unit"] = unit
+            if kind == "purchase" and date_str:
+                # ties on date go to the higher invoice, so the result doesn't depend on apply order
+                if not ent.get("latest_purchase_date") or \
+                        (date_str, invoice) > (ent.get("latest_purchase_date", ""), ent.get("latest_invoice", "")):
+                    ent["latest_purchase_date"] = date_str
+                    ent["latest_invoice"] = invoice
+                if stale is not None and ent.get("latest_invoice") == invoice:
+                    stale.discard(name)
+        else:
+            if kind == "purchase" and stale is not None and invoice and ent.get("latest_invoice") == invoice:
+                stale.add(name)
+            if ent["lines"] <= 0:
+                products.pop(name, None)
+                if stale is not None:
+                    stale.discard(name)
+
+def _build_stock_summary(products):
+    """Turn running per-product totals into the list saved as stock.json."""
     summary = []
     for name, rec in products.items():
         purchased = rec.get("purchased", 0)
@@ -258,9 +1832,200 @@ def compute_stock_from_files():
         })
     return summary
 
-def recompute_ledger():
-    purchases = load_json(PURCHASE_FILE)
-    sales = load_json(SALE_FILE)
+def _aggregate_stock(purchases, sales):
+    products = {}
+    for p in purchases:
+        _apply_stock_record(products, p, "purchase")
+    for s in sales:
+        _apply_stock_record(products, s, "sale")
+    return products
+
+def compute_stock_from_files():
+    """
+    Build stock summary from purchases and sales.
+    For each product compute: purchased, sold, available, avg_price, total value, latest_invoice.
+    Returns a list of dicts to be saved as stock.json.
+    Handles both old single-product records and new multi-product records.
+    """
+    return _build_stock_summary(_aggregate_stock(load_invoices(PURCHASE_FILE), load_invoices(SALE_FILE)))
+
+# -------------------------
+# Incremental stock engine
+# -------------------------
+class StockEngine:
+    """
+    Keeps running per-product totals (purchased, sold, purchase_value,
+    latest_invoice) in STOCK_STATE_FILE and applies per-invoice deltas for
+    add / update / delete instead of rescanning purchase.json and sale.json.
+    A full rebuild only happens when asked, or when the saved totals no longer
+    match the files they were built from.
+    """
+    SOURCES = {"purchase": PURCHASE_FILE, "sale": SALE_FILE}
+
+    def __init__(self, state_file=STOCK_STATE_FILE):
+        self.state_file = state_file
+        self.products = None
+        self.sources = {}
+        self.rebuilds = 0
+
+    def _load_state(self):
+        state = load_json(self.state_file)
+        if isinstance(state, dict) and isinstance(state.get("products"), dict):
+            self.products = state["products"]
+            self.sources = state.get("sources", {})
+        else:
+            self.products = None
+            self.sources = {}
+
+    def _save_state(self):
+        storage = get_storage()
+        self.sources = {kind: storage.signature(fn) for kind, fn in self.SOURCES.items()}
+        save_json(self.state_file, {"version": 1, "sources": self.sources, "products": self.products})
+
+    def is_consistent(self, changed=None):
+        """True if the saved totals were built from the current files (ignoring `changed`)."""
+        if self.products is None:
+            return False
+        storage = get_storage()
+        for kind, fn in self.SOURCES.items():
+            if kind != changed and self.sources.get(kind) != storage.signature(fn):
+                return False
+        return True
+
+    def rebuild(self):
+        """Recompute all totals from scratch and persist them."""
+        self.products = _aggregate_stock(load_invoices(PURCHASE_FILE), load_invoices(SALE_FILE))
+        self.rebuilds += 1
+        self._save_state()
+        return self.summary()
+
+    def ensure_loaded(self):
+        if self.products is None:
+            self._load_state()
+        if not self.is_consistent():
+            self.rebuild()
+
+    def apply(self, kind, old=None, new=None):
+        """
+        Apply one invoice change. kind is "purchase" or "sale";
+        add: old=None, new=rec / update: old, new / delete: old, new=None.
+        The data file for `kind` must already be saved.
+        """
+        if self.products is None:
+            self._load_state()
+        if not self.is_consistent(changed=kind):
+            return self.rebuild()
+        stale = set()
+        if old:
+            _apply_stock_record(self.products, Invoice.from_dict(old), kind, -1, stale)
+        if new:
+            _apply_stock_record(self.products, Invoice.from_dict(new), kind, 1, stale)
+        if stale:
+            return self.rebuild()
+        self._save_state()
+        return self.summary()
+
+    def summary(self):
+        self.ensure_loaded()
+        return _build_stock_summary(self.products)
+
+_stock_engine = None
+
+def get_stock_engine():
+    global _stock_engine
+    if _stock_engine is None:
+        _stock_engine = StockEngine()
+    return _stock_engine
+
+def update_stock(kind, old=None, new=None):
+    """Apply one purchase/sale change to the stock totals and save STOCK_FILE."""
+    summary = get_stock_engine().apply(kind, old, new)
+    save_json(STOCK_FILE, summary)
+    return summary
+
+def rebuild_stock():
+    """Full recompute of stock totals from purchase.json and sale.json."""
+    summary = get_stock_engine().rebuild()
+    save_json(STOCK_FILE, summary)
+    return summary
+
+def _ledger_txns(ledger, parties=None):
+    """Turn the transactions of `parties` (default: all) into LedgerTxn rows, in place."""
+    for party in (ledger if parties is None else parties):
+        ent = ledger.get(party)
+        if isinstance(ent, dict):
+            ent["transactions"] = [t if type(t) is LedgerTxn else LedgerTxn.from_dict(t)
+                                   for t in ent.get("transactions", [])]
+    return ledger
+
+def _ledger_dicts(ledger):
+    """The ledger in its JSON shape again (LedgerTxn rows back to dicts)."""
+    for ent in ledger.values():
+        if isinstance(ent, dict) and "transactions" in ent:
+            ent["transactions"] = [t.to_dict() if type(t) is LedgerTxn else t for t in ent["transactions"]]
+    return ledger
+
+def _ledger_index(ledger, parties=None):
+    """(party, type, invoice) -> LedgerTxn, first match wins (like the old find_txn)."""
+    index = {}
+    for party in (ledger if parties is None else parties):
+        for t in ledger.get(party, {}).get("transactions", []):
+            index.setdefault((party, t.type, t.invoice), t)
+    return index
+
+def _upsert_auto_txn(ledger, index, party, tx_type, rec):
+    """Create or refresh the automatic Purchase/Sale row for one Invoice."""
+    ent = ledger.setdefault(party, {"transactions": [], "purchases": 0.0, "sales": 0.0})
+    amount = _to_qty(rec.total)
+    key = (party, tx_type, rec.invoice)
+    txn = index.get(key)
+    if txn is not None:
+        txn.update(date=rec.date, type=tx_type, invoice=rec.invoice, credit="", debit="",
+                remaining=amount, amount=amount)
+    else:
+        txn = index[key] = LedgerTxn(rec.date, tx_type, rec.invoice, remaining=amount, amount=amount)
+        ent.setdefault("transactions", []).append(txn)
+    return ent, amount
+
+LEDGER_KINDS = {"purchase": ("Purchase", "purchases"), "sale": ("Sale", "sales")}
+LEDGER_STATE_FILE = "ledger_state.json"
+LEDGER_SOURCES = {"purchase": PURCHASE_FILE, "sale": SALE_FILE, "ledger": LEDGER_FILE}
+
+def save_ledger(ledger):
+    """
+    Save LEDGER_FILE and record the purchase/sale/ledger signatures it matches
+    in LEDGER_STATE_FILE, so the next incremental update can tell whether
+    the ledger is still in step with its sources (like _DerivedStore).
+    """
+    save_json(LEDGER_FILE, ledger)
+    storage = get_storage()
+    save_json(LEDGER_STATE_FILE, {"version": 1, "sources": {
+        name: storage.signature(fn) for name, fn in LEDGER_SOURCES.items()}})
+
+def _ledger_is_consistent(changed):
+    """True if nothing but the `changed` source moved since the last save_ledger()."""
+    state = load_json(LEDGER_STATE_FILE)
+    if not isinstance(state, dict) or not isinstance(state.get("sources"), dict):
+        return False
+    storage = get_storage()
+    for name, fn in LEDGER_SOURCES.items():
+        if name != changed and state["sources"].get(name) != storage.signature(fn):
+            return False
+    return True
+
+def recompute_ledger(kind=None, old=None, new=None):
+    """
+    Rebuild the automatic Purchase/Sale rows of the ledger, keeping manual rows.
+    With kind ("purchase"/"sale") and old/new records (like update_stock),
+    only the parties of that invoice are touched and re-propagated.
+    """
+    if kind is not None:
+        ledger = _recompute_ledger_parties(kind, old, new)
+        if ledger is not None:
+            return ledger
+
+    purchases = load_invoices(PURCHASE_FILE)
+    sales = load_invoices(SALE_FILE)
 
     # Load existing ledger (contains manual entries)
     existing = load_json(LEDGER_FILE)
@@ -272,75 +2037,56 @@ def recompute_ledger():
     # Copy old ledger safely
     for party, data in existing.items():
         ledger[party] = {
-            "transactions": [t.copy() for t in data.get("transactions", [])],
+            "transactions": [LedgerTxn.from_dict(t) for t in data.get("transactions", [])],
             "purchases": 0.0,
             "sales": 0.0
         }
 
-    # Helper to find matching purchase/sale row
-    def find_txn(txns, tx_type, invoice):
-        for i, t in enumerate(txns):
-            if t.get("type") == tx_type and t.get("invoice") == invoice:
-                return i
-        return None
+    index = _ledger_index(ledger)
 
-    # Process PURCHASE entries
-    for p in purchases:
-        party = p.get("party")
-        if not party:
-            continue
-        ledger.setdefault(party, {"transactions": [], "purchases": 0.0, "sales": 0.0})
-
-        amount = float(p.get("total", 0))
-        ledger[party]["purchases"] += amount
-
-        auto_txn = {
-            "date": p.get("date"),
-            "type": "Purchase",
-            "invoice": p.get("invoice"),
-            "credit": "",
-            "debit": "",
-            "remaining": amount,
-            "amount": amount
-        }
-
-        idx = find_txn(ledger[party]["transactions"], "Purchase", p.get("invoice"))
-        if idx is not None:
-            ledger[party]["transactions"][idx].update(auto_txn)
-        else:
-            ledger[party]["transactions"].append(auto_txn)
-
-    # Process SALE entries
-    for s in sales:
-        party = s.get("party")
-        if not party:
-            continue
-        ledger.setdefault(party, {"transactions": [], "purchases": 0.0, "sales": 0.0})
-
-        amount = float(s.get("total", 0))
-        ledger[party]["sales"] += amount
-
-        auto_txn = {
-            "date": s.get("date"),
-            "type": "Sale",
-            "invoice": s.get("invoice"),
-            "credit": "",
-            "debit": "",
-            "remaining": amount,
-            "amount": amount
-        }
-
-        idx = find_txn(ledger[party]["transactions"], "Sale", s.get("invoice"))
-        if idx is not None:
-            ledger[party]["transactions"][idx].update(auto_txn)
-        else:
-            ledger[party]["transactions"].append(auto_txn)
+    # Process PURCHASE and SALE entries
+    for kind_name, recs in (("purchase", purchases), ("sale", sales)):
+        tx_type, total_key = LEDGER_KINDS[kind_name]
+        for rec in recs:
+            party = rec.party
+            if not party:
+                continue
+            ent, amount = _upsert_auto_txn(ledger, index, party, tx_type, rec)
+            # rounded per step, exactly like the incremental path
+            ent[total_key] = round(ent[total_key] + amount, 2)
 
     # Now recalc remaining for each party WITHOUT deleting manual rows
     for party, ent in ledger.items():
         recalc_party_transactions(ent)
 
-    save_json(LEDGER_FILE, ledger)
+    save_ledger(_ledger_dicts(ledger))
+    return ledger
+
+def _recompute_ledger_parties(kind, old, new):
+    """Incremental part of recompute_ledger; None means fall back to a full rebuild."""
+    if not _ledger_is_consistent(kind):
+        return None
+    ledger = load_json(LEDGER_FILE)   # a private copy, changed in place below
+    if not isinstance(ledger, dict):
+        return None
+    tx_type, total_key = LEDGER_KINDS[kind]
+    old = Invoice.from_dict(old) if old else None
+    new = Invoice.from_dict(new) if new else None
+    parties = {r.party for r in (old, new) if r and r.party}
+    index = _ledger_index(_ledger_txns(ledger, parties), parties)
+
+    if old and old.party in ledger:
+        ent = ledger[old.party]
+        ent[total_key] = round(float(ent.get(total_key, 0) or 0) - _to_qty(old.total), 2)
+    if new and new.party:
+        ent, amount = _upsert_auto_txn(ledger, index, new.party, tx_type, new)
+        ent[total_key] = round(float(ent.get(total_key, 0) or 0) + amount, 2)
+
+    for party in parties:
+        if party in ledger:
+            recalc_party_transactions(ledger[party])
+
+    save_ledger(_ledger_dicts(ledger))
     return ledger
 
 #------------------------------
@@ -351,7 +2097,7 @@ def recalc_party_transactions(ledger_party):
     Recalculate the remaining values for all rows WITHOUT deleting any row.
     Formula:
         remaining = previous_remaining - credit + debit
-    Starts from first row.
+    Starts from first row. The transactions are LedgerTxn rows (_ledger_txns).
     """
     txns = ledger_party.get("transactions", [])
     if not txns:
@@ -363,50 +2109,1358 @@ def recalc_party_transactions(ledger_party):
 
     # First row sets the starting remaining
     first = txns[0]
-    prev_remaining = to_float(first.get("remaining") or first.get("amount") or 0)
+    prev_remaining = to_float(first.remaining or first.amount or 0)
 
-    first["remaining"] = round(prev_remaining, 2)
-    first["amount"] = round(to_float(first.get("amount")), 2)
+    first.update(remaining=round(prev_remaining, 2), amount=round(to_float(first.amount), 2))
 
     # Propagate remaining for all next rows
     for i in range(1, len(txns)):
         t = txns[i]
-        credit = to_float(t.get("credit"))
-        debit  = to_float(t.get("debit"))
+        credit = to_float(t.credit)
+        debit  = to_float(t.debit)
+
+        new_remaining = prev_remaining - credit + debit
+
+        t.update(remaining=round(new_remaining, 2), amount=round(to_float(t.amount), 2))
+
+        prev_remaining = new_remaining
+
+    ledger_party["last_amount"] = round(prev_remaining, 2)
+
+
+# -------------------------
+# Dashboard helpers
+# -------------------------
+KPI_STATE_FILE = "kpi_state.json"
+KPI_LATEST = 12
+
+def _kpi_id(value):
+    """Record id as an int for heap ordering (0 if missing or not numeric)."""
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+def _kpi_row(rec, seq):
+    """
+    Compact dashboard row: [date, id, seq, invoice, party, products, total].
+    date is a str and id an int, and seq is unique per store, so heap
+    comparisons never reach the free-form fields after it.
+    """
+    product_display = rec.get("product", "")
+    if not product_display and isinstance(rec.get("products"), list) and rec.get("products"):
+        product_display = ", ".join([x.get("product", "") for x in rec["products"][:2]])
+    return [str(rec.get("date") or ""), _kpi_id(rec.get("id")), seq, rec.get("invoice"), rec.get("party"),
+            product_display, rec.get("total")]
+
+class _DerivedStore:
+    """
+    Base for state derived from purchase.json / sale.json (KPIs, rollups):
+    kept in state_file with the storage signatures it was built from,
+    updated per invoice through apply() and rebuilt when those go stale.
+    Subclasses fill self.data in rebuild() and change it in _apply().
+    The lock lets the dashboard reconcile on a worker thread while the Tk
+    thread saves invoices.
+
+    With DELTAS, _apply() reports what it touched through _changed(path)
+    and apply() appends just those values (absolute, so replay is
+    idempotent) to a .delta.jsonl file next to state_file instead of
+    rewriting the whole state; the deltas are replayed on load and folded
+    into state_file every DELTA_COMPACT_EVERY applies.
+    """
+    SOURCES = {"purchase": PURCHASE_FILE, "sale": SALE_FILE}
+    VERSION = 1     # bump when the layout of data changes; older state is rebuilt
+    DELTAS = False
+    DELTA_COMPACT_EVERY = 500
+
+    def __init__(self, state_file):
+        self.state_file = state_file
+        self.delta_file = os.path.splitext(state_file)[0] + ".delta.jsonl"
+        self.data = None
+        self.sources = {}
+        self.rebuilds = 0
+        self.changes = set()
+        self.delta_seq = 0      # last delta written (or folded into state_file)
+        self.delta_lines = 0    # deltas waiting in delta_file
+        self.lock = threading.RLock()
+
+    def _load_state(self):
+        state = load_json(self.state_file)
+        if isinstance(state, dict) and state.get("version") == self.VERSION and isinstance(state.get("data"), dict):
+            self.data = state["data"]
+            self.sources = state.get("sources", {})
+            self.delta_seq = state.get("delta_seq", 0)
+            self.delta_lines = 0
+            if self.DELTAS:
+                self._replay_deltas()
+        else:
+            self.data = None
+            self.sources = {}
+
+    def _replay_deltas(self):
+        try:
+            with open(self.delta_file, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except OSError:
+            return
+        for line in lines:
+            try:
+                delta = json.loads(line)
+            except ValueError:
+                self.data = None    # torn write: rebuild rather than guess
+                return
+            if delta["seq"] <= self.delta_seq:
+                continue            # already folded into state_file
+            for path, value in delta["set"]:
+                parent = self.data
+                for key in path[:-1]:
+                    parent = parent.setdefault(key, {})
+                if value is None:
+                    parent.pop(path[-1], None)
+                else:
+                    parent[path[-1]] = value
+            self.sources = delta["sources"]
+            self.delta_seq = delta["seq"]
+            self.delta_lines += 1
+
+    def _changed(self, *path):
+        """Record that data[path[0]][path[1]]... changed (for DELTAS)."""
+        self.changes.add(path)
+
+    def _save_state(self, delta=False):
+        storage = get_storage()
+        self.sources = {kind: storage.signature(fn) for kind, fn in self.SOURCES.items()}
+        changes, self.changes = self.changes, set()
+        if delta and self.DELTAS and self.delta_lines < self.DELTA_COMPACT_EVERY:
+            sets = []
+            for path in sorted(changes):
+                value = self.data
+                for key in path:
+                    value = value.get(key) if isinstance(value, dict) else None
+                sets.append([list(path), value])
+            self.delta_seq += 1
+            line = json.dumps({"seq": self.delta_seq, "sources": self.sources, "set": sets},
+                              ensure_ascii=False, separators=(",", ":"))
+            with open(self.delta_file, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.delta_lines += 1
+            return
+        save_json(self.state_file, {"version": self.VERSION, "sources": self.sources,
+                                    "delta_seq": self.delta_seq, "data": self.data})
+        if self.delta_lines or (self.DELTAS and os.path.exists(self.delta_file)):
+            open(self.delta_file, "w").close()
+            self.delta_lines = 0
+
+    def is_consistent(self, changed=None):
+        if self.data is None:
+            return False
+        storage = get_storage()
+        for kind, fn in self.SOURCES.items():
+            if kind != changed and self.sources.get(kind) != storage.signature(fn):
+                return False
+        return True
+
+    def ensure_loaded(self):
+        with self.lock:
+            if self.data is None:
+                self._load_state()
+            if not self.is_consistent():
+                self.rebuild()
+
+    def apply(self, kind, old=None, new=None):
+        """Apply one invoice change (same arguments as StockEngine.apply)."""
+        with self.lock:
+            if self.data is None:
+                self._load_state()
+            if not self.is_consistent(changed=kind):
+                return self.rebuild()
+            self.changes = set()
+            if self._apply(kind, old, new) is False:
+                return self.rebuild()
+            self._save_state(delta=True)
+
+class KpiStore(_DerivedStore):
+    """
+    Materialized dashboard numbers per document type: running total, count
+    and the latest rows (a min-heap on (date, id, seq) holding up to twice
+    KPI_LATEST rows, so deletes rarely need a refill). Saved in KPI_STATE_FILE.
+    """
+
+    def __init__(self, state_file=KPI_STATE_FILE, latest=KPI_LATEST):
+        super().__init__(state_file)
+        self.latest = latest
+
+    def _push(self, ent, rec):
+        ent["seq"] = ent.get("seq", 0) + 1
+        row = _kpi_row(rec, ent["seq"])
+        heap = ent["latest"]
+        if len(heap) < 2 * self.latest:
+            heapq.heappush(heap, row)
+        elif row[:3] > heap[0][:3]:
+            heapq.heapreplace(heap, row)
+
+    def rebuild(self):
+        self.data = {}
+        for kind, fn in self.SOURCES.items():
+            ent = self.data[kind] = {"total": 0.0, "count": 0, "seq": 0, "latest": []}
+            for rec in load_json(fn):
+                ent["total"] += float(rec.get("total", 0) or 0)
+                ent["count"] += 1
+                self._push(ent, rec)
+        self.rebuilds += 1
+        self._save_state()
+
+    def _apply(self, kind, old, new):
+        ent = self.data[kind]
+        if old:
+            ent["total"] -= float(old.get("total", 0) or 0)
+            ent["count"] -= 1
+            heap = [r for r in ent["latest"] if r[1] != _kpi_id(old.get("id"))]
+            if len(heap) != len(ent["latest"]):
+                heapq.heapify(heap)
+                ent["latest"] = heap
+        if new:
+            ent["total"] += float(new.get("total", 0) or 0)
+            ent["count"] += 1
+            self._push(ent, new)
+        # False = a shown row was deleted and the spare rows ran out: rebuild
+        return len(ent["latest"]) >= min(self.latest, ent["count"])
+
+    def total(self, kind):
+        with self.lock:
+            self.ensure_loaded()
+            return round(self.data[kind]["total"], 2)
+
+    def latest_rows(self, kind, n=KPI_LATEST):
+        """Newest n rows as (invoice, date, party, products, total), newest first."""
+        with self.lock:
+            self.ensure_loaded()
+            rows = sorted(self.data[kind]["latest"], key=lambda r: r[:3], reverse=True)[:n]
+        return [(r[3], r[0], r[4], r[5], r[6]) for r in rows]
+
+_kpi_store = None
+
+def get_kpi_store():
+    global _kpi_store
+    if _kpi_store is None:
+        _kpi_store = KpiStore()
+    return _kpi_store
+
+def total_purchases_amount():
+    return get_kpi_store().total("purchase")
+
+def total_sales_amount():
+    return get_kpi_store().total("sale")
+
+def total_stock_value():
+    s = load_json(STOCK_FILE)
+    if not isinstance(s, list):
+        return 0.0
+    return round(sum(float(x.get("value", 0) or 0) for x in s), 2)
+
+def profit_or_loss():
+    return round(total_sales_amount() - total_purchases_amount(), 2)
+
+# -------------------------
+# Dashboard snapshot
+# -------------------------
+DASHBOARD_SNAPSHOT_FILE = "dashboard_snapshot.json"
+
+def dashboard_snapshot():
+    """Card values [purchases, sales, stock value, P/L] and latest rows, from the KPI store."""
+    kpis = get_kpi_store()
+    tp, ts = kpis.total("purchase"), kpis.total("sale")
+    return {
+        "version": 1,
+        "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "cards": [tp, ts, total_stock_value(), round(ts - tp, 2)],
+        "purchases": kpis.latest_rows("purchase"),
+        "sales": kpis.latest_rows("sale"),
+    }
+
+def save_dashboard_snapshot(snap=None):
+    """
+    Write the snapshot the dashboard paints from at launch. It is a plain
+    file outside the storage backend, so reading it opens nothing else.
+    """
+    snap = snap or dashboard_snapshot()
+    try:
+        _atomic_write_json(DASHBOARD_SNAPSHOT_FILE, snap, indent=None)
+    except OSError:
+        pass
+    return snap
+
+def load_dashboard_snapshot():
+    """Last saved snapshot, or None if missing or unreadable."""
+    try:
+        with open(DASHBOARD_SNAPSHOT_FILE, "r", encoding="utf-8") as f:
+            snap = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return snap if isinstance(snap, dict) and snap.get("version") == 1 else None
+
+# -------------------------
+# Period rollups
+# -------------------------
+ROLLUP_STATE_FILE = "rollup_state.json"
+ROLLUP_DIMS = ("product", "party")
+ROLLUP_METRICS = ("lines", "qty", "amount", "tax", "discount")
+
+def _rollup_lines(rec):
+    """Yield (product, [lines, qty, amount, tax, discount]) for each product line."""
+    prods = rec.get("products")
+    for line in prods if isinstance(prods, list) else [rec]:
+        name = str(line.get("product", "")).strip()
+        if name:
+            yield name, [1, _to_qty(line.get("qty")), _to_qty(line.get("total")),
+                         _to_qty(line.get("tax_amt")), _to_qty(line.get("discount_amt"))]
+
+def _period_keys(date_str):
+    """Day, month and year bucket keys for a record date ("YYYY-MM-DD ...")."""
+    day = str(date_str or "")[:10]
+    try:
+        datetime.strptime(day, "%Y-%m-%d")
+    except ValueError:
+        return ()
+    return day, day[:7], day[:4]
+
+def _range_buckets(date_from, date_to):
+    """Fewest day/month/year keys that exactly cover date_from..date_to (inclusive)."""
+    from datetime import timedelta
+    cur = datetime.strptime(date_from, "%Y-%m-%d").date()
+    end = datetime.strptime(date_to, "%Y-%m-%d").date()
+    keys = []
+    while cur <= end:
+        next_year = cur.replace(year=cur.year + 1, month=1, day=1)
+        next_month = (cur.replace(day=28) + timedelta(days=4)).replace(day=1)
+        if cur.month == 1 and cur.day == 1 and next_year - timedelta(days=1) <= end:
+            keys.append(f"{cur.year:04d}")
+            cur = next_year
+        elif cur.day == 1 and next_month - timedelta(days=1) <= end:
+            keys.append(cur.strftime("%Y-%m"))
+            cur = next_month
+        else:
+            keys.append(cur.isoformat())
+            cur += timedelta(days=1)
+    return keys
+
+class RollupStore(_DerivedStore):
+    """
+    Daily / monthly / yearly buckets of lines, qty, amount, tax and discount
+    per product and per party, for purchases and sales, keyed by each
+    record's date. A period query sums at most a few dozen buckets instead
+    of scanning the history. Saved in ROLLUP_STATE_FILE, with each invoice's
+    changed buckets appended to its delta file in between (see DELTAS).
+    """
+    DELTAS = True
+
+    def __init__(self, state_file=ROLLUP_STATE_FILE):
+        super().__init__(state_file)
+
+    def _add(self, kind, rec, sign):
+        keys = _period_keys(rec.get("date"))
+        if not keys:
+            return
+        party = str(rec.get("party", "") or "").strip()
+        dims = self.data.setdefault(kind, {d: {} for d in ROLLUP_DIMS})
+        for product, vals in _rollup_lines(rec):
+            for dim, name in (("product", product), ("party", party)):
+                if not name:
+                    continue
+                for key in keys:
+                    self._changed(kind, dim, key)
+                    bucket = dims[dim].setdefault(key, {})
+                    cur = bucket.setdefault(name, [0, 0.0, 0.0, 0.0, 0.0])
+                    for i, v in enumerate(vals):
+                        cur[i] += sign * v
+                    if cur[0] <= 0:
+                        del bucket[name]
+                        if not bucket:
+                            del dims[dim][key]
+
+    def rebuild(self):
+        self.data = {kind: {d: {} for d in ROLLUP_DIMS} for kind in self.SOURCES}
+        for kind, fn in self.SOURCES.items():
+            for rec in load_json(fn):
+                self._add(kind, rec, 1)
+        self.rebuilds += 1
+        self._save_state()
+
+    def _apply(self, kind, old, new):
+        if old:
+            self._add(kind, old, -1)
+        if new:
+            self._add(kind, new, 1)
+
+    def query(self, kind, dim, date_from, date_to):
+        """{name: {lines, qty, amount, tax, discount}} for a YYYY-MM-DD range (inclusive)."""
+        self.ensure_loaded()
+        buckets = self.data.get(kind, {}).get(dim, {})
+        out = {}
+        for key in _range_buckets(date_from, date_to):
+            for name, vals in buckets.get(key, {}).items():
+                cur = out.setdefault(name, [0, 0.0, 0.0, 0.0, 0.0])
+                for i, v in enumerate(vals):
+                    cur[i] += v
+        return {name: dict(zip(ROLLUP_METRICS, [vals[0]] + [round(v, 2) for v in vals[1:]]))
+                for name, vals in out.items()}
+
+    def period_totals(self, kind, date_from, date_to):
+        rows = self.query(kind, "product", date_from, date_to).values()
+        return {m: round(sum(r[m] for r in rows), 2) for m in ROLLUP_METRICS}
+
+_rollup_store = None
+
+def get_rollup_store():
+    global _rollup_store
+    if _rollup_store is None:
+        _rollup_store = RollupStore()
+    return _rollup_store
+
+# -------------------------
+# Cost of goods (FIFO / weighted average)
+# -------------------------
+COGS_STATE_FILE = "cogs_state.json"
+COGS_KINDS = {"purchase": 0, "sale": 1}   # same-day purchases are costed before sales
+
+def _cost_events(kind, rec):
+    """
+    Compact per-line events of one invoice: (product, [date, k, id, line_no, qty, unit]).
+    unit is the net (after discount, before tax) cost or selling price per unit.
+    """
+    k = COGS_KINDS[kind]
+    date = str(rec.get("date") or "")
+    prods = rec.get("products")
+    for line_no, line in enumerate(prods if isinstance(prods, list) else [rec]):
+        name = str(line.get("product", "")).strip()
+        qty = _to_qty(line.get("qty"))
+        if not name or qty <= 0:
+            continue
+        if "subtotal" in line:    # a 100% discount is a real zero price
+            unit = (_to_qty(line["subtotal"]) - _to_qty(line.get("discount_amt"))) / qty
+        else:
+            unit = _to_qty(line.get("rate"))
+        yield name, [date, k, rec.get("id") or 0, line_no, qty, unit]
+
+class CostEngine(_DerivedStore):
+    """
+    Inventory valuation per product with FIFO purchase lots and a moving
+    weighted average, consuming sales in (date, purchase-first, id) order.
+
+    data["products"][name] = {"lots": [[qty, unit_cost]], "avg": [qty, unit_cost],
+                              "last_cost": unit_cost, "last": [date, k, id, line]}
+    data["totals"] = [revenue, fifo_cogs, avg_cogs]
+    data["sales_size"], data["sales_lines"] = bytes / lines in sales_file
+
+    Only the open lots are kept. Per-sale margins {product: [revenue,
+    fifo_cogs, avg_cogs]} are appended to sales_file as [sale_id, margins]
+    lines (the last line of an id wins, null = deleted), so a save never
+    rewrites the earlier sales; they are read back only for sale_margin()
+    and edits.
+
+    An invoice dated after everything already seen for its products is
+    applied directly; an edit, delete or back-dated invoice replays the
+    products it touches from purchase.json / sale.json. Sales beyond the
+    lots on hand are costed at the last purchase cost.
+    """
+    DELTAS = True
+
+    def __init__(self, state_file=COGS_STATE_FILE):
+        super().__init__(state_file)
+        self.sales_file = os.path.splitext(state_file)[0] + ".sales.jsonl"
+        self.sales = None   # sale_id -> margins, read from sales_file on demand
+
+    @staticmethod
+    def _empty_product():
+        return {"lots": [], "avg": [0.0, 0.0], "last_cost": 0.0, "last": None}
+
+    def _run(self, prod, ev):
+        """Apply one event to the product's lots / average; a sale returns its [revenue, fifo, avg]."""
+        date, k, rec_id, line_no, qty, unit = ev
+        prod["last"] = ev[:4]
+        if k == COGS_KINDS["purchase"]:
+            prod["lots"].append([qty, unit])
+            aq, ac = prod["avg"]
+            prod["avg"] = [aq + qty, unit if aq <= 0 else (aq * ac + qty * unit) / (aq + qty)]
+            prod["last_cost"] = unit
+            return None
+        fifo, need, used = 0.0, qty, 0
+        lots = prod["lots"]
+        while need > 1e-9 and used < len(lots):
+            take = min(need, lots[used][0])
+            fifo += take * lots[used][1]
+            need -= take
+            if take >= lots[used][0] - 1e-9:
+                used += 1
+            else:
+                lots[used][0] -= take
+        if used:
+            del lots[:used]
+        fifo += need * prod["last_cost"]
+        aq, ac = prod["avg"]
+        avg_cost = qty * (ac if aq > 0 else prod["last_cost"])
+        prod["avg"] = [aq - qty, ac if aq > 0 else prod["last_cost"]]
+        return [qty * unit, fifo, avg_cost]
+
+    def _book(self, margins, name, vals, sign=1):
+        """Add (or with sign=-1 remove) one product's sale values to margins and the totals."""
+        cur = margins.setdefault(name, [0.0, 0.0, 0.0])
+        totals = self.data["totals"]
+        for i, v in enumerate(vals):
+            cur[i] += sign * v
+            totals[i] += sign * v
+        self._changed("totals")
+
+    def _events(self, names=None):
+        """Sorted cost events per product from the sources (only names, if given)."""
+        events = {}
+        for kind, fn in self.SOURCES.items():
+            for rec in load_json(fn):
+                for name, ev in _cost_events(kind, rec):
+                    if names is None or name in names:
+                        events.setdefault(name, []).append(ev)
+        for evs in events.values():
+            evs.sort(key=lambda ev: ev[:4])
+        return events
+
+    # ---- sales file ----
+    def _sales_size(self):
+        try:
+            return os.path.getsize(self.sales_file)
+        except OSError:
+            return 0
+
+    def _load_sales(self):
+        if self.sales is not None:
+            return
+        self.sales = {}
+        try:
+            with open(self.sales_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    sale_id, margins = json.loads(line)
+                    if margins is None:
+                        self.sales.pop(sale_id, None)
+                    else:
+                        self.sales[sale_id] = margins
+        except OSError:
+            pass
+
+    def _write_sales(self):
+        tmp = self.sales_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for sale_id, margins in self.sales.items():
+                f.write(json.dumps([sale_id, margins], ensure_ascii=False, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.sales_file)
+        self.data["sales_size"], self.data["sales_lines"] = self._sales_size(), len(self.sales)
+        self._changed("sales_size")
+        self._changed("sales_lines")
+
+    def _append_sales(self, changed):
+        """Append the current margins of the changed sale ids ({id: margins or None})."""
+        if not changed:
+            return
+        with open(self.sales_file, "a", encoding="utf-8") as f:
+            for sale_id, margins in changed.items():
+                f.write(json.dumps([sale_id, margins or None], ensure_ascii=False, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.data["sales_size"] = self._sales_size()
+        self.data["sales_lines"] = self.data.get("sales_lines", 0) + len(changed)
+        self._changed("sales_size")
+        self._changed("sales_lines")
+
+    # ---- _DerivedStore ----
+    def _load_state(self):
+        super()._load_state()
+        self.sales = None
+
+    def is_consistent(self, changed=None):
+        # the sales file must be exactly what the state last recorded
+        return super().is_consistent(changed) and self.data.get("sales_size") == self._sales_size()
+
+    def rebuild(self):
+        self.data = {"products": {}, "totals": [0.0, 0.0, 0.0]}
+        self.sales = {}
+        for name, events in self._events().items():
+            prod = self.data["products"][name] = self._empty_product()
+            for ev in events:
+                vals = self._run(prod, ev)
+                if vals:
+                    self._book(self.sales.setdefault(str(ev[2]), {}), name, vals)
+        self._write_sales()
+        self.rebuilds += 1
+        self._save_state()
+
+    def _apply(self, kind, old, new):
+        products = self.data["products"]
+        events = list(_cost_events(kind, new)) if new else []
+        if not old and all(name not in products or products[name]["last"] is None
+                           or ev[:4] > products[name]["last"] for name, ev in events):
+            margins = {}
+            for name, ev in events:
+                vals = self._run(products.setdefault(name, self._empty_product()), ev)
+                self._changed("products", name)
+                if vals:
+                    self._book(margins, name, vals)
+            if margins:
+                sale_id = str(new.get("id") or 0)
+                if self.sales is not None:
+                    self.sales[sale_id] = margins
+                self._append_sales({sale_id: margins})
+            return
+
+        # edit, delete or back-dated: replay the touched products from the sources
+        names = {name for name, _ in events}
+        names.update(name for name, _ in (_cost_events(kind, old) if old else ()))
+        self._load_sales()
+        replayed = {}   # sale_id -> {name: vals}
+        for name in names:
+            self._changed("products", name)
+            products.pop(name, None)
+        for name, evs in self._events(names).items():
+            prod = products[name] = self._empty_product()
+            for ev in evs:
+                vals = self._run(prod, ev)
+                if vals:
+                    cur = replayed.setdefault(str(ev[2]), {}).setdefault(name, [0.0, 0.0, 0.0])
+                    for i, v in enumerate(vals):
+                        cur[i] += v
+        sale_ids = set(replayed)
+        if kind == "sale" and old:
+            sale_ids.add(str(old.get("id") or 0))
+        changed = {}
+        for sale_id in sale_ids:
+            margins = self.sales.get(sale_id, {})
+            before = {name: margins[name] for name in names if name in margins}
+            after = replayed.get(sale_id, {})
+            if before == after:
+                continue
+            for name, vals in before.items():
+                self._book(margins, name, vals, -1)
+                del margins[name]
+            for name, vals in after.items():
+                self._book(margins, name, vals)
+            if margins:
+                self.sales[sale_id] = margins
+            else:
+                self.sales.pop(sale_id, None)
+            changed[sale_id] = margins
+        self._append_sales(changed)
+        if self.data["sales_lines"] > 2 * len(self.sales) + 1000:
+            self._write_sales()     # mostly superseded lines: rewrite
+
+    def sale_margin(self, sale_id):
+        """Revenue (net of discount, before tax), FIFO and average COGS and margins of one sale."""
+        with self.lock:
+            self.ensure_loaded()
+            self._load_sales()
+            rows = self.sales.get(str(sale_id), {}).values()
+            return self._margin([sum(r[i] for r in rows) for i in range(3)])
+
+    def totals(self):
+        self.ensure_loaded()
+        return self._margin(self.data["totals"])
+
+    @staticmethod
+    def _margin(vals):
+        revenue, fifo, avg = vals
+        return {"revenue": round(revenue, 2), "fifo_cogs": round(fifo, 2), "avg_cogs": round(avg, 2),
+                "fifo_margin": round(revenue - fifo, 2), "avg_margin": round(revenue - avg, 2)}
+
+    def valuation(self):
+        """{product: {qty, fifo_value, avg_cost, avg_value}} of the stock on hand."""
+        self.ensure_loaded()
+        out = {}
+        for name, prod in self.data["products"].items():
+            aq, ac = prod["avg"]
+            out[name] = {"qty": round(aq, 3),
+                         "fifo_value": round(sum(q * c for q, c in prod["lots"]), 2),
+                         "avg_cost": round(ac, 2), "avg_value": round(max(aq, 0) * ac, 2)}
+        return out
+
+_cost_engine = None
+
+def get_cost_engine():
+    global _cost_engine
+    if _cost_engine is None:
+        _cost_engine = CostEngine()
+    return _cost_engine
+
+# -------------------------
+# Offset-indexed record files
+# -------------------------
+RECORD_INDEX_FILE = "record_index.json"
+RECORD_SUFFIX = ".rec"
+RECORD_INDEX_SUFFIX = ".idx"
+RECORD_INDEX_ENTRY = "<QIHH"    # struct: offset, length (0 = deleted), id bytes, invoice bytes
+
+class RecordIndex(_DerivedStore):
+    """
+    Random access to single purchases/sales without parsing the history.
+    Each kind has a record file (purchase.rec / sale.rec, one compact JSON
+    record per line) read through mmap, and an index file (purchase.idx /
+    sale.idx) of appended RECORD_INDEX_ENTRY headers, each followed by the
+    id and invoice bytes: the latest entry of an id points at its line,
+    length 0 marks a delete. The index files are read once into
+    self.index[kind] = {"ids": {id: (offset, length, invoice)}, "invoices": {invoice: id}},
+    so a write appends one line and one entry and the state stays small:
+
+    data[kind] = {"size": bytes in the record file, "idx": bytes in the index file,
+                  "garbage": bytes of replaced lines}
+
+    The files are rewritten from scratch when the sources change behind its
+    back, either file doesn't match the state, or replaced lines outweigh live ones.
+    """
+
+    def __init__(self, state_file=RECORD_INDEX_FILE):
+        super().__init__(state_file)
+        self.maps = {}      # kind -> (mmap, mapped size)
+        self.index = {}
+
+    @staticmethod
+    def record_file(kind):
+        return os.path.splitext(_DerivedStore.SOURCES[kind])[0] + RECORD_SUFFIX
+
+    @staticmethod
+    def index_file(kind):
+        return os.path.splitext(_DerivedStore.SOURCES[kind])[0] + RECORD_INDEX_SUFFIX
+
+    @staticmethod
+    def _line(rec):
+        return (json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+    @staticmethod
+    def _entry(offset, length, key, invoice):
+        import struct
+        key, invoice = key.encode("utf-8"), invoice.encode("utf-8")
+        return struct.pack(RECORD_INDEX_ENTRY, offset, length, len(key), len(invoice)) + key + invoice
+
+    @staticmethod
+    def _point(index, offset, length, key, invoice):
+        """Apply one index entry to the in-memory maps."""
+        prev = index["ids"].pop(key, None)
+        if prev and index["invoices"].get(prev[2]) == key:
+            del index["invoices"][prev[2]]
+        if length:
+            index["ids"][key] = (offset, length, invoice)
+            if invoice:
+                index["invoices"][invoice] = key
+
+    def _read_index(self, kind):
+        import struct
+        index = {"ids": {}, "invoices": {}}
+        head = struct.calcsize(RECORD_INDEX_ENTRY)
+        try:
+            with open(self.index_file(kind), "rb") as f:
+                buf = f.read()
+        except OSError:
+            buf = b""
+        pos = 0
+        while pos + head <= len(buf):
+            offset, length, klen, ilen = struct.unpack_from(RECORD_INDEX_ENTRY, buf, pos)
+            pos += head
+            key = buf[pos:pos + klen].decode("utf-8")
+            invoice = buf[pos + klen:pos + klen + ilen].decode("utf-8")
+            pos += klen + ilen
+            self._point(index, offset, length, key, invoice)
+        self.index[kind] = index
+
+    def _close(self, kind=None):
+        for k in [kind] if kind else list(self.maps):
+            m = self.maps.pop(k, None)
+            if m:
+                m[0].close()
+
+    def _load_state(self):
+        super()._load_state()
+        self._close()
+        self.index = {}
+        if self.data is not None:
+            for kind in self.SOURCES:
+                self._read_index(kind)
+
+    def is_consistent(self, changed=None):
+        if not super().is_consistent(changed):
+            return False
+        for kind in self.SOURCES:
+            ent = self.data.get(kind)
+            if not ent or kind not in self.index or \
+               _file_signature(self.record_file(kind)) is None or \
+               os.path.getsize(self.record_file(kind)) != ent["size"] or \
+               _file_signature(self.index_file(kind)) is None or \
+               os.path.getsize(self.index_file(kind)) != ent["idx"]:
+                return False
+        return True
+
+    def rebuild(self):
+        self._close()
+        self.data = {}
+        self.index = {}
+        for kind, fn in self.SOURCES.items():
+            ent = self.data[kind] = {"size": 0, "idx": 0, "garbage": 0}
+            index = self.index[kind] = {"ids": {}, "invoices": {}}
+            path, idx_path = self.record_file(kind), self.index_file(kind)
+            with open(path + ".tmp", "wb") as f, open(idx_path + ".tmp", "wb") as fi:
+                for rec in load_json(fn):
+                    line = self._line(rec)
+                    key, invoice = str(rec.get("id")), str(rec.get("invoice") or "")
+                    if key in index["ids"]:
+                        ent["garbage"] += index["ids"][key][1]
+                    entry = self._entry(ent["size"], len(line), key, invoice)
+                    self._point(index, ent["size"], len(line), key, invoice)
+                    f.write(line)
+                    fi.write(entry)
+                    ent["size"] += len(line)
+                    ent["idx"] += len(entry)
+                for out in (f, fi):
+                    out.flush()
+                    os.fsync(out.fileno())
+            os.replace(path + ".tmp", path)
+            os.replace(idx_path + ".tmp", idx_path)
+        self.rebuilds += 1
+        self._save_state()
+
+    def _apply(self, kind, old, new):
+        ent, index = self.data[kind], self.index[kind]
+        rec = new or old
+        key = str(rec.get("id"))
+        if key in index["ids"]:
+            ent["garbage"] += index["ids"][key][1]
+        offset, length, invoice = ent["size"], 0, str(rec.get("invoice") or "")
+        if new:
+            line = self._line(new)
+            length = len(line)
+            with open(self.record_file(kind), "ab") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            ent["size"] += length
+        entry = self._entry(offset, length, key, invoice)
+        with open(self.index_file(kind), "ab") as f:
+            f.write(entry)
+            f.flush()
+            os.fsync(f.fileno())
+        ent["idx"] += len(entry)
+        self._point(index, offset, length, key, invoice)
+        # False = mostly replaced lines: rebuild compacts the record files
+        return ent["garbage"] <= max(ent["size"] - ent["garbage"], 1 << 20)
+
+    def _read(self, kind, span):
+        import mmap
+        offset, length = span[:2]
+        m = self.maps.get(kind)
+        if m is None or m[1] < offset + length:
+            self._close(kind)
+            with open(self.record_file(kind), "rb") as f:
+                m = self.maps[kind] = (mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), self.data[kind]["size"])
+        return json.loads(m[0][offset:offset + length].decode("utf-8"))
+
+    def get(self, kind, rec_id=None, invoice=None):
+        """One purchase/sale record by id or invoice number, or None."""
+        with self.lock:
+            self.ensure_loaded()
+            index = self.index[kind]
+            key = str(rec_id) if rec_id is not None else index["invoices"].get(str(invoice))
+            span = index["ids"].get(key) if key is not None else None
+            return self._read(kind, span) if span else None
+
+_record_index = None
+
+def get_record_index():
+    global _record_index
+    if _record_index is None:
+        _record_index = RecordIndex()
+    return _record_index
+
+# -------------------------
+# Headless invoice service
+# -------------------------
+HEADER_FIELDS = ("party", "phone", "address", "gst_no", "place_of_supply", "auth_sign", "notes")
+LINE_TOTAL_FIELDS = ("subtotal", "discount_amt", "tax_amt", "total")
+
+def make_product_line(product, unit="pcs", qty=0, rate=0, discount_pct=0, tax_pct=0, **extra):
+    """Build one product line dict (same shape the windows store) with calc_totals."""
+    product = str(product or "").strip()
+    if not product:
+        raise ValueError("Product name is required.")
+    try:
+        qty, rate = float(qty), float(rate)
+        discount_pct, tax_pct = float(discount_pct or 0), float(tax_pct or 0)
+    except (TypeError, ValueError):
+        raise ValueError(f"{product}: Qty / Rate / Discount / Tax must be numbers.")
+    subtotal, disc_amt, tax_amt, total = calc_totals(qty, rate, discount_pct, tax_pct)
+    line = {
+        "product": product,
+        "unit": str(unit or "").strip(),
+        "qty": qty,
+        "rate": rate,
+        "discount_pct": discount_pct,
+        "tax_pct": tax_pct,
+        "subtotal": subtotal,
+        "discount_amt": disc_amt,
+        "tax_amt": tax_amt,
+        "total": total
+    }
+    line.update(extra)
+    return line
+
+class InventoryService:
+    """
+    UI-free purchase/sale operations: invoice numbering, totals, stock,
+    ledger and Firebase sync. The Tk windows and scripts both call this.
+    Bad input raises ValueError.
+    """
+    KINDS = {
+        "purchase": (PURCHASE_FILE, "P", "purchases"),
+        "sale": (SALE_FILE, "S", "sales"),
+    }
+
+    def __init__(self, sync=True):
+        self.sync = sync
+
+    def _kind(self, kind):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown invoice kind: {kind}")
+        return self.KINDS[kind]
+
+    def peek_invoice(self, kind):
+        """(id, invoice) the next create() will use, without claiming it."""
+        fn, prefix, _ = self._kind(kind)
+        seq = next_id(fn)
+        return seq, next_invoice(prefix, fn, seq)
+
+    def build_invoice(self, kind, header, products, rec_id=None, date=None):
+        """
+        Record dict for header fields + product lines. rec_id=None allocates
+        a new id at save time; an explicit rec_id must still be unused.
+        The invoice number is always derived from the id actually claimed.
+        """
+        fn, prefix, _ = self._kind(kind)
+        header = header or {}
+        if not str(header.get("party", "")).strip():
+            raise ValueError("Party is required.")
+        if not products:
+            raise ValueError("Add at least one product.")
+        if rec_id is None:
+            rec_id = get_sequences().allocate(fn)
+        else:
+            claim_id(fn, rec_id)
+        rec = {
+            "id": rec_id,
+            "invoice": next_invoice(prefix, fn, rec_id),
+            "date": date or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        rec.update(self._fields(header, products))
+        return rec
+
+    def _fields(self, header, products):
+        fields = {k: header.get(k, "") for k in HEADER_FIELDS if k != "notes"}
+        fields["products"] = [dict(p) for p in products]
+        for key in LINE_TOTAL_FIELDS:
+            fields[key] = sum(float(p.get(key, 0) or 0) for p in products)
+        fields["notes"] = str(header.get("notes", "") or "").strip()
+        return fields
+
+    def _after_write(self, kind, old=None, new=None):
+        """
+        Bring every store derived from the invoice files up to date. The
+        record is already saved, so a store whose update fails is rebuilt
+        from the files instead; only a failed rebuild is left to report.
+        """
+        for name, apply, rebuild in (
+                ("stock", update_stock, rebuild_stock),
+                ("KPIs", get_kpi_store().apply, get_kpi_store().rebuild),
+                ("rollups", get_rollup_store().apply, get_rollup_store().rebuild),
+                ("cost of goods", get_cost_engine().apply, get_cost_engine().rebuild),
+                ("record index", get_record_index().apply, get_record_index().rebuild),
+                ("ledger", recompute_ledger, recompute_ledger)):
+            try:
+                apply(kind, old=old, new=new)
+            except Exception as e:
+                print(f"{name}: update after {kind} failed ({e}), rebuilding", file=sys.stderr)
+                try:
+                    rebuild()
+                except Exception as e:
+                    print(f"{name}: rebuild failed ({e})", file=sys.stderr)
+        save_dashboard_snapshot()
+        if self.sync:
+            sync_to_firebase(self._kind(kind)[2], "stock", "ledger")
+
+    def available_stock(self):
+        """product -> available qty, from the stock engine."""
+        return {s["product"]: s["available"] for s in self.stock_summary()}
+
+    def _check_stock(self, kind, products, old=None):
+        """Sales may not take more of a product than is in stock (ValueError)."""
+        if kind == "sale" and products:
+            check_stock_available(_stock_needed(products, old), self.available_stock())
+
+    def create(self, kind, header, products, rec_id=None, date=None):
+        self._check_stock(kind, products)
+        rec = self.build_invoice(kind, header, products, rec_id, date)
+        insert_record(self._kind(kind)[0], rec)
+        self._after_write(kind, new=rec)
+        return rec
+
+    def create_purchase(self, header, products, **kw):
+        return self.create("purchase", header, products, **kw)
+
+    def create_sale(self, header, products, **kw):
+        return self.create("sale", header, products, **kw)
+
+    def get(self, kind, rec_id=None, invoice=None):
+        """One record by id or invoice number (through the record index), or None."""
+        self._kind(kind)
+        return get_record_index().get(kind, rec_id=rec_id, invoice=invoice)
+
+    def update(self, kind, rec_id, header, products):
+        """Replace the product lines (and given header fields) of one invoice; id/invoice/date are kept."""
+        if not products:
+            raise ValueError("Add at least one product.")
+        rec = self.get(kind, rec_id)
+        if rec is None:
+            raise ValueError(f"{kind.title()} record {rec_id} not found.")
+        self._check_stock(kind, products, old=rec)
+        old = dict(rec)
+        merged = {k: rec.get(k, "") for k in HEADER_FIELDS}
+        merged.update(header or {})
+        rec = dict(rec)
+        rec.update(self._fields(merged, products))
+        update_record(self._kind(kind)[0], rec)
+        self._after_write(kind, old=old, new=rec)
+        return rec
+
+    def delete(self, kind, rec_id):
+        old = self.get(kind, rec_id)
+        if old is None:
+            raise ValueError(f"{kind.title()} record {rec_id} not found.")
+        delete_record(self._kind(kind)[0], rec_id)
+        self._after_write(kind, old=old)
+        return old
+
+    def stock_summary(self):
+        return get_stock_engine().summary()
+
+    def party_ledger(self, party):
+        """Ledger entry (transactions, purchases, sales, last_amount) for one party."""
+        ledger = load_json(LEDGER_FILE)
+        if not isinstance(ledger, dict):
+            return None
+        return ledger.get(party)
 
-        new_remaining = prev_remaining - credit + debit
+    def sale_margin(self, rec_id):
+        """Revenue, FIFO / average cost of goods and gross margin of one sale."""
+        return get_cost_engine().sale_margin(rec_id)
 
-        t["remaining"] = round(new_remaining, 2)
-        t["amount"] = round(to_float(t.get("amount")), 2)
+_service = None
 
-        prev_remaining = new_remaining
+def get_service():
+    global _service
+    if _service is None:
+        _service = InventoryService()
+    return _service
 
-    ledger_party["last_amount"] = round(prev_remaining, 2)
+# -------------------------
+# Bulk CSV import
+# -------------------------
+IMPORT_LINE_FIELDS = ("product", "unit", "qty", "rate", "discount_pct", "tax_pct")
+# accepted in the date column; saved as "%Y-%m-%d %H:%M:%S" like the app does
+IMPORT_DATE_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d",
+                       "%d-%m-%Y %H:%M:%S", "%d-%m-%Y %H:%M", "%d-%m-%Y", "%d/%m/%Y")
+
+def _import_date(value):
+    """Normalize one CSV date to "YYYY-MM-DD HH:MM:SS"; "" stays "" (import time)."""
+    if not value:
+        return ""
+    for fmt in IMPORT_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            pass
+    raise ValueError(f"Bad date {value!r} (use YYYY-MM-DD or DD-MM-YYYY, optionally with HH:MM:SS).")
 
+def _csv_invoice_groups(path):
+    """
+    Stream (first_line_no, [rows]) groups from a CSV with one product line per row.
+    Consecutive rows sharing the same "ref" column belong to one invoice;
+    without a ref column (or with an empty ref) every row is its own invoice.
+    """
+    import csv
+    with open(path, "r", newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        key, start, rows = None, 0, []
+        for line_no, row in enumerate(reader, start=2):
+            row = {str(k).strip().lower(): (v or "").strip() for k, v in row.items() if k}
+            row_key = row.get("ref") or ("line", line_no)
+            if rows and row_key != key:
+                yield start, rows
+                rows = []
+            if not rows:
+                key, start = row_key, line_no
+            rows.append(row)
+        if rows:
+            yield start, rows
+
+def import_invoices_csv(path, kind, dry_run=False, progress=None, sync=True, every=100):
+    """
+    Bulk-import purchases or sales from CSV in one pass.
+    Columns: ref, date, party, phone, address, gst_no, place_of_supply, auth_sign,
+    notes, product, unit, qty, rate, discount_pct, tax_pct (header fields are
+    read from the first row of each invoice; rows of one invoice share a ref,
+    without it each row is an invoice). Dates are checked and normalized per
+    row (see IMPORT_DATE_FORMATS). Lines are validated with
+    calc_totals via make_product_line; bad invoices (and sales for more than
+    is in stock) are skipped and reported.
+    Ids are reserved in one batch, the file is saved once, stock and ledger
+    are rebuilt once and Firebase is synced once. dry_run only validates.
+    progress(rows, invoices) is called every `every` rows and at the end.
+    Returns {"rows", "invoices", "errors", "records"}.
+    """
+    service = InventoryService(sync=False)
+    fn, prefix, fb_path = service._kind(kind)
+    pending, errors = [], []
+    rows_done = 0
+    # sales draw on stock as the batch goes, like saving them one by one would
+    available = service.available_stock() if kind == "sale" else None
+
+    for start, rows in _csv_invoice_groups(path):
+        reported = rows_done // every
+        rows_done += len(rows)
+        head = dict(rows[0])
+        try:
+            if not head.get("party"):
+                raise ValueError("Party is required.")
+            dates = {_import_date(r.get("date")) for r in rows}
+            if len(dates - {""}) > 1:
+                raise ValueError("Rows of one invoice have different dates.")
+            head["date"] = max(dates)
+            lines = []
+            for r in rows:
+                if not r.get("qty") or not r.get("rate"):
+                    raise ValueError(f"{r.get('product') or 'Line'}: Qty and Rate are required.")
+                lines.append(make_product_line(**{k: r[k] for k in IMPORT_LINE_FIELDS if r.get(k)}))
+            if available is not None:
+                need = _stock_needed(lines)
+                check_stock_available(need, available)
+                for name, qty in need.items():
+                    available[name] = available.get(name, 0) - qty
+            pending.append((head, lines))
+        except (TypeError, ValueError) as e:
+            errors.append((start, str(e)))
+        if progress and rows_done // every > reported:
+            progress(rows_done, len(pending))
+    if progress:
+        progress(rows_done, len(pending))
+
+    report = {"rows": rows_done, "invoices": len(pending), "errors": errors, "records": []}
+    if dry_run or not pending:
+        return report
+
+    first = get_sequences().reserve(fn, len(pending))
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    records = []
+    for offset, (head, lines) in enumerate(pending):
+        rec_id = first + offset
+        rec = {
+            "id": rec_id,
+            "invoice": next_invoice(prefix, fn, rec_id),
+            "date": head.get("date") or now,
+        }
+        rec.update(service._fields(head, lines))
+        records.append(rec)
+
+    db = load_json(fn)
+    db.extend(records)
+    save_json(fn, db)
+    rebuild_stock()
+    get_kpi_store().rebuild()
+    get_rollup_store().rebuild()
+    get_cost_engine().rebuild()
+    get_record_index().rebuild()
+    recompute_ledger()
+    save_dashboard_snapshot()
+    if sync:
+        sync_to_firebase(fb_path, "stock", "ledger")
+    report["records"] = records
+    return report
 
 # -------------------------
-# Dashboard helpers
+# Streaming exports
 # -------------------------
-def total_purchases_amount():
-    p = load_json(PURCHASE_FILE)
-    return round(sum(float(x.get("total", 0) or 0) for x in p), 2)
+INVOICE_LINE_EXPORT_FIELDS = (
+    "invoice", "date", "party", "phone", "gst_no", "place_of_supply",
+    "product", "unit", "qty", "rate", "discount_pct", "tax_pct",
+    "subtotal", "discount_amt", "tax_amt", "total")
+STOCK_EXPORT_FIELDS = ("product", "purchased", "sold", "available", "avg_price", "value", "unit", "latest_invoice")
+LEDGER_EXPORT_FIELDS = ("party", "date", "type", "invoice", "credit", "debit", "amount", "remaining")
+
+def _date_ok(value, date_from=None, date_to=None):
+    day = str(value or "")[:10]
+    return (not date_from or day >= date_from) and (not date_to or day <= date_to)
+
+def iter_invoice_records(fn, date_from=None, date_to=None, party=None):
+    """Purchase/sale records filtered by day range (YYYY-MM-DD, inclusive) and party."""
+    storage = get_storage()
+    if hasattr(storage, "iter_invoices"):
+        yield from storage.iter_invoices(fn, date_from, date_to, party)
+        return
+    for rec in load_json(fn):
+        if (not party or rec.get("party") == party) and _date_ok(rec.get("date"), date_from, date_to):
+            yield rec
+
+def iter_invoice_lines(fn, date_from=None, date_to=None, party=None):
+    """One row per product line, with the invoice header fields repeated."""
+    for rec in iter_invoice_records(fn, date_from, date_to, party):
+        head = {k: rec.get(k, "") for k in ("invoice", "date", "party", "phone", "gst_no", "place_of_supply")}
+        prods = rec.get("products")
+        for line in prods if isinstance(prods, list) else [rec]:
+            row = dict(head)
+            row.update({k: line.get(k, "") for k in INVOICE_LINE_EXPORT_FIELDS if k not in head})
+            yield row
+
+def iter_stock_rows():
+    stock = load_json(STOCK_FILE)
+    for r in stock if isinstance(stock, list) else []:
+        yield r
+
+def iter_ledger_rows(date_from=None, date_to=None, party=None):
+    ledger = load_json(LEDGER_FILE)
+    if not isinstance(ledger, dict):
+        return
+    for name in ([party] if party else list(ledger)):
+        for t in ledger.get(name, {}).get("transactions", []):
+            if _date_ok(t.get("date"), date_from, date_to):
+                row = {"party": name}
+                row.update(t)
+                yield row
+
+def _open_export(path):
+    if path.endswith(".gz"):
+        import gzip
+        return gzip.open(path, "wt", newline="", encoding="utf-8")
+    return open(path, "w", newline="", encoding="utf-8")
+
+def export_rows(rows, path, fields, headers=None):
+    """
+    Write dict rows to path one at a time: CSV, or JSON Lines when the name
+    ends in .jsonl; a trailing .gz gzips either. Returns the row count.
+    """
+    base = path[:-3] if path.endswith(".gz") else path
+    count = 0
+    with _open_export(path) as f:
+        if base.endswith(".jsonl"):
+            for row in rows:
+                f.write(json.dumps({k: row.get(k, "") for k in fields}, ensure_ascii=False) + "\n")
+                count += 1
+        else:
+            import csv
+            writer = csv.writer(f)
+            writer.writerow(headers or fields)
+            for row in rows:
+                writer.writerow([row.get(k, "") for k in fields])
+                count += 1
+    return count
+
+EXPORTS = {
+    "purchases": lambda **kw: (iter_invoice_lines(PURCHASE_FILE, **kw), INVOICE_LINE_EXPORT_FIELDS),
+    "sales": lambda **kw: (iter_invoice_lines(SALE_FILE, **kw), INVOICE_LINE_EXPORT_FIELDS),
+    "ledger": lambda **kw: (iter_ledger_rows(**kw), LEDGER_EXPORT_FIELDS),
+    "stock": lambda **kw: (iter_stock_rows(), STOCK_EXPORT_FIELDS),
+}
+
+def export_report(what, path, date_from=None, date_to=None, party=None):
+    """Export "purchases", "sales" (line items), "ledger" or "stock" to path."""
+    if what not in EXPORTS:
+        raise ValueError(f"Unknown export: {what}")
+    rows, fields = EXPORTS[what](date_from=date_from, date_to=date_to, party=party)
+    return export_rows(rows, path, fields)
 
-def total_sales_amount():
-    s = load_json(SALE_FILE)
-    return round(sum(float(x.get("total", 0) or 0) for x in s), 2)
+# -------------------------
+# Invoice / party search
+# -------------------------
+class SearchIndex:
+    """
+    Trigram index over invoice, party, phone, GST number and product names
+    of a purchase/sale list. A search matches when the term is a substring
+    of any one of those fields. If the new term contains the previous one,
+    only the previous hits are checked again.
+    """
+    FIELDS = ("invoice", "party", "phone", "gst_no")
+
+    def __init__(self, records):
+        self.records = records
+        self.texts = []
+        self.grams = {}
+        self.last_term = None
+        self.last_hits = None
+        for i, rec in enumerate(records):
+            text = self._text(rec)
+            self.texts.append(text)
+            for j in range(len(text) - 2):
+                self.grams.setdefault(text[j:j + 3], set()).add(i)
+
+    @classmethod
+    def _text(cls, rec):
+        parts = [str(rec.get(f, "") or "") for f in cls.FIELDS]
+        prods = rec.get("products")
+        if isinstance(prods, list):
+            parts.extend(str(p.get("product", "") or "") for p in prods)
+        elif rec.get("product"):
+            parts.append(str(rec.get("product")))
+        # NUL separator: a term can't match across two fields
+        return "\x00".join(parts).lower()
+
+    def search(self, term):
+        """Records matching `term` (case-insensitive), in file order."""
+        term = term.strip().lower()
+        if not term:
+            return list(self.records)
+        if self.last_term is not None and self.last_term in term:
+            candidates = self.last_hits
+        elif len(term) >= 3:
+            postings = sorted((self.grams.get(term[j:j + 3], set()) for j in range(len(term) - 2)), key=len)
+            candidates = sorted(set.intersection(*postings)) if postings[0] else []
+        else:
+            candidates = range(len(self.records))
+        hits = [i for i in candidates if term in self.texts[i]]
+        self.last_term, self.last_hits = term, hits
+        return [self.records[i] for i in hits]
 
-def total_stock_value():
-    s = load_json(STOCK_FILE)
-    if not isinstance(s, list):
-        return 0.0
-    return round(sum(float(x.get("value", 0) or 0) for x in s), 2)
+_search_indexes = {}
 
-def profit_or_loss():
-    return round(total_sales_amount() - total_purchases_amount(), 2)
+def search_records(fn, term):
+    """Search purchase.json / sale.json through a SearchIndex rebuilt only when the file changes."""
+    sig = get_storage().signature(fn)
+    ent = _search_indexes.get(fn)
+    if ent is None or sig is None or ent[0] != sig:
+        ent = _search_indexes[fn] = (sig, SearchIndex(load_json(fn)))
+    return ent[1].search(term)
 
 # -------------------------
 # Small utilities (UI)
 # -------------------------
+class Debouncer:
+    """Run `callback` once typing pauses for `delay_ms` (bind it to <KeyRelease>)."""
+
+    def __init__(self, widget, delay_ms, callback):
+        self.widget = widget
+        self.delay_ms = delay_ms
+        self.callback = callback
+        self.pending = None
+
+    def __call__(self, event=None):
+        if self.pending is not None:
+            self.widget.after_cancel(self.pending)
+        self.pending = self.widget.after(self.delay_ms, self._fire)
+
+    def _fire(self):
+        self.pending = None
+        self.callback()
+
 def color_rows(tree):
     """Alternate row background for readability."""
     for i, iid in enumerate(tree.get_children()):
@@ -415,6 +3469,123 @@ def color_rows(tree):
     tree.tag_configure("even", background="white")
     tree.tag_configure("odd", background="#f1fbff")
 
+class VirtualTable:
+    """
+    Windowed front-end for a Treeview holding large histories. The full row
+    list stays in Python and the tree holds at most `pages` pages of items.
+    When the view nears either edge the window slides by a page: the items
+    that fall out are rewritten with the incoming rows and moved to the
+    other end, so the item count stays flat however far the user scrolls,
+    and rows still in the window keep their item (and selection). The
+    scrollbar shows the position in the full list. Rows are striped by
+    their index in the full list, so no color_rows pass is needed.
+    """
+
+    def __init__(self, tree, scrollbar=None, page_size=100, pages=3):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.page_size = page_size
+        self.window = page_size * pages
+        self.rows = []
+        self.offset = 0     # index in rows of the first item in the tree
+        self._pending = False
+        tree.tag_configure("even", background="white")
+        tree.tag_configure("odd", background="#f1fbff")
+        tree.configure(yscrollcommand=self._on_yscroll)
+        if scrollbar is not None:
+            scrollbar.configure(command=self._on_scrollbar)
+
+    @staticmethod
+    def _tags(i):
+        return ("even" if i % 2 == 0 else "odd",)
+
+    def set_rows(self, rows):
+        """Replace the table contents with `rows` (tuples of column values)."""
+        self.tree.delete(*self.tree.get_children())
+        self.rows = list(rows)
+        self.offset = 0
+        for i, values in enumerate(self.rows[:self.window]):
+            self.tree.insert("", tk.END, values=values, tags=self._tags(i))
+
+    def _shift(self, offset):
+        """Slide the window to start at rows[offset], recycling the items that leave it."""
+        offset = max(0, min(offset, len(self.rows) - self.window))
+        delta = offset - self.offset
+        items = self.tree.get_children()
+        n = len(items)
+        if not delta or not n:
+            return
+        if abs(delta) >= n:
+            recycled = [(iid, offset + i) for i, iid in enumerate(items)]
+        elif delta > 0:
+            recycled = [(iid, self.offset + n + j) for j, iid in enumerate(items[:delta])]
+        else:
+            recycled = [(iid, offset + j) for j, iid in enumerate(items[n + delta:])]
+        selected = set(self.tree.selection())
+        gone = [iid for iid, _ in recycled if iid in selected]
+        if gone:
+            self.tree.selection_remove(*gone)
+        for j, (iid, i) in enumerate(recycled):
+            self.tree.item(iid, values=self.rows[i], tags=self._tags(i))
+            if abs(delta) < n:
+                self.tree.move(iid, "", tk.END if delta > 0 else j)
+        self.offset = offset
+
+    def delete(self, iid):
+        """Remove one shown row from the tree and the backing list."""
+        pos = self.tree.index(iid)
+        self.tree.delete(iid)
+        del self.rows[self.offset + pos]
+        n = len(self.tree.get_children())
+        if self.offset + n < len(self.rows):
+            # pull the next row in at the bottom
+            i = self.offset + n
+            self.tree.insert("", tk.END, values=self.rows[i], tags=self._tags(i))
+        elif self.offset > 0:
+            # at the end of the list: pull the previous row in at the top
+            self.offset -= 1
+            self.tree.insert("", 0, values=self.rows[self.offset], tags=self._tags(self.offset))
+            pos += 1
+        for i, child in enumerate(self.tree.get_children()[pos:], start=self.offset + pos):
+            self.tree.item(child, tags=self._tags(i))
+
+    def _on_yscroll(self, first, last):
+        first, last = float(first), float(last)
+        n, total = len(self.tree.get_children()), len(self.rows)
+        if self.scrollbar is not None:
+            if total:
+                self.scrollbar.set((self.offset + first * n) / total, (self.offset + last * n) / total)
+            else:
+                self.scrollbar.set(first, last)
+        if self._pending or last - first > 0.5:
+            return      # (a view taller than half the window has nowhere to slide)
+        if (last > 0.9 and self.offset + n < total) or (first < 0.1 and self.offset > 0):
+            self._pending = True
+            self.tree.after_idle(self._recenter)
+
+    def _recenter(self):
+        """Slide the window a page towards the view, keeping the same rows on screen."""
+        self._pending = False
+        n = len(self.tree.get_children())
+        if not n:
+            return
+        first, last = self.tree.yview()
+        top = self.offset + first * n
+        if last > 0.9:
+            self._shift(self.offset + self.page_size)
+        elif first < 0.1:
+            self._shift(self.offset - self.page_size)
+        self.tree.yview_moveto((top - self.offset) / n)
+
+    def _on_scrollbar(self, *args):
+        """Scrollbar drags jump the window anywhere in the full list; arrows scroll the tree."""
+        if args[0] != "moveto" or not self.rows:
+            return self.tree.yview(*args)
+        target = float(args[1]) * len(self.rows)
+        self._shift(int(target) - self.page_size)
+        n = len(self.tree.get_children())
+        self.tree.yview_moveto((target - self.offset) / n)
+
 # ---------- Helper: refresh stock window if open ----------
 def refresh_stock_if_open(parent):
     try:
@@ -431,6 +3602,336 @@ def refresh_stock_if_open(parent):
     except:
         pass
     
+# -------------------------
+# Bill PDF rendering (no UI)
+# -------------------------
+def iter_bill_rows(record):
+    """Printable product table rows (S.No, Product, Page No, HSN, Qty, Rate, Amount)."""
+    for sno, p in enumerate(record.get("products", []), start=1):
+        yield [str(sno), str(p.get("product", "")), str(p.get("page_no", "")), str(p.get("hsn", "")),
+               str(p.get("qty", "")), str(p.get("rate", "")), f"{float(p.get('subtotal', 0) or 0):.2f}"]
+
+def bill_rows(record):
+    return list(iter_bill_rows(record))
+
+def bill_pdf_path(record, folder=BILLS_DIR):
+    return os.path.join(folder, f"Invoice_{record.get('invoice','')}.pdf")
+
+BILL_COLUMNS = ["S.No", "Product", "Page No", "HSN", "Qty", "Rate", "Amount"]
+BILL_COL_WIDTHS = [40, 150, 60, 60, 50, 60, 70]
+BILL_BANK_LINES = [
+    "Central Bank Of India",
+    "Branch: Pitampura, Delhi-110034",
+    "A/c No: 5322181315",
+    "IFSC Code: CBIN0283490"
+]
+BILL_TERMS = [
+    "Goods once sold will not be taken back.",
+    "Our responsibility ceases once the goods are delivered.",
+    "All disputes subject to Delhi Jurisdiction.",
+    "Cheque in favour of Kidzibooks Publications"
+]
+
+class BillTemplate:
+    """
+    Static parts of the tax invoice, built once per process: the TableStyle,
+    the company header and the bank/terms/signature footer.
+
+    paint_rows draws the product table with draw_table instead of a Table
+    flowable. use_forms records the header and footer once per PDF as form
+    XObjects and places them with doForm, so a bill only draws its own data;
+    use_forms=False draws them directly (defining a form costs a little more
+    than drawing the ~20 strings once on a one-page bill).
+    """
+
+    def __init__(self, use_forms=True, paint_rows=True):
+        import weakref
+        load_reportlab()
+        self.use_forms = use_forms
+        self.forms = weakref.WeakKeyDictionary()   # canvas -> names of the forms defined in it
+        self.paint_rows = paint_rows
+        self.width, self.height = A4
+        self.margin = 20 * mm
+        self.table_style = TableStyle([
+            ("GRID", (0, 0), (-1, -1), 0.8, colors.darkgray),
+            ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#d1e0ff")),
+            ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+            ("FONTSIZE", (0, 0), (-1, -1), 9),
+            ("TEXTCOLOR", (0, 0), (-1, 0), colors.darkblue),
+            ("ALIGN", (0, 0), (-1, 0), "CENTER"),
+        ])
+        self.row_height = 18
+        self.bottom = 10 * mm   # lowest y a table row or the footer may reach
+        # footer height below its anchor: bank lines, gap, terms title + lines, signature
+        self.footer_depth = 12 * len(BILL_BANK_LINES) + 15 + 12 * (len(BILL_TERMS) + 1) + 20 + 24
+
+    def _header(self, c):
+        width, y = self.width, self.height - self.margin
+        c.setFillColorRGB(0, 0.2, 0.5)
+        c.setFont("Helvetica-Bold", 16)
+        c.drawCentredString(width/2, y, "Kidzibooks Publications")
+        y -= 18
+        c.setFont("Helvetica", 10)
+        c.setFillColorRGB(0.1, 0.1, 0.1)
+        c.drawCentredString(width/2, y, "A-32, Second Floor, Rishi Nagar, Rani Bagh, Delhi")
+        y -= 14
+        c.setFont("Helvetica-Bold", 11)
+        c.setFillColorRGB(0.2, 0.4, 0.1)
+        c.drawCentredString(width/2, y, "GST No. 07AIAPV0703B2ZU      TAX INVOICE      M: 9971052240")
+
+    def _footer(self, c):
+        """Footer drawn with its top line (first bank row) at y=0."""
+        x, m, width = self.margin, self.margin, self.width
+        c.setFont("Helvetica", 9)
+        c.setFillColorRGB(0.2, 0.2, 0.2)
+        y = 0
+        for line in BILL_BANK_LINES:
+            c.drawString(x, y, line)
+            y -= 12
+        y -= 15
+        c.setFillColorRGB(0, 0, 0)
+        c.drawString(x, y, "Terms and Conditions:")
+        y -= 12
+        for tt in BILL_TERMS:
+            c.drawString(x, y, tt)
+            y -= 12
+        y -= 20
+        c.setFont("Helvetica-Bold", 10)
+        c.setFillColorRGB(0.2, 0, 0.4)
+        c.drawString(x, y, "For Kidzibooks Publications")
+        y -= 24
+        c.setFont("Helvetica", 9)
+        c.setFillColorRGB(0.2, 0.2, 0.6)
+        c.drawRightString(width - m, y, "Authorized Sign")
+
+    def _place(self, c, name, draw, dy=0, form=None):
+        c.saveState()
+        c.translate(0, dy)
+        if self.use_forms if form is None else form:
+            defined = self.forms.setdefault(c, set())
+            if name not in defined:
+                defined.add(name)
+                c.beginForm(name, lowery=-self.height, uppery=self.height)
+                draw(c)
+                c.endForm()
+            c.doForm(name)
+        else:
+            draw(c)
+        c.restoreState()
+
+    def page_number(self, c, page):
+        c.saveState()
+        c.setFont("Helvetica", 8)
+        c.setFillColorRGB(0.3, 0.3, 0.3)
+        c.drawCentredString(self.width / 2, self.bottom / 2, f"Page {page}")
+        c.restoreState()
+
+    def header(self, c, form=None):
+        self._place(c, "bill_header", self._header, form=form)
+
+    def footer(self, c, y, form=None):
+        self._place(c, "bill_footer", self._footer, y, form=form)
+
+    def table(self, rows):
+        table = Table([BILL_COLUMNS] + rows, colWidths=BILL_COL_WIDTHS)
+        table.setStyle(self.table_style)
+        return table
+
+    def draw_table(self, c, x, top, rows):
+        """
+        Draw the product table with its top edge at `top`; returns the bottom y.
+        With paint_rows it looks the same as table(rows).drawOn (single-line
+        cells, 18pt rows) but uses one text object and one line path instead
+        of a string and a stroke per cell.
+        """
+        if not self.paint_rows:
+            table = self.table(rows)
+            table_width, table_height = table.wrapOn(c, self.width, self.height)
+            table.drawOn(c, x, top - table_height)
+            return top - table_height
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+        row_h = self.row_height
+        cols = [x]
+        for w in BILL_COL_WIDTHS:
+            cols.append(cols[-1] + w)
+        bottom = top - row_h * (len(rows) + 1)
+        c.saveState()
+        c.setFillColor(colors.HexColor("#d1e0ff"))
+        c.rect(x, top - row_h, cols[-1] - x, row_h, stroke=0, fill=1)
+        t = c.beginText()
+        t.setFont("Helvetica-Bold", 9, 12)
+        t.setFillColor(colors.darkblue)
+        y = top - row_h + 6   # bottom padding 3 + leading 12 - font size 9
+        for title, cx, w in zip(BILL_COLUMNS, cols, BILL_COL_WIDTHS):
+            t.setTextOrigin(cx + (w - stringWidth(title, "Helvetica-Bold", 9)) / 2.0, y)
+            t.textOut(title)
+        t.setFont("Helvetica", 9, 12)
+        t.setFillColor(colors.black)
+        for row in rows:
+            y -= row_h
+            for val, cx in zip(row, cols):
+                t.setTextOrigin(cx + 6, y)
+                t.textOut(str(val).replace("\n", " "))
+        c.drawText(t)
+        c.setStrokeColor(colors.darkgray)
+        c.setLineWidth(0.8)
+        lines = [(x, top - row_h * i, cols[-1], top - row_h * i) for i in range(len(rows) + 2)]
+        lines += [(cx, top, cx, bottom) for cx in cols]
+        c.lines(lines)
+        c.restoreState()
+        return bottom
+
+_bill_template = None
+
+def get_bill_template():
+    global _bill_template
+    if _bill_template is None:
+        _bill_template = BillTemplate()
+    return _bill_template
+
+def _bill_details(c, tpl, record):
+    """Date/invoice/party block of the first page; returns the table top y."""
+    width, height = A4
+    m = tpl.margin
+    x = m
+    y = height - m - 54
+    c.setFillColorRGB(0, 0, 0)
+    c.setFont("Helvetica", 9)
+    c.drawString(x, y, f"Date: {record.get('date','')}")
+    c.drawRightString(width-m, y, f"Invoice No: {record.get('invoice','')}")
+    y -= 20
+    c.drawString(x, y, f"Party: {record.get('party','')}")
+    y -= 12
+    c.drawString(x, y, f"Phone: {record.get('phone','')}")
+    y -= 12
+    c.drawString(x, y, f"Address: {record.get('address','')}")
+    y -= 20
+    c.drawRightString(width-m, y+40, f"GST No: {record.get('gst_no','')}")
+    c.drawRightString(width-m, y+25, f"Place of Supply: {record.get('place_of_supply','')}")
+    return y
+
+def _bill_continued(c, tpl, record):
+    """Short heading of a continuation page; returns the table top y."""
+    width, height = A4
+    m = tpl.margin
+    y = height - m - 54
+    c.setFillColorRGB(0, 0, 0)
+    c.setFont("Helvetica", 9)
+    c.drawString(m, y, f"Invoice No: {record.get('invoice','')} (continued)")
+    c.drawRightString(width - m, y, f"Party: {record.get('party','')}")
+    return y - 12
+
+def _bill_totals(c, tpl, record, y_after_table):
+    """Per-invoice text over the footer: totals beside the bank lines, signatory name."""
+    width, m = tpl.width, tpl.margin
+    right_rows = [
+        f"Subtotal: {float(record.get('subtotal', 0)):.2f}",
+        f"Discount: {float(record.get('discount_amt', 0)):.2f}",
+        f"Tax: {float(record.get('tax_amt', 0)):.2f}",
+        f"Grand Total: {float(record.get('total', 0)):.2f}"
+    ]
+    y_side = y_after_table
+    c.setFont("Helvetica", 9)
+    c.setFillColorRGB(0.1, 0.1, 0.5)
+    for right_text in right_rows:
+        c.drawRightString(width - m, y_side, right_text)
+        y_side -= 12
+    y_sig = y_side - 15 - 12 * (len(BILL_TERMS) + 1) - 20 - 10
+    auth_name = record.get("auth_sign", "").strip() or " "
+    c.setFont("Helvetica-Bold", 10)
+    c.setFillColorRGB(0.05, 0.05, 0.05)
+    c.drawRightString(width - m, y_sig, auth_name)
+
+def render_bill_pdf(record, file_pdf=None, rows=None, template=None):
+    """
+    Draw the Kidzibooks tax invoice for one record and return its path.
+    rows overrides the record's product rows (the preview passes its edited
+    table) and may be any iterable.
+
+    Rows are laid out page by page, holding at most one page of rows: a page
+    that is not the last ends with a "Carried forward" amount row and the
+    next starts with "Brought forward" under a repeated table header. The
+    bank/terms footer and totals go on the last page. A bill that fits on
+    one page looks exactly as before.
+    Written to a temp file and renamed, so a PDF is either complete or absent.
+    """
+    load_reportlab()
+    tpl = template or get_bill_template()
+    file_pdf = file_pdf or bill_pdf_path(record)
+    rows = iter(iter_bill_rows(record) if rows is None else rows)
+    os.makedirs(os.path.dirname(file_pdf) or ".", exist_ok=True)
+    tmp = file_pdf + ".tmp"
+    c = pdf_canvas.Canvas(tmp, pagesize=A4)
+    x = tpl.margin
+    row_h = tpl.row_height
+    page, running, pending = 1, 0.0, []
+    while True:
+        tpl.header(c, form=page > 1 or None)
+        top = _bill_details(c, tpl, record) if page == 1 else _bill_continued(c, tpl, record)
+        lead = [] if page == 1 else [["", "Brought forward", "", "", "", "", f"{running:.2f}"]]
+        # rows that fit above the footer (last page) / above the carried-forward row
+        fit_last = int((top - 20 - tpl.footer_depth - tpl.bottom) // row_h) - 1 - len(lead)
+        fit_page = int((top - tpl.bottom) // row_h) - 2 - len(lead)
+        for row in rows:
+            pending.append(row)
+            if len(pending) > fit_page:
+                break
+        if len(pending) <= max(fit_last, 0):
+            y_after_table = tpl.draw_table(c, x, top, lead + pending) - 20
+            tpl.footer(c, y_after_table, form=page > 1 or None)
+            _bill_totals(c, tpl, record, y_after_table)
+            if page > 1:
+                tpl.page_number(c, page)
+            break
+        # keep at least one row for the last page so the footer never stands alone
+        take = max(1, min(fit_page, len(pending) - 1))
+        chunk, pending = pending[:take], pending[take:]
+        for row in chunk:
+            try:
+                running += float(row[6])
+            except (IndexError, TypeError, ValueError):
+                pass
+        tpl.draw_table(c, x, top, lead + chunk + [["", "Carried forward", "", "", "", "", f"{running:.2f}"]])
+        tpl.page_number(c, page)
+        c.showPage()
+        page += 1
+    c.showPage()
+    c.save()
+    os.replace(tmp, file_pdf)
+    return file_pdf
+
+def _render_bill_job(job):
+    record, file_pdf = job
+    try:
+        return render_bill_pdf(record, file_pdf), None
+    except Exception as e:
+        if os.path.exists(file_pdf + ".tmp"):
+            os.remove(file_pdf + ".tmp")
+        return file_pdf, str(e)
+
+def render_bills(records, folder=BILLS_DIR, workers=None, progress=None):
+    """
+    Render many bills into folder across a process pool (workers=1 renders
+    in this process). progress(done, total) is called after each PDF.
+    Returns [(path, error_or_None)] in input order.
+    """
+    jobs = [(r, bill_pdf_path(r, folder)) for r in records]
+    total = len(jobs)
+    results = []
+    if workers == 1 or total < 2:
+        for job in jobs:
+            results.append(_render_bill_job(job))
+            if progress:
+                progress(len(results), total)
+        return results
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for res in pool.map(_render_bill_job, jobs, chunksize=max(1, total // ((workers or os.cpu_count() or 1) * 4))):
+            results.append(res)
+            if progress:
+                progress(len(results), total)
+    return results
+
 # -------------------------
 # Receipt & Bill helpers
 # -------------------------
@@ -490,6 +3991,7 @@ def save_receipt_text(parent, record, kind="Purchase"):
         filename = f"{kind.lower()}_receipt_{record.get('invoice')}.pdf"
         path = os.path.join(folder, filename)
         try:
+            load_reportlab()
             c = pdf_canvas.Canvas(path, pagesize=A4)
             width, height = A4
             y = height - 80
@@ -659,112 +4161,11 @@ def generate_bill_text(parent, record, kind="Sale"):
     tk.Label(sig, text="Authorized Signatory", font=("Arial", 10, "bold"), bg="white").pack(side=tk.RIGHT)
 
     def save_bill_pdf():
-        updated_products = []
+        rows = []
         for child in tbl.get_children():
             vals = tbl.item(child)["values"]
-            updated_products.append([
-                vals[0], vals[1], vals[2], vals[3],
-                str(vals[4]), str(vals[5]), str(vals[6])
-            ])
-        folder = BILLS_DIR
-        os.makedirs(folder, exist_ok=True)
-        filename = f"Invoice_{record.get('invoice','')}.pdf"
-        file_pdf = os.path.join(folder, filename)
-        c = pdf_canvas.Canvas(file_pdf, pagesize=A4)
-        width, height = A4
-        m = 20 * mm
-        x = m
-        y = height - m
-        # header
-        c.setFillColorRGB(0, 0.2, 0.5)
-        c.setFont("Helvetica-Bold", 16)
-        c.drawCentredString(width/2, y, "Kidzibooks Publications")
-        y -= 18
-        c.setFont("Helvetica", 10)
-        c.setFillColorRGB(0.1, 0.1, 0.1)
-        c.drawCentredString(width/2, y, "A-32, Second Floor, Rishi Nagar, Rani Bagh, Delhi")
-        y -= 14
-        c.setFont("Helvetica-Bold", 11)
-        c.setFillColorRGB(0.2, 0.4, 0.1)
-        c.drawCentredString(width/2, y, "GST No. 07AIAPV0703B2ZU      TAX INVOICE      M: 9971052240")
-        y -= 22
-        c.setFillColorRGB(0, 0, 0)
-        c.setFont("Helvetica", 9)
-        c.drawString(x, y, f"Date: {record.get('date','')}")
-        c.drawRightString(width-m, y, f"Invoice No: {record.get('invoice','')}")
-        y -= 20
-        c.drawString(x, y, f"Party: {record.get('party','')}")
-        y -= 12
-        c.drawString(x, y, f"Phone: {record.get('phone','')}")
-        y -= 12
-        c.drawString(x, y, f"Address: {record.get('address','')}")
-        y -= 20
-        c.drawRightString(width-m, y+40, f"GST No: {record.get('gst_no','')}")
-        c.drawRightString(width-m, y+25, f"Place of Supply: {record.get('place_of_supply','')}")
-        # table
-        data = [["S.No", "Product", "Page No", "HSN", "Qty", "Rate", "Amount"]]
-        # Convert tbl rows to printable rows
-        for child in tbl.get_children():
-            vals = tbl.item(child)["values"]
-            data.append([str(v) for v in vals])
-        table = Table(data, colWidths=[40, 150, 60, 60, 50, 60, 70])
-        table_style = TableStyle([
-            ("GRID", (0, 0), (-1, -1), 0.8, colors.darkgray),
-            ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#d1e0ff")),
-            ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-            ("FONTSIZE", (0, 0), (-1, -1), 9),
-            ("TEXTCOLOR", (0, 0), (-1, 0), colors.darkblue),
-            ("ALIGN", (0, 0), (-1, 0), "CENTER"),
-        ])
-        table.setStyle(table_style)
-        table_width, table_height = table.wrapOn(c, width, height)
-        table.drawOn(c, x, y - table_height)
-        y_after_table = (y - table_height) - 20
-        left_rows = [
-            "Central Bank Of India",
-            "Branch: Pitampura, Delhi-110034",
-            "A/c No: 5322181315",
-            "IFSC Code: CBIN0283490"
-        ]
-        right_rows = [
-            f"Subtotal: {float(record.get('subtotal', 0)):.2f}",
-            f"Discount: {float(record.get('discount_amt', 0)):.2f}",
-            f"Tax: {float(record.get('tax_amt', 0)):.2f}",
-            f"Grand Total: {float(record.get('total', 0)):.2f}"
-        ]
-        y_side = y_after_table
-        for left_text, right_text in zip(left_rows, right_rows):
-            c.setFillColorRGB(0.2, 0.2, 0.2)
-            c.drawString(x, y_side, left_text)
-            c.setFillColorRGB(0.1, 0.1, 0.5)
-            c.drawRightString(width - m, y_side, right_text)
-            y_side -= 12
-        y_terms = y_side - 15
-        c.setFillColorRGB(0, 0, 0)
-        c.drawString(x, y_terms, "Terms and Conditions:")
-        y_terms -= 12
-        for tt in [
-            "Goods once sold will not be taken back.",
-            "Our responsibility ceases once the goods are delivered.",
-            "All disputes subject to Delhi Jurisdiction.",
-            "Cheque in favour of Kidzibooks Publications"
-        ]:
-            c.drawString(x, y_terms, tt)
-            y_terms -= 12
-        y_sig = y_terms - 20
-        c.setFont("Helvetica-Bold", 10)
-        c.setFillColorRGB(0.2, 0, 0.4)
-        c.drawString(x, y_sig, "For Kidzibooks Publications")
-        auth_name = record.get("auth_sign", "").strip() or " "
-        y_sig -= 10
-        c.setFillColorRGB(0.05, 0.05, 0.05)
-        c.drawRightString(width - m, y_sig, auth_name)
-        y_sig -= 14
-        c.setFont("Helvetica", 9)
-        c.setFillColorRGB(0.2, 0.2, 0.6)
-        c.drawRightString(width - m, y_sig, "Authorized Sign")
-        c.showPage()
-        c.save()
+            rows.append([str(v) for v in vals])
+        file_pdf = render_bill_pdf(record, rows=rows)
         messagebox.showinfo("Saved", f"PDF saved:\n{file_pdf}",parent=win)
 
     tk.Button(frame, text="Save Bill as PDF", command=save_bill_pdf,
@@ -776,14 +4177,61 @@ def generate_bill_text(parent, record, kind="Sale"):
 class DashboardApp(tk.Tk):
     def __init__(self):
         super().__init__()
-        ensure_files_exist()
 
         self.title("Simple Inventory & Accounting (Kidzibooks)")
         self.geometry("1360x700+0+0")
         self.config(bg="#E8EAF6")
 
         self._build_ui()
-        self.refresh_dashboard()
+        startup_mark("ui")
+
+        # Paint from the last snapshot; the full data is reconciled in the background
+        snap = load_dashboard_snapshot()
+        if snap:
+            self.show_dashboard(snap)
+        startup_mark("snapshot")
+
+        # Reconcile and Firebase start once the first frame is on screen
+        self.sync_queue = None
+        self.reconciled = queue.Queue()
+        self.after_idle(self._after_first_frame)
+
+    def _after_first_frame(self):
+        self.update_idletasks()
+        startup_mark("first_frame")
+        threading.Thread(target=self._reconcile, name="dashboard-reconcile", daemon=True).start()
+        self.after(50, self._poll_reconcile)
+        init_firebase_in_background()
+
+    def _reconcile(self):
+        """
+        Worker: create/migrate the files, replay journals, bring the KPI store
+        up to date and save a fresh snapshot. Nothing else touches storage
+        until it is done (see data_buttons).
+        """
+        try:
+            ensure_files_exist()
+            self.reconciled.put(save_dashboard_snapshot())
+        except Exception as e:
+            self.reconciled.put(e)
+
+    def _poll_reconcile(self):
+        try:
+            res = self.reconciled.get_nowait()
+        except queue.Empty:
+            self.after(50, self._poll_reconcile)
+            return
+        startup_mark("data")
+        if isinstance(res, Exception):
+            # the data buttons stay disabled: the files are not safe to write
+            messagebox.showerror("Load failed", f"Could not load data:\n{res}", parent=self)
+        else:
+            self.show_dashboard(res)
+            for b in self.data_buttons:
+                b.state(["!disabled"])
+        # the sync queue reads the data files, so it waits for the reconcile
+        self.sync_queue = start_sync_queue()
+        self.after(500, self._poll_sync)
 
     # ============================================================
     # BUILD UI
@@ -817,6 +4265,11 @@ class DashboardApp(tk.Tk):
         ttk.Button(top, text="Exit", style="Stock.TButton",
                    command=self.on_exit).pack(side=tk.RIGHT, padx=12, pady=8)
 
+        # Firebase queue status
+        self.sync_var = tk.StringVar(value="Sync: starting...")
+        tk.Label(top, textvariable=self.sync_var, bg="#0a4661", fg="#B2EBF2",
+                 font=("Arial", 10)).pack(side=tk.RIGHT, padx=12)
+
         # ---------------- KPI CARDS ----------------
         cards = tk.Frame(self, pady=10, bg="#E8EAF6")
         cards.pack(fill=tk.X)
@@ -840,24 +4293,31 @@ class DashboardApp(tk.Tk):
 
             self.card_vars.append(v)
 
-        ttk.Button(cards, text="Refresh",style="Ledger.TButton",
-                   command=self.refresh_dashboard).pack(side=tk.RIGHT, padx=20)
+        # every button that touches the data files; disabled until the
+        # background reconcile (migration, journal replay) has finished
+        self.data_buttons = []
+
+        b = ttk.Button(cards, text="Refresh",style="Ledger.TButton",
+                       command=self.refresh_dashboard)
+        b.pack(side=tk.RIGHT, padx=20)
+        self.data_buttons.append(b)
 
         # ---------------- MAIN BUTTONS ----------------
         btns = tk.Frame(self, pady=8, bg="#E8EAF6")
         btns.pack(fill=tk.X)
 
-        ttk.Button(btns, text="Purchase", style="Purchase.TButton",
-                   command=lambda: PurchaseWindow(self)).pack(side=tk.LEFT, padx=6)
-
-        ttk.Button(btns, text="Sale", style="Sale.TButton",
-                   command=lambda: SaleWindow(self)).pack(side=tk.LEFT, padx=6)
+        for text, style_name, window in [("Purchase", "Purchase.TButton", PurchaseWindow),
+                                         ("Sale", "Sale.TButton", SaleWindow),
+                                         ("Stock", "Stock.TButton", StockWindow),
+                                         ("Ledger", "Ledger.TButton", LedgerWindow),
+                                         ("Reports", "Stock.TButton", ReportWindow)]:
+            b = ttk.Button(btns, text=text, style=style_name,
+                           command=lambda w=window: w(self))
+            b.pack(side=tk.LEFT, padx=6)
+            self.data_buttons.append(b)
 
-        ttk.Button(btns, text="Stock", style="Stock.TButton",
-                   command=lambda: StockWindow(self)).pack(side=tk.LEFT, padx=6)
-
-        ttk.Button(btns, text="Ledger", style="Ledger.TButton",
-                   command=lambda: LedgerWindow(self)).pack(side=tk.LEFT, padx=6)
+        for b in self.data_buttons:
+            b.state(["disabled"])
 
         # ---------------- LISTS (LEFT/RIGHT) ----------------
         lists = tk.Frame(self, bg="#E8EAF6")
@@ -933,45 +4393,36 @@ class DashboardApp(tk.Tk):
     # REFRESH DASHBOARD DATA
     # ============================================================
     def refresh_dashboard(self):
-        tp = total_purchases_amount()
-        ts = total_sales_amount()
-        sv = total_stock_value()
-        pl = profit_or_loss()
+        self.show_dashboard(save_dashboard_snapshot())
 
-        self.card_vars[0].set(f"₹ {tp}")
-        self.card_vars[1].set(f"₹ {ts}")
-        self.card_vars[2].set(f"₹ {sv}")
-        self.card_vars[3].set(f"₹ {pl}")
+    def show_dashboard(self, snap):
+        """Fill the cards and latest-12 tables from a dashboard snapshot."""
+        for var, value in zip(self.card_vars, snap["cards"]):
+            var.set(f"₹ {value}")
 
-        # Load latest 12 records in each table
-        for tree, fn in [(self.p_tree, PURCHASE_FILE),
-                         (self.s_tree, SALE_FILE)]:
+        for tree, key in [(self.p_tree, "purchases"),
+                          (self.s_tree, "sales")]:
 
             tree.delete(*tree.get_children())
-            recs = load_json(fn)
-            latest = sorted(recs, key=lambda r: r.get("date", ""),
-                            reverse=True)[:12]
-
-            for r in latest:
-                product_display = r.get("product", "")
-
-                if not product_display:
-                    if isinstance(r.get("products"), list) and r.get("products"):
-                        product_display = ", ".join(
-                            [x.get("product", "") for x in r["products"][:2]]
-                        )
-
-                tree.insert("", tk.END, values=(
-                    r.get("invoice"),
-                    r.get("date"),
-                    r.get("party"),
-                    product_display,
-                    r.get("total")
-                ))
+            for row in snap[key]:
+                tree.insert("", tk.END, values=row)
 
         color_rows(self.p_tree)
         color_rows(self.s_tree)
 
+    # ============================================================
+    # FIREBASE SYNC STATUS (results marshalled from the worker)
+    # ============================================================
+    def _poll_sync(self):
+        q = self.sync_queue
+        q.poll()
+        text = f"Sync: {q.depth()} pending"
+        if q.last_error:
+            text += f" | offline, retry in {int(q.retry_in)}s"
+        text += f" | last: {q.last_sync or 'never'}"
+        self.sync_var.set(text)
+        self.after(1000, self._poll_sync)
+
     # ============================================================
     # EXIT
     # ============================================================
@@ -1120,7 +4571,7 @@ class PurchaseWindow(tk.Toplevel):
             .pack(side=tk.LEFT)
         self.search_var = tk.Entry(search, width=40, bg="lightyellow")
         self.search_var.pack(side=tk.LEFT, padx=6)
-        self.search_var.bind("<KeyRelease>", lambda e: self.load_table())
+        self.search_var.bind("<KeyRelease>", Debouncer(self, 250, self.load_table))
 
         # -----------------------
         # PURCHASE RECORD TABLE (BOTTOM) WITH SCROLLBARS
@@ -1145,7 +4596,8 @@ class PurchaseWindow(tk.Toplevel):
         rec_vs = ttk.Scrollbar(table_frame, orient="vertical", command=self.tree.yview)
         rec_hs = ttk.Scrollbar(table_frame, orient="horizontal", command=self.tree.xview)
 
-        self.tree.configure(yscroll=rec_vs.set, xscroll=rec_hs.set)
+        self.tree.configure(xscroll=rec_hs.set)
+        self.table = VirtualTable(self.tree, rec_vs)
 
         # Proper grid placement
         self.tree.grid(row=0, column=0, sticky="nsew")
@@ -1277,6 +4729,9 @@ class PurchaseWindow(tk.Toplevel):
     # ---------------------------------------------------------------------
     # SAVE PURCHASE
     # ---------------------------------------------------------------------
+    def header_values(self):
+        return {k: self.inputs[k].get() for k in HEADER_FIELDS if k in self.inputs}
+
     def add_purchase(self):
         if not self.product_list:
             messagebox.showwarning("Empty", "Add at least one product.", parent=self)
@@ -1287,57 +4742,25 @@ class PurchaseWindow(tk.Toplevel):
             messagebox.showwarning("Missing", "Enter Supplier/Party.", parent=self)
             return
 
-        subtotal = sum(p["subtotal"] for p in self.product_list)
-        disc = sum(p["discount_amt"] for p in self.product_list)
-        tax = sum(p["tax_amt"] for p in self.product_list)
-        total = sum(p["total"] for p in self.product_list)
-
-        rec = {
-            "id": next_id(PURCHASE_FILE),
-            "invoice": next_invoice("P", PURCHASE_FILE),
-            "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "party": party,
-            "phone": self.inputs["phone"].get(),
-            "address": self.inputs["address"].get(),
-            "gst_no": self.inputs["gst_no"].get(),
-            "place_of_supply": self.inputs["place_of_supply"].get(),
-            "auth_sign": self.inputs["auth_sign"].get(),
-            "products": self.product_list.copy(),
-            "subtotal": subtotal,
-            "discount_amt": disc,
-            "tax_amt": tax,
-            "total": total,
-            "notes": self.inputs["notes"].get().strip()
-        }
+        service = get_service()
+        _, invoice = service.peek_invoice("purchase")
 
         # ⭐ ASK USER BEFORE SAVE — THIS WILL NOT CLOSE THE WINDOW
         if not messagebox.askokcancel(
             "Confirm Save",
-            f"Do you want to save this purchase?\nInvoice: {rec['invoice']}",
+            f"Do you want to save this purchase?\nInvoice: {invoice}",
             parent=self
         ):
             return  # user pressed Cancel
 
-
-        # ⭐ SAVE PURCHASE
-        db = load_json(PURCHASE_FILE)
-        db.append(rec)
-        save_json(PURCHASE_FILE, db)
-
-        # Update stock safely
+        # ⭐ SAVE PURCHASE (stock, ledger and Firebase sync happen in the service)
+        # The id is allocated at save time: another window may have used the
+        # peeked one meanwhile, so the saved message shows the real invoice.
         try:
-            save_json(STOCK_FILE, compute_stock_from_files())
-        except:
-            pass
-
-        # Update ledger safely
-        recompute_ledger()
-        # ---------------- FIREBASE SYNC ----------------
-        save_to_firebase("purchases", load_json(PURCHASE_FILE))
-        save_to_firebase("stock", load_json(STOCK_FILE))
-        save_to_firebase("ledger", load_json(LEDGER_FILE))
-        # -----------------------------------------------
-
+            rec = service.create_purchase(self.header_values(), self.product_list)
+        except ValueError as e:
+            messagebox.showwarning("Invalid", str(e), parent=self)
+            return
 
         # ⭐ Show Saved Message
         messagebox.showinfo(
@@ -1356,24 +4779,19 @@ class PurchaseWindow(tk.Toplevel):
     # LOAD TABLE
     # ---------------------------------------------------------------------
     def load_table(self):
-        self.tree.delete(*self.tree.get_children())
-
-        term = self.search_var.get().lower()
-        db = load_json(PURCHASE_FILE)
+        term = self.search_var.get().strip()
+        db = search_records(PURCHASE_FILE, term) if term else load_json(PURCHASE_FILE)
 
+        rows = []
         for r in db:
-            if term:
-                if term not in r.get("invoice","").lower() and term not in r.get("party","").lower():
-                    continue
-
-            self.tree.insert("", tk.END, values=(
+            rows.append((
                 r.get("id"), r.get("invoice"), r.get("date"), r.get("party"),
                 r.get("phone"), r.get("address"), r.get("gst_no"),
                 r.get("place_of_supply"), r.get("auth_sign"),
                 r.get("notes","")
             ))
 
-        color_rows(self.tree)
+        self.table.set_rows(rows)
 
     # ---------------------------------------------------------------------
     # LOAD SELECTED RECORD
@@ -1384,7 +4802,7 @@ class PurchaseWindow(tk.Toplevel):
             return
 
         tid = int(self.tree.item(sel[0])["values"][0])
-        rec = next((r for r in load_json(PURCHASE_FILE) if r["id"] == tid), None)
+        rec = get_service().get("purchase", rec_id=tid)
         if not rec:
             return
 
@@ -1415,8 +4833,6 @@ class PurchaseWindow(tk.Toplevel):
             return
 
         tid = int(self.tree.item(sel[0])["values"][0])
-        db = load_json(PURCHASE_FILE)
-        rec = next((r for r in db if r["id"] == tid), None)
 
         if not self.product_list:
             messagebox.showwarning("No Items", "Add at least one product.", parent=self)
@@ -1430,40 +4846,11 @@ class PurchaseWindow(tk.Toplevel):
         ):
             return
 
-        subtotal = sum(p["subtotal"] for p in self.product_list)
-        disc = sum(p["discount_amt"] for p in self.product_list)
-        tax = sum(p["tax_amt"] for p in self.product_list)
-        total = sum(p["total"] for p in self.product_list)
-
-        rec.update({
-            "party": self.inputs["party"].get(),
-            "phone": self.inputs["phone"].get(),
-            "address": self.inputs["address"].get(),
-            "gst_no": self.inputs["gst_no"].get(),
-            "place_of_supply": self.inputs["place_of_supply"].get(),
-            "auth_sign": self.inputs["auth_sign"].get(),
-            "products": [p.copy() for p in self.product_list],
-            "subtotal": subtotal,
-            "discount_amt": disc,
-            "tax_amt": tax,
-            "total": total,
-            "notes": self.inputs["notes"].get().strip()
-        })
-
-        save_json(PURCHASE_FILE, db)
-        # Firebase sync
-        save_to_firebase("purchases", load_json(PURCHASE_FILE))
-        save_to_firebase("sales", load_json(SALE_FILE))
-        save_to_firebase("stock", load_json(STOCK_FILE))
-        save_to_firebase("ledger", load_json(LEDGER_FILE))
-
-
         try:
-            save_json(STOCK_FILE, compute_stock_from_files())
-        except:
-            pass
-
-        recompute_ledger()
+            get_service().update("purchase", tid, self.header_values(), self.product_list)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e), parent=self)
+            return
 
         messagebox.showinfo("Updated", "Purchase updated successfully!", parent=self)
         self.load_table()
@@ -1483,20 +4870,11 @@ class PurchaseWindow(tk.Toplevel):
             return
 
         tid = int(self.tree.item(sel[0])["values"][0])
-        db = [r for r in load_json(PURCHASE_FILE) if r["id"] != tid]
-        save_json(PURCHASE_FILE, db)
-        save_to_firebase("purchases", load_json(PURCHASE_FILE))
-        save_to_firebase("sales", load_json(SALE_FILE))
-        save_to_firebase("stock", load_json(STOCK_FILE))
-        save_to_firebase("ledger", load_json(LEDGER_FILE))
-
-
         try:
-            save_json(STOCK_FILE, compute_stock_from_files())
-        except:
-            pass
-
-        recompute_ledger()
+            get_service().delete("purchase", tid)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e), parent=self)
+            return
 
         messagebox.showinfo("Deleted", "Purchase deleted successfully!", parent=self)
         self.load_table()
@@ -1511,7 +4889,10 @@ class PurchaseWindow(tk.Toplevel):
             messagebox.showwarning("Select", "Select a purchase.", parent=self)
             return
         invoice = self.tree.item(sel[0])["values"][1]
-        rec = next((r for r in load_json(PURCHASE_FILE) if r["invoice"] == invoice), None)
+        rec = get_service().get("purchase", invoice=invoice)
+        if not rec:
+            messagebox.showerror("Error", "Record not found.", parent=self)
+            return
         save_receipt_text(self, rec, kind="Purchase")
 
     def show_bill_selected(self):
@@ -1520,7 +4901,10 @@ class PurchaseWindow(tk.Toplevel):
             messagebox.showwarning("Select", "Select a purchase.", parent=self)
             return
         invoice = self.tree.item(sel[0])["values"][1]
-        rec = next((r for r in load_json(PURCHASE_FILE) if r["invoice"] == invoice), None)
+        rec = get_service().get("purchase", invoice=invoice)
+        if not rec:
+            messagebox.showerror("Error", "Record not found.", parent=self)
+            return
         generate_bill_text(self, rec, kind="Purchase")
 
 # -------------------------
@@ -1630,7 +5014,7 @@ class SaleWindow(tk.Toplevel):
         search_frame = tk.Frame(self, bg="#E8EAF6"); search_frame.pack(fill=tk.X, padx=8)
         tk.Label(search_frame, text="Search:", font=("Arial", 10, "bold"), bg="#E8EAF6").pack(side=tk.LEFT)
         self.search_var = tk.Entry(search_frame, bg="lightyellow", width=40); self.search_var.pack(side=tk.LEFT, padx=6)
-        self.search_var.bind("<KeyRelease>", lambda e: self.load_table())
+        self.search_var.bind("<KeyRelease>", Debouncer(self, 250, self.load_table))
 
         table_frame = tk.Frame(self); table_frame.pack(fill=tk.BOTH, expand=True, padx=8, pady=6)
         cols = ("id", "invoice", "date", "party", "phone", "address", "gst_no", "place_of_supply", "auth_sign", "ref_invoice", "notes")
@@ -1641,7 +5025,8 @@ class SaleWindow(tk.Toplevel):
             self.tree.column(c, width=150, anchor="center")
         vs = ttk.Scrollbar(table_frame, orient="vertical", command=self.tree.yview)
         hs = ttk.Scrollbar(table_frame, orient="horizontal", command=self.tree.xview)
-        self.tree.configure(yscroll=vs.set, xscroll=hs.set); 
+        self.tree.configure(xscroll=hs.set); 
+        self.table = VirtualTable(self.tree, vs)
         vs.pack(side=tk.RIGHT, fill=tk.Y); 
         hs.pack(side=tk.BOTTOM, fill=tk.X)
         self.tree.pack(fill=tk.BOTH, expand=True)
@@ -1803,57 +5188,23 @@ class SaleWindow(tk.Toplevel):
             return
 
         # -----------------------------------
-        # CALCULATE TOTALS
-        # -----------------------------------
-        subtotal = sum(p["subtotal"] for p in self.product_list)
-        discount = sum(p.get("discount_amt", 0) for p in self.product_list)
-        tax = sum(p.get("tax_amt", 0) for p in self.product_list)
-        total = sum(p.get("total", 0) for p in self.product_list)
-
-        # -----------------------------------
-        # CREATE SALE OBJECT
-        # -----------------------------------
-        rec = {
-            "id": next_id(SALE_FILE),
-            "invoice": next_invoice("S", SALE_FILE),
-            "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "party": self.inputs["party"].get(),
-            "phone": self.inputs["phone"].get(),
-            "address": self.inputs["address"].get(),
-            "gst_no": self.inputs["gst_no"].get(),
-            "place_of_supply": self.inputs["place_of_supply"].get(),
-            "auth_sign": self.inputs["auth_sign"].get(),
-            "products": self.product_list.copy(),
-            "subtotal": subtotal,
-            "discount_amt": discount,
-            "tax_amt": tax,
-            "total": total,
-            "notes": self.inputs.get("notes", tk.Entry()).get() if "notes" in self.inputs else ""
-        }
-
-        # -----------------------------------
-        # SAVE TO JSON (ONLY IF OK WAS PRESSED)
+        # SAVE (stock, ledger and Firebase sync happen in the service)
         # -----------------------------------
-        db = load_json(SALE_FILE)
-        db.append(rec)
-        save_json(SALE_FILE, db)
-
-        # UPDATE STOCK & LEDGER
-        save_json(STOCK_FILE, compute_stock_from_files())
-        recompute_ledger()
-        # ---------------- FIREBASE SYNC ----------------
-        save_to_firebase("sales", load_json(SALE_FILE))
-        save_to_firebase("stock", load_json(STOCK_FILE))
-        save_to_firebase("ledger", load_json(LEDGER_FILE))
-        # -----------------------------------------------
-
+        header = {k: self.inputs[k].get() for k in HEADER_FIELDS if k in self.inputs}
+        try:
+            rec = get_service().create_sale(header, self.product_list)
+        except ValueError as e:
+            messagebox.showwarning("Invalid", str(e), parent=self)
+            return
 
         # -----------------------------------
         # SHOW SUCCESS POPUP
         # -----------------------------------
+        m = get_service().sale_margin(rec["id"])
         messagebox.showinfo(
             "Saved",
-            f"Sale saved successfully!\nInvoice: {rec['invoice']}",
+            f"Sale saved successfully!\nInvoice: {rec['invoice']}\n"
+            f"Gross margin: ₹ {m['fifo_margin']} (FIFO), ₹ {m['avg_margin']} (avg cost)",
             parent=self
         )
 
@@ -1874,17 +5225,14 @@ class SaleWindow(tk.Toplevel):
         # load_table
         # -----------------------------------
     def load_table(self):
-        self.tree.delete(*self.tree.get_children())
-        db = load_json(SALE_FILE)
-        term = self.search_var.get().strip().lower()
+        term = self.search_var.get().strip()
+        db = search_records(SALE_FILE, term) if term else load_json(SALE_FILE)
+        rows = []
         for r in db:
-            if term:
-                if term not in r.get("invoice","").lower() and term not in r.get("party","").lower():
-                    continue
-            self.tree.insert("", tk.END, values=(r.get("id"), r.get("invoice"), r.get("date"), r.get("party"),
-                                                 r.get("phone"), r.get("address"), r.get("gst_no"), r.get("place_of_supply"),
-                                                 r.get("auth_sign"), r.get("invoice", ""), r.get("notes","")))
-        color_rows(self.tree)
+            rows.append((r.get("id"), r.get("invoice"), r.get("date"), r.get("party"),
+                         r.get("phone"), r.get("address"), r.get("gst_no"), r.get("place_of_supply"),
+                         r.get("auth_sign"), r.get("invoice", ""), r.get("notes","")))
+        self.table.set_rows(rows)
 
     def on_select(self):
         sel = self.tree.selection()
@@ -1892,9 +5240,8 @@ class SaleWindow(tk.Toplevel):
             return
         # Get selected sale ID
         tid = int(self.tree.item(sel[0])["values"][0])
-        # Load record from JSON
-        db = load_json(SALE_FILE)
-        rec = next((r for r in db if r.get("id") == tid), None)
+        # Load record through the offset index
+        rec = get_service().get("sale", rec_id=tid)
         if not rec:
             return
 
@@ -1966,13 +5313,6 @@ class SaleWindow(tk.Toplevel):
 
         tid = int(self.tree.item(sel[0])["values"][0])
 
-        db = load_json(SALE_FILE)
-        rec = next((r for r in db if r.get("id") == tid), None)
-
-        if not rec:
-            messagebox.showerror("Error", "Sale record not found.", parent=self)
-            return
-
         if not self.product_list:
             messagebox.showwarning("Empty", "Add at least one product.", parent=self)
             return
@@ -1980,43 +5320,12 @@ class SaleWindow(tk.Toplevel):
         if not messagebox.askokcancel("Confirm", "Update this sale?", parent=self):
             return
 
-        # Recalculate totals
-        subtotal = sum(p["subtotal"] for p in self.product_list)
-        discount_amt = sum(p["discount_amt"] for p in self.product_list)
-        tax_amt = sum(p["tax_amt"] for p in self.product_list)
-        total = sum(p["total"] for p in self.product_list)
-
-        # Update fields
-        rec.update({
-            "party": self.inputs["party"].get(),
-            "phone": self.inputs["phone"].get(),
-            "address": self.inputs["address"].get(),
-            "gst_no": self.inputs["gst_no"].get(),
-            "place_of_supply": self.inputs["place_of_supply"].get(),
-            "auth_sign": self.inputs["auth_sign"].get(),
-            "products": [p.copy() for p in self.product_list],
-            "subtotal": subtotal,
-            "discount_amt": discount_amt,
-            "tax_amt": tax_amt,
-            "total": total,
-            "notes": self.inputs.get("notes", tk.Entry()).get()
-        })
-
-        save_json(SALE_FILE, db)
-        # Firebase sync
-        save_to_firebase("purchases", load_json(PURCHASE_FILE))
-        save_to_firebase("sales", load_json(SALE_FILE))
-        save_to_firebase("stock", load_json(STOCK_FILE))
-        save_to_firebase("ledger", load_json(LEDGER_FILE))
-
-
-        # Recompute stock & ledger
+        header = {k: self.inputs[k].get() for k in HEADER_FIELDS if k in self.inputs}
         try:
-            save_json(STOCK_FILE, compute_stock_from_files())
-        except:
-            pass
-
-        recompute_ledger()
+            get_service().update("sale", tid, header, self.product_list)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e), parent=self)
+            return
 
         messagebox.showinfo("Updated", "Sale updated successfully!", parent=self)
         self.load_table()
@@ -2031,17 +5340,10 @@ class SaleWindow(tk.Toplevel):
             messagebox.showwarning("Select", "Select a record to delete.", parent=self); return
         if not messagebox.askyesno("Confirm", "Delete selected sale?", parent=self): return
         tid = int(self.tree.item(sel[0])["values"][0])
-        db = load_json(SALE_FILE); 
-        db = [r for r in db if r.get("id") != tid]; 
-        save_json(SALE_FILE, db)
-        
-        save_to_firebase("purchases", load_json(PURCHASE_FILE))
-        save_to_firebase("sales", load_json(SALE_FILE))
-        save_to_firebase("stock", load_json(STOCK_FILE))
-        save_to_firebase("ledger", load_json(LEDGER_FILE))
-
-        save_json(STOCK_FILE, compute_stock_from_files()); 
-        recompute_ledger()
+        try:
+            get_service().delete("sale", tid)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e), parent=self); return
         messagebox.showinfo("Deleted", "Sale deleted.", parent=self); 
         self.load_table()
 
@@ -2050,7 +5352,7 @@ class SaleWindow(tk.Toplevel):
         if not sel:
             messagebox.showwarning("Select", "Select a sale.", parent=self); return
         invoice = self.tree.item(sel[0])["values"][1]
-        db = load_json(SALE_FILE); rec = next((r for r in db if r.get("invoice") == invoice), None)
+        rec = get_service().get("sale", invoice=invoice)
         if not rec:
             messagebox.showerror("Error", "Record not found.", parent=self); return
         save_receipt_text(self, rec, kind="Sale")
@@ -2060,7 +5362,7 @@ class SaleWindow(tk.Toplevel):
         if not sel:
             messagebox.showwarning("Select", "Select a sale.", parent=self); return
         invoice = self.tree.item(sel[0])["values"][1]
-        db = load_json(SALE_FILE); rec = next((r for r in db if r.get("invoice") == invoice), None)
+        rec = get_service().get("sale", invoice=invoice)
         if not rec:
             messagebox.showerror("Error", "Record not found.", parent=self); return
         generate_bill_text(self, rec, kind="Sale")
@@ -2146,7 +5448,8 @@ class StockWindow(tk.Toplevel):
 
         vs = ttk.Scrollbar(frame, orient="vertical", command=self.tree.yview)
         hs = ttk.Scrollbar(frame, orient="horizontal", command=self.tree.xview)
-        self.tree.configure(yscroll=vs.set, xscroll=hs.set)
+        self.tree.configure(xscroll=hs.set)
+        self.table = VirtualTable(self.tree, vs)
 
         vs.pack(side=tk.RIGHT, fill=tk.Y)
         hs.pack(side=tk.BOTTOM, fill=tk.X)
@@ -2156,8 +5459,6 @@ class StockWindow(tk.Toplevel):
     # LOAD STOCK DATA
     # -----------------------------------------------------------
     def load_stock(self):
-        self.tree.delete(*self.tree.get_children())
-
         # Load stock.json
         try:
             stock = load_json(STOCK_FILE)
@@ -2168,8 +5469,9 @@ class StockWindow(tk.Toplevel):
         if not isinstance(stock, list):
             stock = []
 
+        rows = []
         for r in stock:
-            vals = (
+            rows.append((
                 r.get("product"),
                 r.get("purchased"),
                 r.get("sold"),
@@ -2178,18 +5480,16 @@ class StockWindow(tk.Toplevel):
                 round(float(r.get("value", 0)), 2),
                 r.get("unit"),
                 r.get("latest_invoice")
-            )
-            self.tree.insert("", tk.END, values=vals)
+            ))
 
-        color_rows(self.tree)
+        self.table.set_rows(rows)
 
     # -----------------------------------------------------------
     # RECOMPUTE STOCK FROM PURCHASE + SALE FILES
     # -----------------------------------------------------------
     def refresh_and_save_stock(self):
         try:
-            stock = compute_stock_from_files()  # recompute using your working function
-            save_json(STOCK_FILE, stock)
+            rebuild_stock()  # full recompute from purchase.json + sale.json
             self.load_stock()
             messagebox.showinfo("Updated", "Stock recomputed successfully!", parent=self)
         except Exception as e:
@@ -2208,28 +5508,10 @@ class StockWindow(tk.Toplevel):
             return
 
         try:
-            import csv
-            stock = load_json(STOCK_FILE)
-
-            with open(file, "w", newline="", encoding="utf-8") as f:
-                writer = csv.writer(f)
-
-                writer.writerow([
-                    "Product", "Purchased", "Sold", "Available",
-                    "Avg Price", "Value", "Unit", "Latest Invoice"
-                ])
-
-                for r in stock:
-                    writer.writerow([
-                        r.get("product"),
-                        r.get("purchased"),
-                        r.get("sold"),
-                        r.get("available"),
-                        r.get("avg_price"),
-                        r.get("value"),
-                        r.get("unit"),
-                        r.get("latest_invoice"),
-                    ])
+            export_rows(iter_stock_rows(), file, STOCK_EXPORT_FIELDS, headers=[
+                "Product", "Purchased", "Sold", "Available",
+                "Avg Price", "Value", "Unit", "Latest Invoice"
+            ])
 
             messagebox.showinfo("Exported", "CSV Export Successful!", parent=self)
 
@@ -2319,6 +5601,9 @@ class LedgerWindow(tk.Toplevel):
             self.tree.heading(col, text=txt)
             self.tree.column(col, width=150, anchor="center")
 
+        vs = ttk.Scrollbar(self, orient="vertical", command=self.tree.yview)
+        self.table = VirtualTable(self.tree, vs)
+        vs.pack(side=tk.RIGHT, fill=tk.Y, pady=6)
         self.tree.pack(fill=tk.BOTH, expand=True, padx=8, pady=6)
 
     # ---------------------------------------------------------------
@@ -2430,7 +5715,7 @@ class LedgerWindow(tk.Toplevel):
         ledger[party]["transactions"].append(new_txn)
         ledger[party]["last_amount"] = new_txn["remaining"]
 
-        save_json(LEDGER_FILE, ledger)
+        save_ledger(ledger)
         self.show_party()
 
         popup.destroy()
@@ -2454,7 +5739,8 @@ class LedgerWindow(tk.Toplevel):
             messagebox.showwarning("Select", "Select a party first.",parent=self)
             return
 
-        selected = self.tree.focus()
+        sel = self.tree.selection()
+        selected = sel[0] if sel else None
         if not selected:
             messagebox.showwarning("Select", "Please select a row to delete.",parent=self)
             return
@@ -2473,9 +5759,9 @@ class LedgerWindow(tk.Toplevel):
                     new_list.append(txn)
 
             ledger[party]["transactions"] = new_list
-            save_json(LEDGER_FILE, ledger)
+            save_ledger(ledger)
 
-        self.tree.delete(selected)
+        self.table.delete(selected)
 
         messagebox.showinfo("Deleted", "Selected row deleted successfully!",parent=self)
 
@@ -2489,32 +5775,154 @@ class LedgerWindow(tk.Toplevel):
             messagebox.showwarning("Select", "Select a party.", parent=self)
             return
 
-        self.tree.delete(*self.tree.get_children())
-
         ledger = load_json(LEDGER_FILE)
         ent = ledger.get(party, {})
 
-        for t in ent.get("transactions", []):
-            self.tree.insert(
-                "",
-                tk.END,
-                values=(
-                    t.get("date", ""),
-                    t.get("type", ""),
-                    t.get("invoice", ""),
-                    t.get("credit", ""),
-                    t.get("debit", ""),
-                    t.get("remaining", ""),
-                    t.get("amount", "")
-                )
+        self.table.set_rows(
+            (
+                t.get("date", ""),
+                t.get("type", ""),
+                t.get("invoice", ""),
+                t.get("credit", ""),
+                t.get("debit", ""),
+                t.get("remaining", ""),
+                t.get("amount", "")
             )
+            for t in ent.get("transactions", [])
+        )
+
+# -------------------------
+# ReportWindow
+# -------------------------
+class ReportWindow(tk.Toplevel):
+    """Period report from the rollup buckets: totals per product or party."""
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.title("Period Report")
+        self.geometry("980x560+40+90")
+        self.config(bg="#E8EAF6")
+        self._build_ui()
+        self.run_report()
+
+    def _build_ui(self):
+        bar = tk.Frame(self, pady=6, bg="#E8EAF6")
+        bar.pack(fill=tk.X, padx=8)
+
+        today = datetime.now()
+        self.from_var = tk.StringVar(value=today.strftime("%Y-%m-01"))
+        self.to_var = tk.StringVar(value=today.strftime("%Y-%m-%d"))
+        self.kind_var = tk.StringVar(value="sale")
+        self.dim_var = tk.StringVar(value="product")
+
+        tk.Label(bar, text="From", bg="#E8EAF6").pack(side=tk.LEFT)
+        tk.Entry(bar, textvariable=self.from_var, width=12).pack(side=tk.LEFT, padx=4)
+        tk.Label(bar, text="To", bg="#E8EAF6").pack(side=tk.LEFT)
+        tk.Entry(bar, textvariable=self.to_var, width=12).pack(side=tk.LEFT, padx=4)
+        ttk.Combobox(bar, textvariable=self.kind_var, values=("sale", "purchase"),
+                     width=10, state="readonly").pack(side=tk.LEFT, padx=6)
+        ttk.Combobox(bar, textvariable=self.dim_var, values=ROLLUP_DIMS,
+                     width=10, state="readonly").pack(side=tk.LEFT, padx=6)
+        ttk.Button(bar, text="Run", style="Ledger.TButton",
+                   command=self.run_report).pack(side=tk.LEFT, padx=6)
+
+        frame = tk.Frame(self)
+        frame.pack(fill=tk.BOTH, expand=True, padx=8, pady=6)
+        cols = ("name",) + ROLLUP_METRICS
+        self.tree = ttk.Treeview(frame, columns=cols, show="headings", height=16)
+        for c in cols:
+            self.tree.heading(c, text=c.title())
+            self.tree.column(c, width=220 if c == "name" else 120, anchor="w" if c == "name" else "e")
+        sb = ttk.Scrollbar(frame, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscroll=sb.set)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        sb.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.summary_var = tk.StringVar()
+        tk.Label(self, textvariable=self.summary_var, bg="#E8EAF6",
+                 font=("Arial", 11, "bold")).pack(anchor="w", padx=10, pady=(0, 8))
+
+    def run_report(self):
+        date_from, date_to = self.from_var.get().strip(), self.to_var.get().strip()
+        try:
+            t0 = time.perf_counter()
+            store = get_rollup_store()
+            rows = store.query(self.kind_var.get(), self.dim_var.get(), date_from, date_to)
+            sales = store.period_totals("sale", date_from, date_to)
+            purchases = store.period_totals("purchase", date_from, date_to)
+            ms = (time.perf_counter() - t0) * 1000
+        except ValueError:
+            messagebox.showerror("Dates", "Enter dates as YYYY-MM-DD.", parent=self)
+            return
+
+        self.tree.delete(*self.tree.get_children())
+        for name, vals in sorted(rows.items(), key=lambda kv: kv[1]["amount"], reverse=True):
+            self.tree.insert("", tk.END, values=(name,) + tuple(vals[m] for m in ROLLUP_METRICS))
+        color_rows(self.tree)
+        self.summary_var.set(
+            f"Sales ₹ {sales['amount']}   Purchases ₹ {purchases['amount']}   "
+            f"Sales - Purchases ₹ {round(sales['amount'] - purchases['amount'], 2)}   ({ms:.1f} ms)")
 
 # -------------------------
 # Start the app
 # -------------------------
 if __name__ == "__main__":
-    app = DashboardApp()
-    app.mainloop()
+    import multiprocessing
+    multiprocessing.freeze_support()   # render_bills workers in the PyInstaller build
+    startup_mark("imports")
+    if "--migrate-sqlite" in sys.argv:
+        # one-shot: python part2.py --migrate-sqlite  (then run with INVENTORY_STORAGE=sqlite)
+        n = migrate_json_to_sqlite(force="--force" in sys.argv)
+        print(f"Migrated {n} JSON documents into {DB_FILE}")
+    elif "--convert" in sys.argv:
+        # python part2.py --convert sale.json sale.col   (or back: sale.col sale.json)
+        # run with INVENTORY_FORMAT=columnar to keep purchase/sale history as .col files
+        i = sys.argv.index("--convert")
+        n = convert_invoice_file(sys.argv[i + 1], sys.argv[i + 2])
+        print(f"Converted {n} records to {sys.argv[i + 2]}")
+    elif "--export" in sys.argv:
+        # python part2.py --export sales|purchases|ledger|stock FILE[.csv|.jsonl][.gz]
+        #                 [--from YYYY-MM-DD] [--to YYYY-MM-DD] [--party NAME]
+        i = sys.argv.index("--export")
+        opt = lambda flag: sys.argv[sys.argv.index(flag) + 1] if flag in sys.argv else None
+        ensure_files_exist()
+        n = export_report(sys.argv[i + 1], sys.argv[i + 2],
+                          date_from=opt("--from"), date_to=opt("--to"), party=opt("--party"))
+        print(f"Exported {n} rows to {sys.argv[i + 2]}")
+    elif "--startup-report" in sys.argv:
+        # python part2.py --startup-report  (timings logged by previous app starts)
+        print(startup_report())
+    elif "--render-bills" in sys.argv:
+        # python part2.py --render-bills sales|purchases [--from D] [--to D] [--party P] [--workers N]
+        i = sys.argv.index("--render-bills")
+        opt = lambda flag: sys.argv[sys.argv.index(flag) + 1] if flag in sys.argv else None
+        ensure_files_exist()
+        fn = {"sales": SALE_FILE, "purchases": PURCHASE_FILE}[sys.argv[i + 1]]
+        records = list(iter_invoice_records(fn, opt("--from"), opt("--to"), opt("--party")))
+        t0 = time.perf_counter()
+        results = render_bills(records, workers=int(opt("--workers") or 0) or None,
+                               progress=lambda done, total: print(f"\r{done}/{total} PDFs", end="", flush=True))
+        print()
+        for path, err in results:
+            if err:
+                print(f"{path}: {err}")
+        print(f"Rendered {len(results)} bills into {BILLS_DIR} in {time.perf_counter() - t0:.1f}s")
+    elif "--import-csv" in sys.argv:
+        # python part2.py --import-csv purchase|sale FILE.csv [--dry-run]
+        i = sys.argv.index("--import-csv")
+        kind, path = sys.argv[i + 1], sys.argv[i + 2]
+        ensure_files_exist()
+        report = import_invoices_csv(
+            path, kind, dry_run="--dry-run" in sys.argv,
+            progress=lambda rows, n: print(f"\r{rows} rows, {n} invoices", end="", flush=True))
+        print()
+        for line_no, msg in report["errors"]:
+            print(f"line {line_no}: {msg}")
+        done = "validated" if "--dry-run" in sys.argv else "imported"
+        print(f"{report['invoices']} invoices {done}, {len(report['errors'])} skipped")
+    else:
+        app = DashboardApp()
+        app.mainloop()
 
 
 #----------this is 02-12-2025
\ No newline at end of file
@@ -0,0 +1,170 @@
+"""
+Benchmarks for the storage, sync and rendering paths. Run from the repo root:
+
+    python -m tests.benchmarks sync|columnar|records|pdf
+"""
+
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+from part2 import (
+    BillTemplate, FirebaseSync, Invoice, LINE_TOTAL_FIELDS, _aggregate_stock, _atomic_write_json,
+    bill_pdf_path, calc_totals, fb_keyed, make_product_line, read_columnar, render_bill_pdf,
+    render_bills, write_columnar,
+)
+from tests.fakes import FakeRealtimeDatabase
+
+def _sample_invoices(invoices, lines, seed=7):
+    """Synthetic sale history shaped like the app's records, for benchmarks."""
+    import random
+    rnd = random.Random(seed)
+    recs = []
+    for i in range(1, invoices + 1):
+        prods = []
+        for j in range(lines):
+            qty, rate = float(rnd.randint(1, 20)), float(rnd.choice([45, 60, 99, 120, 250]))
+            sub_, disc, tax, tot = calc_totals(qty, rate, 5, 12)
+            prods.append({"product": f"Book {rnd.randint(1, 400)}", "unit": "pcs", "qty": qty, "rate": rate,
+                          "discount_pct": 5.0, "tax_pct": 12.0, "subtotal": sub_,
+                          "discount_amt": disc, "tax_amt": tax, "total": tot})
+        recs.append({"id": i, "invoice": f"S{i:06d}", "date": f"2025-{i % 12 + 1:02d}-{i % 28 + 1:02d} 10:00:00",
+                     "party": f"Party {rnd.randint(1, 300)}", "phone": "98100 00000", "address": "Delhi",
+                     "gst_no": "", "place_of_supply": "Delhi", "auth_sign": "", "notes": "",
+                     "products": prods, "total": round(sum(p["total"] for p in prods), 2)})
+    return recs
+
+def benchmark_columnar(invoices=20000, lines=3, folder="bench_columnar"):
+    """File size and load time of the same history as JSON and as columnar."""
+    recs = _sample_invoices(invoices, lines)
+    os.makedirs(folder, exist_ok=True)
+    js, col = os.path.join(folder, "sale.json"), os.path.join(folder, "sale.col")
+    _atomic_write_json(js, recs)
+    write_columnar(col, recs)
+
+    def best(fn, runs=3):
+        out = None
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            data = fn()
+            dt = time.perf_counter() - t0
+            out = dt if out is None else min(out, dt)
+        return out, data
+
+    def load_json_file():
+        with open(js, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    t_json, a = best(load_json_file)
+    t_col, b = best(lambda: read_columnar(col))
+    assert a == b == recs
+    s_json, s_col = os.path.getsize(js), os.path.getsize(col)
+    print(f"{invoices} invoices x {lines} lines")
+    print(f"  json     : {s_json / 1e6:7.2f} MB  load {t_json * 1000:7.1f} ms")
+    print(f"  columnar : {s_col / 1e6:7.2f} MB  load {t_col * 1000:7.1f} ms"
+          f"  ({s_json / s_col:.1f}x smaller, {t_json / t_col:.1f}x faster)")
+    return {"json": (s_json, t_json), "columnar": (s_col, t_col)}
+
+def benchmark_firebase_sync(invoices=2000, edits=20):
+    """
+    Compare bytes sent by full-tree set() against delta sync on a fake
+    Realtime Database, for `edits` single-invoice updates.
+    """
+    import random
+    rnd = random.Random(7)
+    sales = [{
+        "id": i, "invoice": f"S{i:06d}", "date": f"2024-01-{i % 28 + 1:02d} 10:00:00",
+        "party": f"Party {i % 50}", "total": 100.0,
+        "products": [{"product": f"Book {j}", "unit": "pcs", "qty": 2, "rate": 50.0,
+                      "discount_pct": 0, "tax_pct": 0, "subtotal": 100.0, "total": 100.0}
+                     for j in range(3)]
+    } for i in range(invoices)]
+    full = FakeRealtimeDatabase()
+    delta_db = FakeRealtimeDatabase()
+    sync = FirebaseSync(delta_db, state_file=None)
+    sync.sync("sales", sales)
+    full.reference("sales").set(fb_keyed("sales", sales))
+    base_full, base_delta = full.bytes_sent, delta_db.bytes_sent
+    for _ in range(edits):
+        sales[rnd.randrange(invoices)]["total"] = round(rnd.uniform(1, 999), 2)
+        full.reference("sales").set(fb_keyed("sales", sales))
+        sync.sync("sales", sales)
+    assert delta_db.root == full.root
+    full_bytes = full.bytes_sent - base_full
+    delta_bytes = delta_db.bytes_sent - base_delta
+    print(f"{edits} edits over {invoices} invoices: full set() {full_bytes} bytes, "
+          f"delta update() {delta_bytes} bytes ({full_bytes / max(delta_bytes, 1):.0f}x less)")
+    return full_bytes, delta_bytes
+
+def benchmark_record_memory(invoices=100000, lines=3):
+    """Traced memory of a history held as dicts vs Invoice/LineItem, and stock aggregation time."""
+    import gc
+    import tracemalloc
+    text = json.dumps(_sample_invoices(invoices, lines))
+    sizes = {}
+    for name, build in (("dict", json.loads),
+                        ("slots", lambda t: [Invoice.from_dict(r) for r in json.loads(t)])):
+        gc.collect()
+        tracemalloc.start()
+        recs = build(text)
+        gc.collect()
+        sizes[name] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    t0 = time.perf_counter()
+    _aggregate_stock([], recs)
+    t_agg = time.perf_counter() - t0
+    print(f"{invoices} invoices x {lines} lines")
+    print(f"  dict  : {sizes['dict'] / 1e6:7.1f} MB")
+    print(f"  slots : {sizes['slots'] / 1e6:7.1f} MB  ({sizes['dict'] / sizes['slots']:.1f}x less)")
+    print(f"  stock aggregation over slotted records: {t_agg * 1000:.0f} ms")
+    return sizes
+
+def benchmark_bill_pdf(count=200, lines=12, folder="bench_bills"):
+    """
+    PDFs per second: a Table flowable with its style rebuilt per call (the
+    old save_bill_pdf way) against the cached BillTemplate, with and without
+    form XObjects, in-process and across the render_bills pool.
+    """
+    import shutil
+    record = {
+        "invoice": "BENCH", "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "party": "Benchmark School", "phone": "9999999999", "address": "Delhi",
+        "gst_no": "07AAAAA0000A1Z5", "place_of_supply": "Delhi", "auth_sign": "Admin",
+        "products": [make_product_line(f"Book {i}", "pcs", 10, 120, 5, 12) for i in range(lines)],
+    }
+    for key in LINE_TOTAL_FIELDS:
+        record[key] = round(sum(p[key] for p in record["products"]), 2)
+    records = [dict(record, invoice=f"BENCH{i:05d}") for i in range(count)]
+    os.makedirs(folder, exist_ok=True)
+
+    def run(label, render):
+        t0 = time.perf_counter()
+        render()
+        dt = time.perf_counter() - t0
+        print(f"{label:<28} {count / dt:8.1f} PDFs/s  ({dt / count * 1000:.2f} ms each)")
+
+    try:
+        render_bill_pdf(records[0], bill_pdf_path(records[0], folder))   # warm up fonts / imports
+        run("Table flowable, per call", lambda: [
+            render_bill_pdf(r, bill_pdf_path(r, folder), template=BillTemplate(use_forms=False, paint_rows=False))
+            for r in records])
+        plain = BillTemplate(use_forms=False)
+        run("cached template, no forms", lambda: [
+            render_bill_pdf(r, bill_pdf_path(r, folder), template=plain) for r in records])
+        run("cached template + forms", lambda: [render_bill_pdf(r, bill_pdf_path(r, folder)) for r in records])
+        run("cached template, pool", lambda: render_bills(records, folder))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+BENCHMARKS = {
+    "sync": benchmark_firebase_sync,
+    "columnar": benchmark_columnar,
+    "records": benchmark_record_memory,
+    "pdf": benchmark_bill_pdf,
+}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
@@ -0,0 +1,27 @@
+import pytest
+
+import part2
+
+# module-level singletons that hold on to files of the previous test's folder
+SINGLETONS = ("_storage", "_repository", "_firebase_sync", "_sync_queue", "_sequences",
+              "_stock_engine", "_kpi_store", "_rollup_store", "_cost_engine", "_record_index",
+              "_service", "_bill_template")
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Run every test in its own empty data folder with fresh singletons."""
+    monkeypatch.chdir(tmp_path)
+    for name in SINGLETONS:
+        monkeypatch.setattr(part2, name, None)
+    monkeypatch.setattr(part2, "_search_indexes", {})
+    return tmp_path
+
+@pytest.fixture
+def service():
+    """An initialized data folder with stock of products A, B and C to sell from."""
+    part2.ensure_files_exist()
+    svc = part2.InventoryService(sync=False)
+    svc.create("purchase", {"party": "Supplier"},
+               [part2.make_product_line(p, qty=1000, rate=1) for p in "ABC"],
+               date="2020-01-01 00:00:00")
+    return svc
@@ -0,0 +1,76 @@
+"""Offline stand-ins for the services part2 talks to."""
+
+import json
+
+from part2 import _fb_children
+
+class _FakeRef:
+    def __init__(self, fake, path):
+        self.fake = fake
+        self.parts = [p for p in path.split("/") if p]
+
+    def get(self):
+        node = self.fake.root
+        for p in self.parts:
+            if not isinstance(node, dict) or p not in node:
+                return None
+            node = node[p]
+        return node
+
+    def set(self, value):
+        self.fake._count(value)
+        self.fake._put(self.parts, value)
+
+    def update(self, values):
+        self.fake._count(values)
+        for key, value in values.items():
+            self.fake._put(self.parts + [p for p in key.split("/") if p], value)
+
+class FakeRealtimeDatabase:
+    """
+    In-memory stand-in for firebase_admin.db (reference().get/set/update)
+    that counts calls and JSON bytes sent, for measuring sync traffic offline.
+    """
+
+    def __init__(self):
+        self.root = {}
+        self.bytes_sent = 0
+        self.calls = 0
+
+    def reference(self, path="/"):
+        return _FakeRef(self, path)
+
+    def _count(self, payload):
+        self.calls += 1
+        self.bytes_sent += len(json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+
+    @staticmethod
+    def _normalize(value):
+        children = _fb_children(value)
+        if children is None:
+            return value
+        out = {}
+        for k, v in children.items():
+            v = FakeRealtimeDatabase._normalize(v)
+            if v is not None:   # Firebase stores no null or empty nodes
+                out[k] = v
+        return out or None
+
+    def _put(self, parts, value):
+        value = self._normalize(value)
+        if not parts:
+            self.root = value if isinstance(value, dict) else {}
+            return
+        node = self.root
+        trail = []
+        for p in parts[:-1]:
+            trail.append((node, p))
+            node = node.setdefault(p, {})
+        if value is None:
+            node.pop(parts[-1], None)
+            # Firebase drops empty parents
+            for parent, key in reversed(trail):
+                if not parent[key]:
+                    parent.pop(key)
+        else:
+            node[parts[-1]] = value
@@ -0,0 +1,59 @@
+import gc
+import os
+
+import pytest
+
+import part2
+
+pytest.importorskip("reportlab")
+
+def _record(i, lines=3):
+    return {"id": i, "invoice": f"S{i:06d}", "date": "2025-01-02 10:00:00", "party": "X",
+            "products": [part2.make_product_line(f"Book {j}", qty=2, rate=50) for j in range(lines)],
+            "total": 100.0 * lines}
+
+def _is_pdf(path):
+    with open(path, "rb") as f:
+        return f.read(5) == b"%PDF-"
+
+def test_render_bill_pdf_writes_a_complete_file(tmp_path):
+    path = part2.render_bill_pdf(_record(1), str(tmp_path / "out" / "bill.pdf"))
+    assert _is_pdf(path)
+    assert os.listdir(tmp_path / "out") == ["bill.pdf"]     # no temp file left behind
+
+def test_render_bills_in_process_and_in_a_pool(tmp_path):
+    records = [_record(i) for i in range(1, 5)]
+    seen = []
+    results = part2.render_bills(records, str(tmp_path / "a"), workers=1,
+                                 progress=lambda done, total: seen.append((done, total)))
+    assert seen == [(1, 4), (2, 4), (3, 4), (4, 4)]
+    assert [err for _, err in results] == [None] * 4
+    results = part2.render_bills(records, str(tmp_path / "b"), workers=2)
+    assert [os.path.basename(p) for p, _ in results] == [f"Invoice_S{i:06d}.pdf" for i in range(1, 5)]
+    assert all(_is_pdf(p) for p, _ in results)
+
+def test_template_defines_each_form_once_per_canvas(tmp_path):
+    from reportlab.pdfgen import canvas as pdf_canvas
+    tpl = part2.BillTemplate()
+    assert tpl.use_forms
+    first = pdf_canvas.Canvas(str(tmp_path / "a.pdf"))
+    for _ in range(2):
+        tpl.header(first)
+        tpl.footer(first, 200)
+        first.showPage()
+    second = pdf_canvas.Canvas(str(tmp_path / "b.pdf"))
+    tpl.header(second)
+    assert tpl.forms[first] == {"bill_header", "bill_footer"}
+    assert tpl.forms[second] == {"bill_header"}
+    assert not hasattr(first, "_bill_forms")
+    first.save()
+    del first
+    gc.collect()
+    assert list(tpl.forms) == [second]
+
+def test_long_bill_is_paginated_and_defines_its_forms_once(tmp_path):
+    path = part2.render_bill_pdf(_record(1, lines=60), str(tmp_path / "long.pdf"))
+    with open(path, "rb") as f:
+        pdf = f.read()
+    assert pdf.count(b"/Type /Page\n") >= 3
+    assert pdf.count(b"/Subtype /Form") == 2       # header and footer, shared by every page
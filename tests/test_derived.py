@@ -0,0 +1,180 @@
+import random
+
+import part2
+
+def _line(rnd):
+    return part2.make_product_line(rnd.choice("ABC"), qty=rnd.randint(1, 9), rate=rnd.randint(10, 50) + 0.33,
+                                   discount_pct=rnd.choice([0, 5, 100]), tax_pct=18)
+
+def _random_history(svc, steps=80, seed=7, parties=("X", "Y", "Z")):
+    """Random creates / updates / deletes through the service; returns the ids still alive."""
+    rnd = random.Random(seed)
+    ids = {"purchase": [], "sale": []}
+    for _ in range(steps):
+        kind = rnd.choice(["purchase", "sale"])
+        op = rnd.random()
+        lines = [_line(rnd) for _ in range(rnd.randint(1, 3))]
+        date = f"2026-0{rnd.randint(1, 9)}-{rnd.randint(10, 28)} 10:00:00" if rnd.random() < 0.3 else None
+        if op < 0.6 or not ids[kind]:
+            ids[kind].append(svc.create(kind, {"party": rnd.choice(parties)}, lines, date=date)["id"])
+        elif op < 0.8:
+            svc.update(kind, rnd.choice(ids[kind]), {"party": rnd.choice(parties)}, lines)
+        else:
+            rec_id = rnd.choice(ids[kind])
+            ids[kind].remove(rec_id)
+            svc.delete(kind, rec_id)
+    return ids
+
+# ---- KPIs ----
+def test_kpi_store_incremental_matches_rebuild(service):
+    _random_history(service)
+    kpis = part2.get_kpi_store()
+    fresh = part2.KpiStore(state_file="fresh.json")
+    fresh.rebuild()
+    for kind in ("purchase", "sale"):
+        assert fresh.total(kind) == kpis.total(kind)
+        assert fresh.latest_rows(kind) == kpis.latest_rows(kind)
+        recs = part2.load_json(part2.InventoryService.KINDS[kind][0])
+        assert kpis.total(kind) == round(sum(r["total"] for r in recs), 2)
+
+def test_kpi_rows_with_equal_date_and_id_never_compare_free_form_fields():
+    part2.ensure_files_exist()
+    legacy = [{"date": "2025-01-01", "invoice": None, "party": None, "total": 1},
+              {"date": "2025-01-01", "invoice": "L2", "party": "X", "total": 2}]
+    part2.save_json(part2.SALE_FILE, legacy * 20)
+    kpis = part2.get_kpi_store()
+    assert kpis.total("sale") == 60.0
+    assert len(kpis.latest_rows("sale")) == part2.KPI_LATEST
+
+# ---- dashboard snapshot ----
+def test_dashboard_snapshot_follows_every_write(service):
+    _random_history(service, steps=30)
+    snap = part2.load_dashboard_snapshot()
+    kpis = part2.get_kpi_store()
+    assert snap["cards"][:2] == [kpis.total("purchase"), kpis.total("sale")]
+    assert snap["sales"] == [list(r) for r in kpis.latest_rows("sale")]
+    with open(part2.DASHBOARD_SNAPSHOT_FILE, "w", encoding="utf-8") as f:
+        f.write('{"version": 1, "ca')
+    assert part2.load_dashboard_snapshot() is None
+
+# ---- rollups ----
+def test_rollups_incremental_match_rebuild_and_a_scan(service):
+    _random_history(service)
+    rollups = part2.get_rollup_store()
+    fresh = part2.RollupStore(state_file="fresh.json")
+    fresh.rebuild()
+    for kind in ("purchase", "sale"):
+        for dim in part2.ROLLUP_DIMS:
+            assert fresh.query(kind, dim, "2000-01-01", "2099-12-31") == \
+                rollups.query(kind, dim, "2000-01-01", "2099-12-31")
+    sales = [r for r in part2.load_json(part2.SALE_FILE) if r["date"][:7] == "2026-03"]
+    qty = sum(p["qty"] for r in sales for p in r["products"])
+    assert abs(rollups.period_totals("sale", "2026-03-01", "2026-03-31")["qty"] - qty) < 0.001
+
+def test_rollups_reload_from_state_and_delta_file(service):
+    _random_history(service, steps=30)
+    rollups = part2.get_rollup_store()
+    assert rollups.delta_lines > 0
+    reloaded = part2.RollupStore()
+    assert reloaded.query("sale", "party", "2000-01-01", "2099-12-31") == \
+        rollups.query("sale", "party", "2000-01-01", "2099-12-31")
+    assert reloaded.rebuilds == 0
+
+def test_rollups_rebuild_after_a_torn_delta_line(service):
+    _random_history(service, steps=30)
+    expected = part2.get_rollup_store().query("purchase", "product", "2000-01-01", "2099-12-31")
+    with open(part2.get_rollup_store().delta_file, "a", encoding="utf-8") as f:
+        f.write('{"seq": 99, "se')
+    reloaded = part2.RollupStore()
+    assert reloaded.query("purchase", "product", "2000-01-01", "2099-12-31") == expected
+    assert reloaded.rebuilds == 1
+
+# ---- cost engine ----
+def test_cost_engine_incremental_matches_rebuild(service):
+    ids = _random_history(service)
+    engine = part2.get_cost_engine()
+    fresh = part2.CostEngine(state_file="fresh.json")
+    fresh.rebuild()
+    assert fresh.totals() == engine.totals()
+    assert fresh.valuation() == engine.valuation()
+    for sale_id in ids["sale"]:
+        assert fresh.sale_margin(sale_id) == engine.sale_margin(sale_id)
+
+def test_cost_engine_reloads_state_without_rebuilding(service):
+    ids = _random_history(service, steps=30)
+    engine = part2.get_cost_engine()
+    reloaded = part2.CostEngine()
+    assert reloaded.totals() == engine.totals()
+    assert [reloaded.sale_margin(i) for i in ids["sale"]] == [engine.sale_margin(i) for i in ids["sale"]]
+    assert reloaded.rebuilds == 0
+
+def test_fully_discounted_purchase_costs_nothing(service):
+    service.create("purchase", {"party": "S"}, [part2.make_product_line("Free", qty=10, rate=50, discount_pct=100)])
+    sale = service.create("sale", {"party": "X"}, [part2.make_product_line("Free", qty=4, rate=20)])
+    margin = part2.get_cost_engine().sale_margin(sale["id"])
+    assert margin["revenue"] == 80.0
+    assert margin["fifo_cogs"] == margin["avg_cogs"] == 0.0
+
+# ---- record index ----
+def test_record_index_matches_the_history(service):
+    ids = _random_history(service)
+    for kind, fn in (("purchase", part2.PURCHASE_FILE), ("sale", part2.SALE_FILE)):
+        recs = part2.load_json(fn)
+        assert set(ids[kind]) <= {r["id"] for r in recs}
+        for rec in recs:
+            assert service.get(kind, rec_id=rec["id"]) == rec
+            assert service.get(kind, invoice=rec["invoice"]) == rec
+        assert service.get(kind, rec_id=10 ** 6) is None
+        assert service.get(kind, invoice="nope") is None
+
+def test_record_index_reloads_and_rebuilds_a_damaged_file(service):
+    _random_history(service, steps=30)
+    sale = part2.load_json(part2.SALE_FILE)[-1]
+    assert part2.RecordIndex().get("sale", rec_id=sale["id"]) == sale
+    with open("sale" + part2.RECORD_SUFFIX, "ab") as f:
+        f.write(b'{"id": ')
+    reloaded = part2.RecordIndex()
+    assert reloaded.get("sale", invoice=sale["invoice"]) == sale
+    assert reloaded.rebuilds == 1
+
+# ---- ledger ----
+def test_ledger_incremental_matches_full_rebuild(service):
+    _random_history(service)
+    incremental = part2.load_json(part2.LEDGER_FILE)
+    full = part2.recompute_ledger()
+    assert set(incremental) == set(full)
+    for party, ent in full.items():
+        for key in ("purchases", "sales", "last_amount"):
+            assert abs(incremental[party][key] - ent[key]) < 0.011, (party, key)
+        assert incremental[party]["transactions"] == ent["transactions"]
+
+def test_ledger_rebuilds_when_a_source_changed_outside_the_app(service):
+    _random_history(service, steps=30)
+    sales = part2.load_json(part2.SALE_FILE)
+    gone = sales.pop()
+    part2.save_json(part2.SALE_FILE, sales)
+    assert not part2._ledger_is_consistent("purchase")
+    service.create("purchase", {"party": "X"}, [part2.make_product_line("A", qty=1, rate=1)])
+    ledger = part2.load_json(part2.LEDGER_FILE)
+    expected = round(sum(r["total"] for r in sales if r["party"] == gone["party"]), 2)
+    assert abs(ledger[gone["party"]]["sales"] - expected) < 0.011
+    assert part2._ledger_is_consistent(None)
+
+# ---- search ----
+def test_search_index_matches_a_brute_force_scan(service):
+    _random_history(service, steps=30, seed=3)
+    sales = part2.load_json(part2.SALE_FILE)
+    sales[0]["phone"] = "98450 12345"
+    part2.save_json(part2.SALE_FILE, sales)
+    for term in ("", "S", "x", "98450", "98450 1", "a", "b", sales[-1]["invoice"], "nope"):
+        expected = [r for r in sales if term.lower() in part2.SearchIndex._text(r)]
+        assert part2.search_records(part2.SALE_FILE, term) == expected, term
+    assert part2.search_records(part2.SALE_FILE, "98450")[0]["id"] == sales[0]["id"]
+
+def test_search_index_is_rebuilt_after_a_write():
+    part2.ensure_files_exist()
+    assert part2.search_records(part2.PURCHASE_FILE, "acme") == []
+    rec = {"id": 1, "invoice": "P1", "party": "Acme Traders", "products": [{"product": "Widget"}]}
+    part2.insert_record(part2.PURCHASE_FILE, rec)
+    assert part2.search_records(part2.PURCHASE_FILE, "acme") == [rec]
+    assert part2.search_records(part2.PURCHASE_FILE, "widg") == [rec]
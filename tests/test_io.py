@@ -0,0 +1,70 @@
+import part2
+
+HEADER = "ref,date,party,product,qty,rate,tax_pct\n"
+
+def _csv(tmp_path, body, name="in.csv"):
+    path = tmp_path / name
+    path.write_text(HEADER + body, encoding="utf-8")
+    return str(path)
+
+# ---- CSV import ----
+def test_import_groups_rows_by_ref_and_saves_once(service, tmp_path):
+    path = _csv(tmp_path, "r1,2025-03-01,X,A,2,10,18\n"
+                          "r1,2025-03-01,X,B,1,5,0\n"
+                          ",05-03-2025,Y,C,3,1,0\n"
+                          ",,Z,C,1,1,0\n")
+    seen = []
+    report = part2.import_invoices_csv(path, "sale", sync=False, every=2,
+                                       progress=lambda rows, n: seen.append((rows, n)))
+    assert report["errors"] == []
+    assert [len(r["products"]) for r in report["records"]] == [2, 1, 1]
+    assert [r["date"][:10] for r in report["records"][:2]] == ["2025-03-01", "2025-03-05"]
+    assert seen[-1] == (4, 3)
+    assert [r["invoice"] for r in part2.load_json(part2.SALE_FILE)] == [r["invoice"] for r in report["records"]]
+    assert service.available_stock() == {"A": 998, "B": 999, "C": 996}
+    assert part2.load_json(part2.LEDGER_FILE)["X"]["sales"] == report["records"][0]["total"]
+
+def test_import_skips_and_reports_bad_invoices(service, tmp_path):
+    path = _csv(tmp_path, "r1,2025-03-01,X,A,2,10,0\n"
+                          "r1,2025-03-02,X,B,1,5,0\n"      # two dates in one invoice
+                          "r2,31-31-2025,X,A,1,1,0\n"      # bad date
+                          "r3,2025-03-01,,A,1,1,0\n"       # no party
+                          "r4,2025-03-01,X,A,,1,0\n"       # no qty
+                          "r5,2025-03-01,X,A,600,1,0\n"
+                          "r6,2025-03-01,X,A,600,1,0\n")   # stock already taken by r5
+    report = part2.import_invoices_csv(path, "sale", sync=False)
+    assert [line for line, _ in report["errors"]] == [2, 4, 5, 6, 8]
+    assert report["invoices"] == 1
+    assert service.available_stock()["A"] == 400
+
+def test_import_dry_run_writes_nothing(service, tmp_path):
+    path = _csv(tmp_path, "r1,2025-03-01,X,A,2,10,0\n")
+    report = part2.import_invoices_csv(path, "purchase", dry_run=True, sync=False)
+    assert report["invoices"] == 1 and report["records"] == []
+    assert len(part2.load_json(part2.PURCHASE_FILE)) == 1
+
+# ---- exports ----
+def test_export_lines_filtered_by_date_and_party(service, tmp_path):
+    service.create("sale", {"party": "X"}, [part2.make_product_line("A", qty=1, rate=2),
+                                           part2.make_product_line("B", qty=3, rate=4)],
+                   date="2025-03-01 10:00:00")
+    service.create("sale", {"party": "Y"}, [part2.make_product_line("C", qty=1, rate=1)],
+                   date="2025-04-01 10:00:00")
+    path = str(tmp_path / "sales.csv")
+    assert part2.export_report("sales", path, date_to="2025-03-31") == 2
+    with open(path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert lines[0] == ",".join(part2.INVOICE_LINE_EXPORT_FIELDS)
+    assert [l.split(",")[6] for l in lines[1:]] == ["A", "B"]
+    assert part2.export_report("sales", str(tmp_path / "y.csv"), party="Y") == 1
+
+def test_export_jsonl_gz_and_ledger(service, tmp_path):
+    import gzip
+    import json
+    service.create("sale", {"party": "X"}, [part2.make_product_line("A", qty=1, rate=2)])
+    path = str(tmp_path / "ledger.jsonl.gz")
+    assert part2.export_report("ledger", path) == 2      # Supplier's purchase + X's sale
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f]
+    assert [(r["party"], r["type"]) for r in rows] == [("Supplier", "Purchase"), ("X", "Sale")]
+    assert list(rows[0]) == list(part2.LEDGER_EXPORT_FIELDS)
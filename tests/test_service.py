@@ -0,0 +1,47 @@
+import pytest
+
+import part2
+
+def test_create_update_delete_keep_stock_and_ledger_in_step(service):
+    sale = service.create("sale", {"party": "X"}, [part2.make_product_line("A", qty=10, rate=3)])
+    assert service.available_stock()["A"] == 990
+    assert part2.load_json(part2.LEDGER_FILE)["X"]["sales"] == 30.0
+    service.update("sale", sale["id"], {}, [part2.make_product_line("A", qty=4, rate=3)])
+    assert service.available_stock()["A"] == 996
+    assert part2.load_json(part2.LEDGER_FILE)["X"]["sales"] == 12.0
+    assert service.delete("sale", sale["id"])["id"] == sale["id"]
+    assert service.available_stock()["A"] == 1000
+    assert part2.load_json(part2.LEDGER_FILE)["X"]["sales"] == 0.0
+
+def test_invoice_number_follows_the_claimed_id(service):
+    peeked, _ = service.peek_invoice("sale")
+    part2.get_sequences().allocate(part2.SALE_FILE)    # another window saved first
+    rec = service.create("sale", {"party": "X"}, [part2.make_product_line("A", qty=1, rate=1)])
+    assert rec["id"] == peeked + 1
+    assert rec["invoice"] == part2.next_invoice("S", part2.SALE_FILE, rec["id"])
+
+def test_unknown_ids_are_rejected(service):
+    with pytest.raises(ValueError):
+        service.delete("sale", 12345)
+    with pytest.raises(ValueError):
+        service.update("purchase", 12345, {}, [part2.make_product_line("A", qty=1, rate=1)])
+
+def test_sales_cannot_take_more_than_is_in_stock(service):
+    with pytest.raises(ValueError):
+        service.create("sale", {"party": "X"}, [part2.make_product_line("A", qty=1001, rate=1)])
+    with pytest.raises(ValueError):
+        service.create("sale", {"party": "X"}, [part2.make_product_line("Nope", qty=1, rate=1)])
+    sale = service.create("sale", {"party": "X"}, [part2.make_product_line("A", qty=600, rate=1)])
+    # the old sale's quantity is given back before the update is checked
+    service.update("sale", sale["id"], {}, [part2.make_product_line("A", qty=1000, rate=1)])
+    with pytest.raises(ValueError):
+        service.update("sale", sale["id"], {}, [part2.make_product_line("A", qty=1001, rate=1)])
+    assert part2.load_json(part2.SALE_FILE)[0]["products"][0]["qty"] == 1000
+
+def test_a_store_whose_update_fails_is_rebuilt(service, monkeypatch, capsys):
+    def broken(*args, **kwargs):
+        raise RuntimeError("disk full")
+    monkeypatch.setattr(part2, "update_stock", broken)
+    service.create("sale", {"party": "X"}, [part2.make_product_line("B", qty=5, rate=2)])
+    assert "stock: update after sale failed (disk full), rebuilding" in capsys.readouterr().err
+    assert {s["product"]: s["available"] for s in part2.load_json(part2.STOCK_FILE)}["B"] == 995
@@ -0,0 +1,26 @@
+import json
+import os
+import subprocess
+import sys
+
+import part2
+
+def test_module_import_leaves_reportlab_and_firebase_unloaded():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run([sys.executable, "-c", "import sys, part2; "
+                          "print(sorted(m for m in ('reportlab', 'firebase_admin') if m in sys.modules))"],
+                         cwd=root, capture_output=True, text=True, check=True).stdout
+    assert out.strip() == "[]"
+
+def test_startup_report_summarizes_logged_runs():
+    assert part2.startup_report() == "No startup runs logged yet."
+    with open(part2.STARTUP_LOG_FILE, "w", encoding="utf-8") as f:
+        for first_frame in (0.5, 0.3, 0.4):
+            f.write(json.dumps({"at": "2026-01-01 10:00:00", "frozen": False,
+                                "imports": 0.1, "first_frame": first_frame}) + "\n")
+        f.write('{"at": "torn')
+    report = part2.startup_report().splitlines()
+    assert report[0] == "3 runs, latest 2026-01-01 10:00:00"
+    assert report[2].split() == ["first_frame", "median", "0.400s", "latest", "0.400s"]
+    entry = part2.save_startup_report()
+    assert entry["frozen"] is False
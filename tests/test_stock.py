@@ -0,0 +1,69 @@
+import random
+
+import part2
+
+def _line(product, qty, rate):
+    sub, disc, tax, total = part2.calc_totals(qty, rate, 0, 12)
+    return {"product": product, "unit": "pcs", "qty": qty, "rate": rate, "discount_pct": 0,
+            "tax_pct": 12, "subtotal": sub, "discount_amt": disc, "tax_amt": tax, "total": total}
+
+def _record(rec_id, lines):
+    return {"id": rec_id, "invoice": f"I{rec_id:04d}", "date": "2025-01-02 10:00:00",
+            "party": "X", "products": lines, "total": round(sum(p["total"] for p in lines), 2)}
+
+def _write(kind, recs):
+    part2.save_json(part2.StockEngine.SOURCES[kind], recs)
+
+def _edit(files, rnd, next_id):
+    """One random add / update / delete; returns (kind, old, new) like the windows pass it."""
+    kind = rnd.choice(["purchase", "sale"])
+    recs = files[kind]
+    lines = [_line(rnd.choice("ABC"), rnd.randint(1, 9), rnd.randint(10, 50)) for _ in range(rnd.randint(1, 3))]
+    op = rnd.random()
+    if op < 0.6 or not recs:
+        new = _record(next_id, lines)
+        recs.append(new)
+        return kind, None, new
+    i = rnd.randrange(len(recs))
+    old = recs[i]
+    if op < 0.8:
+        recs[i] = new = dict(old, products=lines)
+        return kind, old, new
+    del recs[i]
+    return kind, old, None
+
+def _by_product(summary):
+    # row order follows when a product was first seen, which deltas can't reproduce
+    return {s["product"]: s for s in summary}
+
+def test_incremental_totals_match_rebuild():
+    part2.ensure_files_exist()
+    rnd = random.Random(1)
+    files = {"purchase": [], "sale": []}
+    for i in range(1, 120):
+        kind, old, new = _edit(files, rnd, i)
+        _write(kind, files[kind])
+        summary = part2.update_stock(kind, old=old, new=new)
+        assert _by_product(summary) == _by_product(part2.compute_stock_from_files())
+    # a rebuild only when a purchase that was some product's latest invoice goes away
+    assert part2.get_stock_engine().rebuilds < 10
+
+def test_saved_totals_are_reused_across_runs():
+    part2.ensure_files_exist()
+    _write("purchase", [_record(1, [_line("A", 5, 10)])])
+    part2.rebuild_stock()
+    engine = part2.StockEngine()
+    assert engine.summary() == part2.compute_stock_from_files()
+    assert engine.rebuilds == 0
+
+def test_file_changed_outside_the_engine_forces_rebuild():
+    part2.ensure_files_exist()
+    _write("purchase", [_record(1, [_line("A", 5, 10)])])
+    part2.rebuild_stock()
+    _write("sale", [_record(1, [_line("A", 2, 20)])])     # not reported to the engine
+    new = _record(2, [_line("B", 1, 10)])
+    _write("purchase", [_record(1, [_line("A", 5, 10)]), new])
+    summary = part2.update_stock("purchase", new=new)
+    assert part2.get_stock_engine().rebuilds == 2
+    assert summary == part2.compute_stock_from_files()
+    assert {s["product"]: s["available"] for s in summary}["A"] == 3
@@ -0,0 +1,253 @@
+import json
+import os
+
+import pytest
+
+import part2
+
+def _sale(i, total=100.0, **kw):
+    rec = {"id": i, "invoice": f"S{i:06d}", "date": "2025-01-02 10:00:00", "party": "X",
+           "products": [{"product": "A", "unit": "pcs", "qty": 1, "rate": total, "total": total}],
+           "total": total}
+    rec.update(kw)
+    return rec
+
+# ---- JSON journal ----
+def test_journal_is_replayed_on_load():
+    st = part2.JsonStorage(compact_every=1000)
+    st.ensure()
+    st.insert_record(part2.SALE_FILE, _sale(1))
+    st.insert_record(part2.SALE_FILE, _sale(2))
+    st.update_record(part2.SALE_FILE, _sale(1, total=5.0))
+    st.delete_record(part2.SALE_FILE, 2)
+    # the snapshot itself is untouched until compaction
+    with open(part2.SALE_FILE, encoding="utf-8") as f:
+        assert json.load(f) == []
+    assert part2.JsonStorage(compact_every=1000).load(part2.SALE_FILE) == [_sale(1, total=5.0)]
+
+def test_journal_ignores_torn_last_line():
+    st = part2.JsonStorage(compact_every=1000)
+    st.ensure()
+    st.insert_record(part2.SALE_FILE, _sale(1))
+    with open(st.journal_file, "a", encoding="utf-8") as f:
+        f.write('{"fn": "sale.json", "op": "ins')
+    assert part2.JsonStorage(compact_every=1000).load(part2.SALE_FILE) == [_sale(1)]
+
+def test_journal_compaction_folds_entries_into_snapshot():
+    st = part2.JsonStorage(compact_every=3)
+    st.ensure()
+    for i in range(1, 5):
+        st.insert_record(part2.SALE_FILE, _sale(i))
+    with open(part2.SALE_FILE, encoding="utf-8") as f:
+        assert [r["id"] for r in json.load(f)] == [1, 2, 3]
+    st.compact()
+    assert os.path.getsize(st.journal_file) == 0
+    assert [r["id"] for r in part2.JsonStorage().load(part2.SALE_FILE)] == [1, 2, 3, 4]
+
+def test_journal_keeps_private_copies_of_records():
+    st = part2.JsonStorage(compact_every=1000)
+    st.ensure()
+    rec = _sale(1)
+    st.insert_record(part2.SALE_FILE, rec)
+    rec["party"] = "changed after the write"
+    loaded = st.load(part2.SALE_FILE)
+    assert loaded == [_sale(1)]
+    loaded[0]["products"].clear()
+    st.compact()
+    assert part2.JsonStorage().load(part2.SALE_FILE) == [_sale(1)]
+
+def test_unreadable_history_file_raises_instead_of_loading_empty():
+    part2.ensure_files_exist()
+    with open(part2.SALE_FILE, "w", encoding="utf-8") as f:
+        f.write("[{")
+    with pytest.raises(part2.DataFileError):
+        part2.load_json(part2.SALE_FILE)
+    with open(part2.STOCK_FILE, "w", encoding="utf-8") as f:
+        f.write("[{")
+    assert part2.load_json(part2.STOCK_FILE) == []
+    os.remove(part2.SALE_FILE)
+    assert part2.load_json(part2.SALE_FILE) == []
+
+# ---- event log ----
+def test_event_log_materializes_from_log_and_snapshot():
+    st = part2.EventLogStorage(compact_every=1000)
+    st.ensure()
+    st.insert_record(part2.SALE_FILE, _sale(1))
+    st.insert_record(part2.SALE_FILE, _sale(2))
+    st.update_record(part2.SALE_FILE, _sale(2, total=7.0))
+    st.delete_record(part2.SALE_FILE, 1)
+    assert st.signature(part2.SALE_FILE) == ["eventlog", 4]
+    assert st.signature(part2.PURCHASE_FILE) == ["eventlog", 0]
+    assert [ev["op"] for ev in part2.iter_events(kind="sale")] == ["create", "create", "update", "delete"]
+
+    reopened = part2.EventLogStorage(compact_every=1000)
+    assert reopened.load(part2.SALE_FILE) == [_sale(2, total=7.0)]
+    reopened.compact()
+    assert list(part2.iter_events()) == []
+    assert part2.EventLogStorage().load(part2.SALE_FILE) == [_sale(2, total=7.0)]
+
+def test_event_log_save_appends_only_changes():
+    st = part2.EventLogStorage(compact_every=1000)
+    st.ensure()
+    st.save(part2.SALE_FILE, [_sale(1), _sale(2), _sale(3)])
+    st.save(part2.SALE_FILE, [_sale(1), _sale(3, total=1.0)])
+    ops = [(ev["op"], ev["id"]) for ev in part2.iter_events(since_seq=3)]
+    assert ops == [("update", 3), ("delete", 2)]
+
+# ---- columnar format ----
+def test_columnar_round_trip():
+    recs = [_sale(i, total=i * 1.5) for i in range(1, 50)]
+    recs[3]["notes"] = "ünïcode – ok"
+    recs[4]["paid"] = True
+    recs[5]["gst_no"] = None
+    recs[6]["products"] = []
+    recs[7]["id"] = 2 ** 40
+    assert part2.decode_invoices(part2.encode_invoices(recs)) == recs
+
+def test_convert_invoice_file_both_ways():
+    recs = [_sale(i) for i in range(1, 20)]
+    part2._atomic_write_json("sale.json", recs)
+    assert part2.convert_invoice_file("sale.json", "sale.col") == len(recs)
+    assert part2.read_columnar("sale.col") == recs
+    assert part2.convert_invoice_file("sale.col", "back.json") == len(recs)
+    with open("back.json", encoding="utf-8") as f:
+        assert json.load(f) == recs
+
+def test_columnar_storage_converts_existing_history():
+    part2.JsonStorage().ensure()
+    part2._atomic_write_json(part2.SALE_FILE, [_sale(1), _sale(2)])
+    st = part2.JsonStorage(compact_every=2, columnar=True)
+    st.ensure()
+    assert os.path.exists("sale.col")
+    st.insert_record(part2.SALE_FILE, _sale(3))
+    st.insert_record(part2.SALE_FILE, _sale(4))     # compacts into sale.col
+    assert part2.read_columnar("sale.col") == [_sale(i) for i in range(1, 5)]
+    with open(part2.STOCK_FILE, encoding="utf-8") as f:
+        assert json.load(f) == []
+
+# ---- Cache ----
+def test_repository_hands_out_private_copies():
+    part2.save_json(part2.SALE_FILE, [_sale(1)])
+    part2.get_repository().invalidate()
+    first = part2.load_json(part2.SALE_FILE)     # miss
+    first[0]["party"] = "changed"
+    second = part2.load_json(part2.SALE_FILE)    # hit
+    assert second == [_sale(1)]
+    second[0]["products"].clear()
+    assert part2.load_json(part2.SALE_FILE) == [_sale(1)]
+    assert part2.get_repository().stats()["hits"] == 2
+
+def test_repository_record_writes_patch_the_cache():
+    rec = _sale(1)
+    part2.save_json(part2.SALE_FILE, [])
+    part2.insert_record(part2.SALE_FILE, rec)
+    rec["party"] = "changed"                      # the caller's dict is not kept
+    part2.update_record(part2.SALE_FILE, _sale(1, total=5.0))
+    assert part2.load_json(part2.SALE_FILE) == [_sale(1, total=5.0)]
+    part2.get_repository().invalidate()
+    assert part2.load_json(part2.SALE_FILE) == [_sale(1, total=5.0)]
+
+def test_repository_reloads_after_an_outside_change():
+    part2.save_json(part2.SALE_FILE, [_sale(1)])
+    part2.load_json(part2.SALE_FILE)
+    part2.JsonStorage().save(part2.SALE_FILE, [_sale(1), _sale(2)])   # another process
+    assert part2.load_json(part2.SALE_FILE) == [_sale(1), _sale(2)]
+
+# ---- record model ----
+def test_invoice_records_round_trip_losslessly():
+    recs = [_sale(1), _sale(2, paid=True, gst_no=None),
+            {"total": 8.0, "party": "Y", "id": 3, "invoice": "S000003", "product": "B", "qty": "2"},
+            dict(_sale(4), products=[dict(_sale(4)["products"][0], batch={"no": "B1"})])]
+    for rec in recs:
+        back = part2.Invoice.from_dict(rec).to_dict()
+        assert back == rec and list(back) == list(rec)
+    back = part2.Invoice.from_dict(recs[3]).to_dict()
+    back["products"][0]["batch"]["no"] = "changed"
+    assert recs[3]["products"][0]["batch"]["no"] == "B1"
+    txn = {"date": "d", "type": "Sale", "invoice": "S000001", "credit": None, "debit": "", "remaining": 5}
+    assert part2.LedgerTxn.from_dict(txn).to_dict() == txn
+
+def test_repository_caches_invoices_as_records():
+    part2.save_json(part2.SALE_FILE, [_sale(1), _sale(2)])
+    part2.get_repository().invalidate()
+    assert part2.load_json(part2.SALE_FILE) == [_sale(1), _sale(2)]      # miss
+    part2.update_record(part2.SALE_FILE, _sale(2, total=5.0))
+    shared = part2.get_repository().load_invoices(part2.SALE_FILE)
+    assert [type(r) for r in shared] == [part2.Invoice, part2.Invoice]
+    assert shared[1].total == 5.0
+    loaded = part2.load_json(part2.SALE_FILE)                          # hit
+    loaded[0]["products"][0]["qty"] = 99
+    assert part2.load_json(part2.SALE_FILE) == [_sale(1), _sale(2, total=5.0)]
+
+# ---- Sequences ----
+def test_sequences_seed_from_data_and_never_reuse_ids():
+    part2.save_json(part2.SALE_FILE, [_sale(1), _sale(7)])
+    seqs = part2.get_sequences()
+    assert seqs.peek(part2.SALE_FILE) == 8
+    assert seqs.allocate(part2.SALE_FILE) == 8
+    part2.save_json(part2.SALE_FILE, [_sale(1)])         # highest records deleted
+    assert part2.SequenceAllocator().allocate(part2.SALE_FILE) == 9   # read back from disk
+    assert part2.next_invoice("S", part2.SALE_FILE, 9).endswith("0009")
+
+def test_sequences_claim_rejects_an_id_already_handed_out():
+    part2.save_json(part2.PURCHASE_FILE, [])
+    seqs = part2.get_sequences()
+    peeked = seqs.peek(part2.PURCHASE_FILE)
+    seqs.allocate(part2.PURCHASE_FILE)                   # another window saved first
+    with pytest.raises(ValueError):
+        seqs.claim(part2.PURCHASE_FILE, peeked)
+    seqs.claim(part2.PURCHASE_FILE, peeked + 1)
+    assert seqs.peek(part2.PURCHASE_FILE) == peeked + 2
+
+# ---- SQLite ----
+def test_sqlite_round_trip():
+    db = part2.SqliteStorage("test.db")
+    legacy = {"id": 3, "invoice": "S000003", "party": "Y", "product": "B", "qty": 2, "total": 8.0}
+    sales = [_sale(1), _sale(2, party="Y"), legacy]
+    ledger = {"X": {"transactions": [{"date": "d", "type": "Sale", "invoice": "S000001", "credit": ""}],
+                    "purchases": 0.0, "sales": 100.0, "last_amount": 100.0}}
+    db.save(part2.SALE_FILE, sales)
+    db.save(part2.LEDGER_FILE, ledger)
+    db.save(part2.STOCK_FILE, [{"product": "A", "available": 1}])
+    assert db.load(part2.SALE_FILE) == sales
+    assert db.load(part2.LEDGER_FILE) == ledger
+    assert db.load(part2.STOCK_FILE) == [{"product": "A", "available": 1}]
+
+def test_sqlite_record_writes_keep_order_and_bump_signature():
+    db = part2.SqliteStorage("test.db")
+    db.save(part2.SALE_FILE, [_sale(1), _sale(2)])
+    sig = db.signature(part2.SALE_FILE)
+    db.update_record(part2.SALE_FILE, _sale(1, total=5.0))
+    db.insert_record(part2.SALE_FILE, _sale(3))
+    db.delete_record(part2.SALE_FILE, 2)
+    assert db.load(part2.SALE_FILE) == [_sale(1, total=5.0), _sale(3)]
+    assert db.signature(part2.SALE_FILE) == ["sqlite", sig[1] + 3]
+    assert db.signature(part2.PURCHASE_FILE) == ["sqlite", 0]
+
+def test_migrate_json_to_sqlite():
+    purchases = [dict(_sale(1), invoice="P000001", party="S")]
+    sales = [_sale(1), _sale(2, party="Y")]
+    ledger = {"X": {"transactions": [], "purchases": 0.0, "sales": 100.0, "last_amount": 100.0}}
+    for fn, data in ((part2.PURCHASE_FILE, purchases), (part2.SALE_FILE, sales),
+                     (part2.STOCK_FILE, []), (part2.LEDGER_FILE, ledger)):
+        part2.save_json(fn, data)
+
+    assert part2.migrate_json_to_sqlite("test.db") == 4
+    db = part2.SqliteStorage("test.db")
+    assert db.load(part2.PURCHASE_FILE) == purchases
+    assert db.load(part2.SALE_FILE) == sales
+    assert db.load(part2.LEDGER_FILE) == ledger
+    db.conn.close()
+    # already migrated
+    assert part2.migrate_json_to_sqlite("test.db") == 0
+
+def test_stock_engine_on_sqlite():
+    part2.set_storage(part2.SqliteStorage("test.db"))
+    part2.ensure_files_exist()
+    part2.insert_record(part2.PURCHASE_FILE, dict(_sale(1), products=[{"product": "A", "qty": 5, "rate": 2}]))
+    part2.rebuild_stock()
+    sale = dict(_sale(1), products=[{"product": "A", "qty": 2, "rate": 3}])
+    part2.insert_record(part2.SALE_FILE, sale)
+    summary = part2.update_stock("sale", new=sale)
+    assert {s["product"]: s["available"] for s in summary} == {"A": 3}
+    assert part2.get_stock_engine().rebuilds == 1
@@ -0,0 +1,131 @@
+import part2
+from tests.fakes import FakeRealtimeDatabase
+
+def _sales(n):
+    return [{"id": i, "invoice": f"S{i:06d}", "party": f"P{i % 3}", "total": float(i),
+             "products": [{"product": "A", "qty": 1, "total": float(i)}]} for i in range(1, n + 1)]
+
+def _stored(data):
+    """data the way the (fake) Realtime Database keeps it: lists become "0", "1", ... keys."""
+    return FakeRealtimeDatabase._normalize(data)
+
+def _synced(sales):
+    db = FakeRealtimeDatabase()
+    sync = part2.FirebaseSync(db, state_file=None)
+    sync.sync("sales", sales)
+    return db, sync
+
+def test_first_sync_sends_whole_collection_keyed_by_id():
+    sales = _sales(5)
+    db, _ = _synced(sales)
+    assert sorted(db.root["sales"]) == ["id_1", "id_2", "id_3", "id_4", "id_5"]
+    assert db.root == {"sales": _stored(part2.fb_keyed("sales", sales))}
+
+def test_edit_sends_only_the_changed_record():
+    sales = _sales(50)
+    db, sync = _synced(sales)
+    sales[20]["total"] = 1.5
+    assert sync.sync("sales", sales) == 1
+    assert sync.sync("sales", sales) == 0
+    assert db.root["sales"]["id_21"]["total"] == 1.5
+
+def test_insert_and_delete_do_not_shift_later_records():
+    sales = _sales(50)
+    db, sync = _synced(sales)
+    before = db.calls
+    del sales[10]
+    assert sync.sync("sales", sales) == 1
+    sales.insert(0, {"id": 51, "invoice": "S000051", "party": "P0", "total": 1.0, "products": []})
+    assert sync.sync("sales", sales) == 1
+    assert db.calls == before + 2
+    assert db.root["sales"] == _stored(part2.fb_keyed("sales", sales))
+
+def test_old_array_layout_is_replaced_once():
+    sales = _sales(5)
+    db = FakeRealtimeDatabase()
+    db.reference("sales").set(sales)   # written by a version that synced arrays
+    sync = part2.FirebaseSync(db, state_file="sync_state.json")
+    sync.synced = {"sales": part2.fb_fingerprint(sales, 2)}
+    sync.sync("sales", sales)
+    assert db.root["sales"] == _stored(part2.fb_keyed("sales", sales))
+    sales[0]["total"] = 9.0
+    assert part2.FirebaseSync(db, state_file="sync_state.json").sync("sales", sales) == 1
+
+def test_fingerprint_state_survives_restart():
+    sales = _sales(20)
+    db = FakeRealtimeDatabase()
+    part2.FirebaseSync(db, state_file="sync_state.json").sync("sales", sales)
+    sales[3]["party"] = "Changed"
+    again = part2.FirebaseSync(db, state_file="sync_state.json")
+    assert again.sync("sales", sales) == 1
+    assert db.root["sales"]["id_4"]["party"] == "Changed"
+
+def test_delta_matches_full_set():
+    sales = _sales(30)
+    db, sync = _synced(sales)
+    full = FakeRealtimeDatabase()
+    for i in (4, 9, 25):
+        sales[i]["products"].append({"product": "B", "qty": 2, "total": 3.0})
+        sync.sync("sales", sales)
+    full.reference("sales").set(part2.fb_keyed("sales", sales))
+    assert db.root == full.root
+
+def test_stock_and_ledger_keep_their_layout():
+    db = FakeRealtimeDatabase()
+    sync = part2.FirebaseSync(db, state_file=None)
+    sync.sync("stock", [{"product": "A", "available": 2}, {"product": "B", "available": 0}])
+    sync.sync("ledger", {"X": {"sales": 5.0, "transactions": []}})
+    assert db.root["stock"] == {"0": {"product": "A", "available": 2}, "1": {"product": "B", "available": 0}}
+    assert db.root["ledger"] == {"X": {"sales": 5.0}}
+
+def test_sync_many_is_one_update_call():
+    db = FakeRealtimeDatabase()
+    sync = part2.FirebaseSync(db, state_file=None)
+    sync.sync_many({"sales": _sales(3), "stock": [{"product": "A", "available": 2}]})
+    assert db.calls == 1
+    assert db.root["stock"] == {"0": {"product": "A", "available": 2}}
+
+def test_sync_queue_journal_resends_pending_collections():
+    part2.ensure_files_exist()
+    part2.save_json(part2.SALE_FILE, _sales(2))
+    db = FakeRealtimeDatabase()
+    q = part2.SyncQueue(part2.FirebaseSync(db, state_file=None))
+    q.put("sales", _sales(2))
+    q.put("sales", _sales(2))
+    assert q.depth() == 1
+    # app closed before the worker ran: the next start re-sends it
+    again = part2.SyncQueue(part2.FirebaseSync(db, state_file=None), batch_delay=0).start()
+    try:
+        for _ in range(200):
+            if again.depth() == 0 and db.calls:
+                break
+            again.stopping.wait(0.01)
+    finally:
+        again.stop()
+    assert db.root["sales"] == _stored(part2.fb_keyed("sales", _sales(2)))
+
+def test_sync_queue_retries_after_a_failure():
+    db = FakeRealtimeDatabase()
+    calls = []
+
+    class Flaky(part2.FirebaseSync):
+        def sync_many(self, collections):
+            calls.append(sorted(collections))
+            if len(calls) == 1:
+                raise ConnectionError("offline")
+            return super().sync_many(collections)
+
+    q = part2.SyncQueue(Flaky(db, state_file=None), batch_delay=0, max_backoff=0.05)
+    q.put("stock", [{"product": "A", "available": 1}])
+    q.start()
+    try:
+        for _ in range(300):
+            if q.depth() == 0:
+                break
+            q.stopping.wait(0.01)
+    finally:
+        q.stop()
+    results = q.poll()
+    assert [r[0] for r in results] == ["error", "ok"]
+    assert q.last_error is None and q.last_sync is not None
+    assert db.root["stock"] == {"0": {"product": "A", "available": 1}}